@@ -0,0 +1,440 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import functools
+import ipaddress
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+
+from asic_simulator import log
+from asic_simulator.clock import clock_from_conf
+from asic_simulator.fleet import Fleet, FleetManifest, MinerGroup, load_manifest
+from asic_simulator.fleet.manifest import MODES, MinerSpec
+from asic_simulator.limits import INTERFACES, AccessLimits
+from asic_simulator.network import NetworkProfile
+from asic_simulator.simulators import SIMULATOR_TYPES
+
+LOOPS = ("asyncio", "uvloop")
+# seconds workers get to stop, and write their checkpoints, after an interrupt
+SHUTDOWN_TIMEOUT = 10
+# seconds between checks that the workers are still alive while they start
+READY_POLL = 1
+
+
+def network_settings(value: str) -> dict:
+    """Parse comma separated NetworkProfile fields, like latency=0.2,reset=0.01."""
+    settings = {}
+    for item in value.split(","):
+        name, _, number = item.partition("=")
+        try:
+            settings[name.strip()] = float(number)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid network setting: {item!r}")
+    try:
+        NetworkProfile.from_dict(settings)
+    except (TypeError, ValueError) as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return settings
+
+
+def limit_settings(value: str) -> dict:
+    """Parse comma separated AccessLimits fields, like concurrency=1,overload=refuse."""
+    settings = {}
+    for item in value.split(","):
+        name, _, setting = item.partition("=")
+        name = name.strip()
+        if name == "overload":
+            settings[name] = setting.strip()
+            continue
+        try:
+            settings[name] = float(setting)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid limit setting: {item!r}")
+    try:
+        AccessLimits.from_dict(settings)
+    except (TypeError, ValueError) as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return settings
+
+
+def clock_setting(value: str) -> str:
+    try:
+        clock_from_conf(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="asic-simulator", description="Simulate a fleet of ASIC miners."
+    )
+    parser.add_argument(
+        "-m",
+        "--manifest",
+        help="fleet manifest (JSON or TOML), overrides --vendor etc.",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="reload the manifest when it changes, SIGHUP always does",
+    )
+    parser.add_argument("--vendor", default="antminer")
+    parser.add_argument("--firmware", default="stock")
+    parser.add_argument("--model", default="S19j")
+    parser.add_argument("-n", "--count", type=int, default=1)
+    parser.add_argument("--mode", choices=MODES, default="full")
+    parser.add_argument(
+        "--bind",
+        default="127.0.0.1",
+        help="first address to bind, incremented for each miner",
+    )
+    parser.add_argument("--rpc-port", type=int)
+    parser.add_argument("--web-port", type=int)
+    parser.add_argument("--http-port", type=int, help="whatsminer http redirect port")
+    parser.add_argument(
+        "--replay",
+        metavar="CORPUS",
+        help="answer with responses recorded in this corpus where it has them",
+    )
+    parser.add_argument(
+        "--stratum",
+        action="store_true",
+        help="connect to the miners' pools and submit shares, for every group",
+    )
+    parser.add_argument(
+        "--network",
+        type=network_settings,
+        metavar="SETTINGS",
+        help="degrade every group's network, e.g. latency=0.2,jitter=0.05,reset=0.01",
+    )
+    for interface in INTERFACES:
+        parser.add_argument(
+            f"--{interface}-limits",
+            type=limit_settings,
+            metavar="SETTINGS",
+            help=f"limit every miner's {interface} server, e.g. "
+            "concurrency=1,rate=5,overload=queue",
+        )
+    parser.add_argument(
+        "--checkpoint",
+        metavar="PATH",
+        help="save the fleet state here when stopping and every --checkpoint-interval",
+    )
+    parser.add_argument(
+        "--checkpoint-interval",
+        type=float,
+        metavar="SECONDS",
+        default=300,
+        help="seconds between checkpoints, 0 to only save when stopping",
+    )
+    parser.add_argument(
+        "--restore",
+        action="store_true",
+        help="start miners with the state saved in --checkpoint, if there is one",
+    )
+    parser.add_argument(
+        "--clock",
+        type=clock_setting,
+        help="the miners' time: real, manual (stepped with the admin api's "
+        "/clock/advance) or a speed like 60x",
+    )
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument(
+        "--admin-port",
+        type=int,
+        help="serve the admin api (metrics) locally, one port per worker from here",
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=1, help="processes to split miners over"
+    )
+    parser.add_argument("--loop", choices=LOOPS, default="asyncio")
+    parser.add_argument(
+        "--log-level",
+        default="INFO",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL", "OFF"],
+    )
+    parser.add_argument(
+        "--log-rate",
+        type=float,
+        help="messages per second written for each category (RPC, WEB, ...)",
+    )
+    parser.add_argument(
+        "--log-sync",
+        action="store_true",
+        help="write logs on the event loop instead of a background thread",
+    )
+    return parser.parse_args(argv)
+
+
+def log_config(args: argparse.Namespace) -> dict:
+    off = args.log_level == "OFF"
+    return {
+        "level": None if off else args.log_level,
+        "enabled": not off,
+        "background": not args.log_sync,
+        "rate": args.log_rate,
+    }
+
+
+def build_manifest(args: argparse.Namespace) -> FleetManifest:
+    if args.manifest is not None:
+        manifest = load_manifest(args.manifest)
+    else:
+        ports = {}
+        if args.rpc_port is not None:
+            ports["rpc"] = args.rpc_port
+        if args.web_port is not None:
+            ports["web"] = args.web_port
+        if args.http_port is not None:
+            ports["http"] = args.http_port
+        manifest = FleetManifest(
+            groups=[
+                MinerGroup(
+                    vendor=args.vendor,
+                    firmware=args.firmware,
+                    model=args.model,
+                    address=args.bind,
+                    count=args.count,
+                    mode=args.mode,
+                    ports=ports,
+                    replay=args.replay is not None,
+                    stratum=args.stratum,
+                )
+            ],
+            batch_size=args.batch_size,
+        )
+    if args.replay is not None:
+        manifest.corpus = args.replay
+    if args.stratum:
+        for group in manifest.groups:
+            group.stratum = True
+    if args.network is not None:
+        for group in manifest.groups:
+            group.network = {**(group.network or {}), **args.network}
+    for interface in INTERFACES:
+        settings = getattr(args, f"{interface}_limits")
+        if settings is None:
+            continue
+        for group in manifest.groups:
+            limits = dict(group.limits or {})
+            limits[interface] = {**limits.get(interface, {}), **settings}
+            group.limits = limits
+    if args.seed is not None:
+        manifest.seed = args.seed
+    if args.clock is not None:
+        manifest.clock = args.clock
+    if args.admin_port is not None:
+        manifest.admin_port = args.admin_port
+    return manifest
+
+
+def listen_ports(spec: MinerSpec) -> dict[str, int]:
+    """The ports a miner actually listens on, with the vendor defaults filled in."""
+    simulator_type = SIMULATOR_TYPES.get(spec.vendor)
+    ports = {**getattr(simulator_type, "PORTS", {}), **spec.ports}
+    if spec.mode == "rpc":
+        return {"rpc": ports.get("rpc", 4028)}
+    return ports
+
+
+def address_map(specs: list[MinerSpec]) -> list[str]:
+    """Summarize miners as address ranges, one line per run of similar miners."""
+    lines = []
+    run: list[MinerSpec] = []
+
+    def flush():
+        if not run:
+            return
+        first, last = run[0], run[-1]
+        hosts = first.host if len(run) == 1 else f"{first.host}-{last.host}"
+        ports = " ".join(f"{k}:{v}" for k, v in listen_ports(first).items())
+        lines.append(
+            f"{hosts} ({len(run)}) {first.vendor} {first.model} "
+            f"[{first.mode}] {ports}".rstrip()
+        )
+
+    for spec in specs:
+        if run and (
+            (spec.vendor, spec.model, spec.mode, spec.ports)
+            != (run[-1].vendor, run[-1].model, run[-1].mode, run[-1].ports)
+            or ipaddress.ip_address(spec.host) != ipaddress.ip_address(run[-1].host) + 1
+        ):
+            flush()
+            run = []
+        run.append(spec)
+    flush()
+    return lines
+
+
+def print_ready(manifest: FleetManifest, specs: list[MinerSpec], workers: int):
+    """Print where the miners and admin api listen, no matter the log level."""
+    print("\n".join(address_map(specs)), file=sys.stderr)
+    if manifest.admin_port is not None:
+        last = manifest.admin_port + workers - 1
+        ports = manifest.admin_port if workers == 1 else f"{manifest.admin_port}-{last}"
+        print(f"admin api on 127.0.0.1:{ports}", file=sys.stderr)
+
+
+def wait_ready(
+    ready: multiprocessing.Queue, processes: list[multiprocessing.Process]
+) -> int:
+    """Wait for every worker to start its miners.
+
+    Returns:
+        The number of miners started.
+
+    Raises:
+        SystemExit: If a worker failed or exited before starting.
+    """
+    started = 0
+    pending = len(processes)
+    while pending:
+        try:
+            message = ready.get(timeout=READY_POLL)
+        except queue.Empty:
+            for i, process in enumerate(processes):
+                if process.exitcode is not None:
+                    raise SystemExit(
+                        f"worker {i} exited with code {process.exitcode} "
+                        "before starting its miners"
+                    )
+            continue
+        if isinstance(message, str):
+            # a worker's error
+            raise SystemExit(message)
+        started += message
+        pending -= 1
+    return started
+
+
+def _new_event_loop(loop: str) -> asyncio.AbstractEventLoop:
+    if loop == "uvloop":
+        try:
+            import uvloop
+        except ImportError:
+            raise SystemExit("uvloop is not installed, use --loop asyncio")
+        return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+
+def run_worker(
+    manifest: FleetManifest,
+    specs: list[MinerSpec],
+    args: argparse.Namespace,
+    ready: multiprocessing.Queue = None,
+    worker: int = 0,
+    workers: int = 1,
+):
+    log.configure(**log_config(args))
+    fleet = Fleet(
+        manifest,
+        path=args.manifest,
+        worker=worker,
+        workers=workers,
+        checkpoint=args.checkpoint,
+    )
+    admin_port = None
+    if manifest.admin_port is not None:
+        admin_port = manifest.admin_port + worker
+    if ready is not None:
+        on_ready = functools.partial(ready.put, len(specs))
+    else:
+        on_ready = functools.partial(print_ready, manifest, specs, workers)
+
+    event_loop = _new_event_loop(args.loop)
+    try:
+        event_loop.run_until_complete(
+            fleet.serve(
+                specs,
+                admin_port=admin_port,
+                on_ready=on_ready,
+                watch=args.watch,
+                restore=args.restore,
+                checkpoint_interval=args.checkpoint_interval,
+            )
+        )
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        # cancelled by the fleet's signal handlers, after stopping cleanly
+        pass
+    except Exception as e:
+        if ready is not None:
+            # the main process is waiting for this worker to start
+            ready.put(f"worker {worker} failed: {e!r}")
+        raise
+    finally:
+        event_loop.close()
+
+
+def main(argv: list[str] = None):
+    args = parse_args(argv)
+    try:
+        manifest = build_manifest(args)
+        specs = manifest.specs()
+        for spec in specs:
+            Fleet.check_spec(spec, manifest.corpus)
+    except (OSError, ValueError, TypeError) as e:
+        raise SystemExit(f"Invalid fleet: {e}")
+    if args.watch and args.manifest is None:
+        raise SystemExit("--watch needs a --manifest")
+    if args.restore and args.checkpoint is None:
+        raise SystemExit("--restore needs a --checkpoint")
+    workers = max(1, min(args.workers, len(specs)))
+
+    if workers == 1:
+        run_worker(manifest, specs, args)
+        return
+
+    ready = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=run_worker,
+            # contiguous slices keep each worker's addresses together
+            args=(
+                manifest,
+                specs[i * len(specs) // workers : (i + 1) * len(specs) // workers],
+                args,
+                ready,
+                i,
+                workers,
+            ),
+            daemon=True,
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    if hasattr(signal, "SIGHUP"):
+        # every worker reloads its share of the fleet
+        signal.signal(
+            signal.SIGHUP,
+            lambda *_: [os.kill(p.pid, signal.SIGHUP) for p in processes],
+        )
+    # configured after forking, the workers start their own logging threads
+    log.configure(**log_config(args))
+    try:
+        started = wait_ready(ready, processes)
+        print_ready(manifest, specs, workers)
+        log.startup(f"{started} miners ready across {workers} workers")
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # workers stop cleanly on SIGTERM, writing their checkpoints
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join(SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                process.kill()
+
+
+if __name__ == "__main__":
+    main()
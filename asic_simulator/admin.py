@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import json
+from typing import Awaitable, Callable, TYPE_CHECKING
+
+import hypercorn
+from fastapi import APIRouter, FastAPI, HTTPException
+from fastapi.requests import Request
+from fastapi.responses import PlainTextResponse
+from hypercorn.asyncio import serve
+
+from asic_simulator import log
+from asic_simulator.metrics import METRICS
+from asic_simulator.profiling import Profiler, ProfilingError
+
+if TYPE_CHECKING:
+    from asic_simulator.fleet import Fleet
+
+ADMIN_PORT = 9400
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class AdminHandler:
+    """Local admin API of a fleet process, not part of any simulated miner."""
+
+    def __init__(self, fleet: Fleet = None):
+        self.fleet = fleet
+        self.profiler = Profiler()
+        self.router = APIRouter()
+        self.router.add_api_route("/metrics", self.metrics, methods=["GET"])
+        self.router.add_api_route("/profile", self.profile_status, methods=["GET"])
+        self.router.add_api_route(
+            "/profile/start", self.profile_start, methods=["POST"]
+        )
+        self.router.add_api_route("/profile/stop", self.profile_stop, methods=["POST"])
+        self.router.add_api_route(
+            "/fleet/control", self.fleet_control, methods=["POST"]
+        )
+        self.router.add_api_route("/fleet/reload", self.fleet_reload, methods=["POST"])
+        self.router.add_api_route(
+            "/fleet/checkpoint", self.fleet_checkpoint, methods=["POST"]
+        )
+        self.router.add_api_route("/clock", self.clock, methods=["GET"])
+        self.router.add_api_route(
+            "/clock/advance", self.clock_advance, methods=["POST"]
+        )
+
+    async def run(
+        self,
+        host: str = "127.0.0.1",
+        port: int = ADMIN_PORT,
+        shutdown_trigger: Callable[[], Awaitable[None]] = None,
+    ):
+        app = FastAPI()
+        app.include_router(self.router)
+        cfg = hypercorn.Config()
+        cfg.bind = f"{host}:{port}"
+
+        cfg.loglevel = "ERROR"
+
+        await serve(app, cfg, shutdown_trigger=shutdown_trigger)
+
+    def metrics(self):
+        return PlainTextResponse(
+            METRICS.render(), headers={"Content-Type": PROMETHEUS_CONTENT_TYPE}
+        )
+
+    def profile_status(self):
+        return self.profiler.status()
+
+    async def profile_start(self, kind: str = "cprofile", duration: float = None):
+        try:
+            self.profiler.start(kind, duration)
+        except ProfilingError as e:
+            raise HTTPException(409, str(e))
+        return self.profiler.status()
+
+    async def profile_stop(self):
+        try:
+            return {"path": self.profiler.stop()}
+        except ProfilingError as e:
+            raise HTTPException(409, str(e))
+
+    async def fleet_control(self, request: Request):
+        if self.fleet is None:
+            raise HTTPException(404, "Not running a fleet")
+        try:
+            req_data = json.loads(await request.body())
+            changed = self.fleet.control(
+                req_data.get("selector", {}), req_data.get("mutations", [])
+            )
+        except (ValueError, AttributeError, TypeError) as e:
+            log.failure("ADMIN", "fleet control: %s", e)
+            raise HTTPException(400, str(e))
+        log.success("ADMIN", "fleet control changed %s miners", changed)
+        return {"changed": changed}
+
+    async def fleet_reload(self, request: Request):
+        """Reload from a manifest in the body, or the fleet's file if it's empty."""
+        # the fleet package imports this module
+        from asic_simulator.fleet.manifest import FleetManifest
+
+        if self.fleet is None:
+            raise HTTPException(404, "Not running a fleet")
+        if self.fleet.workers > 1:
+            # this worker only has its share of the miners, the others would
+            # keep the old manifest
+            raise HTTPException(
+                409, "The fleet runs on several workers, send SIGHUP to reload it"
+            )
+        try:
+            body = await request.body()
+            if body:
+                diff = await self.fleet.reload(
+                    FleetManifest.from_dict(json.loads(body))
+                )
+            else:
+                diff = await self.fleet.reload_file()
+        except (OSError, ValueError, AttributeError, TypeError, RuntimeError) as e:
+            log.failure("ADMIN", "fleet reload: %s", e)
+            raise HTTPException(400, str(e))
+        return diff.summary()
+
+    async def fleet_checkpoint(self, path: str = None):
+        """Save the fleet's state, to the `--checkpoint` file unless given a path."""
+        if self.fleet is None:
+            raise HTTPException(404, "Not running a fleet")
+        try:
+            path, miners, size = await self.fleet.checkpoint(path)
+        except (OSError, ValueError) as e:
+            log.failure("ADMIN", "fleet checkpoint: %s", e)
+            raise HTTPException(400, str(e))
+        return {"path": path, "miners": miners, "bytes": size}
+
+    def clock(self):
+        if self.fleet is None:
+            raise HTTPException(404, "Not running a fleet")
+        clock = self.fleet.clock
+        return {"now": clock.now(), "speed": clock.speed}
+
+    def clock_advance(self, seconds: float):
+        """Step a manual clock, running the events due on the way."""
+        if self.fleet is None:
+            raise HTTPException(404, "Not running a fleet")
+        if seconds < 0:
+            raise HTTPException(400, "The clock can't go backwards")
+        try:
+            ran = self.fleet.advance_clock(seconds)
+        except ValueError as e:
+            raise HTTPException(409, str(e))
+        return {"now": self.fleet.clock.now(), "events": ran}
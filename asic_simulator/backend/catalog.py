@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import csv
+import os
+
+from asic_simulator.backend.data import BoardInfo, FanInfo, MinerInfo
+from asic_simulator.backend.data.hashrate import HashUnit, Hashrate
+
+CATALOG_FILE = os.path.join(os.path.dirname(__file__), "models.csv")
+
+
+def load_catalog(
+    path: str = CATALOG_FILE,
+) -> dict[str, dict[str, dict[str, MinerInfo]]]:
+    """Load the model table into {vendor: {firmware: {model: MinerInfo}}}.
+
+    Each model gets one MinerInfo, shared by every miner of that model, and
+    identical board and fan definitions are shared between models too.
+    """
+    catalog = {}
+    boards: dict[tuple, BoardInfo] = {}
+    fans: dict[int, FanInfo] = {}
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            chips = int(row["chips"])
+            hashrate = float(row["board_hashrate"])
+            unit = HashUnit[row["unit"]]
+            board_key = (chips, hashrate, unit)
+            if board_key not in boards:
+                boards[board_key] = BoardInfo(
+                    ideal_chips=chips,
+                    chips=chips,
+                    ideal_hashrate=Hashrate(hashrate, unit),
+                    hashrate=Hashrate(hashrate, unit),
+                )
+            fan_speed = int(row["fan_max_speed"])
+            if fan_speed not in fans:
+                fans[fan_speed] = FanInfo(max_speed=fan_speed)
+            catalog.setdefault(row["vendor"], {}).setdefault(row["firmware"], {})[
+                row["model"]
+            ] = MinerInfo(
+                make=row["make"],
+                model=row["model"],
+                board_count=int(row["board_count"]),
+                board_info=boards[board_key],
+                fan_count=int(row["fan_count"]),
+                fan_info=fans[fan_speed],
+            )
+    return catalog
@@ -0,0 +1,406 @@
+"""Checkpoints of simulated miner state, stored by column.
+
+Every piece of state is one array with the value of each miner (or board or
+fan), so thousands of miners are written and read with one `tobytes` and
+`frombytes` per column rather than one pickle per object.
+
+    magic    b"ASICCKP1"
+    u32      length of the header
+    header   JSON, the miner keys, distinct pool lists, and for each column
+             its typecode, offset and length
+    columns  the raw arrays
+
+Columns are looked up by name and missing ones leave that part of the freshly
+built state alone, so checkpoints written by an older version restore what
+they have.  Miners are matched by key, and only restored if they still have
+the same number of boards and fans.
+
+Uptime, averages and pending faults carry on as if the miners had kept running
+while the simulator was down.  Under a virtual clock the checkpoint has the
+clock's time too, for the clock to resume from.
+"""
+from __future__ import annotations
+
+import array
+import itertools
+import json
+import math
+import os
+import struct
+import sys
+import time
+from typing import Iterable
+
+from asic_simulator.backend.data import (
+    CHANGE_RESTORE,
+    Hashrate,
+    HashUnit,
+    MinerSimulatorBackend,
+    PoolInfo,
+)
+from asic_simulator.backend.data.averages import AVERAGE_WINDOWS
+from asic_simulator.backend.faults import FAULT_KINDS, FaultScheduler
+from asic_simulator.clock import REAL_CLOCK, Clock
+
+MAGIC = b"ASICCKP1"
+FORMAT_VERSION = 1
+_LENGTH = struct.Struct("<I")
+
+# pending fault events
+_NONE, _FAILURE, _RECOVERY = 0, 1, 2
+
+MINER_COLUMNS = {
+    "init_time": "q",
+    "uptime_offset": "q",
+    "light": "b",
+    "mining": "b",
+    "overheated": "b",
+    "fan_manual": "b",
+    "fan_speed": "d",
+    "env_temp": "d",
+    "last_tick": "d",
+    "board_count": "i",
+    "fan_count": "i",
+    "pools": "i",
+    **{
+        f"fault_{kind}_{column}": typecode
+        for kind in FAULT_KINDS
+        for column, typecode in (
+            ("event", "b"),
+            ("when", "d"),
+            ("target", "i"),
+            ("failures", "q"),
+            ("recoveries", "q"),
+        )
+    },
+}
+BOARD_COLUMNS = {
+    "board_working": "b",
+    # -1 for all of them
+    "board_chips": "i",
+    # in H/s, nan if not overridden
+    "board_hashrate": "d",
+    "board_multiplier": "d",
+    "board_temp": "d",
+    "chip_temp": "d",
+    **{f"board_avg_{window}": "d" for window in AVERAGE_WINDOWS},
+    "board_avg_total": "d",
+    "board_avg_start": "d",
+    "board_avg_last": "d",
+}
+FAN_COLUMNS = {"fan_working": "b"}
+COLUMNS = {**MINER_COLUMNS, **BOARD_COLUMNS, **FAN_COLUMNS}
+
+# (attribute, column, conversion) restored as is
+_MINER_ATTRS = (
+    ("init_time", "init_time", None),
+    ("uptime_offset", "uptime_offset", None),
+    ("_light", "light", bool),
+    ("_mining", "mining", bool),
+    ("overheated", "overheated", bool),
+    ("fan_manual", "fan_manual", bool),
+    ("fan_speed", "fan_speed", None),
+    ("_env_temp", "env_temp", None),
+)
+_BOARD_ATTRS = (
+    ("working", "board_working", bool),
+    ("_chips", "board_chips", lambda v: None if v < 0 else v),
+    (
+        "_hashrate",
+        "board_hashrate",
+        lambda v: None if math.isnan(v) else Hashrate(v, HashUnit.H),
+    ),
+    ("multiplier", "board_multiplier", None),
+    ("board_temp", "board_temp", None),
+    ("chip_temp", "chip_temp", None),
+)
+_AVERAGE_ATTRS = (
+    ("total", "board_avg_total", None),
+    ("start", "board_avg_start", None),
+    ("last", "board_avg_last", None),
+)
+_FAN_ATTRS = (("working", "fan_working", bool),)
+
+
+class CheckpointError(ValueError):
+    pass
+
+
+def _pools_row(pools: list[PoolInfo]) -> tuple:
+    return tuple((p.url, p.port, p.user, p.pwd, p.difficulty, p.alive) for p in pools)
+
+
+def _set(obj, attrs: list[tuple], index: int):
+    for attr, column, convert in attrs:
+        value = column[index]
+        setattr(obj, attr, convert(value) if convert is not None else value)
+
+
+class Checkpoint:
+    def __init__(
+        self,
+        keys: list[str],
+        pools: list[list],
+        columns: dict[str, array.array],
+        created: float = None,
+        clock_time: float = None,
+    ):
+        self.keys = keys
+        # distinct lists of pools, miners refer to them by index
+        self.pools = pools
+        self.columns = columns
+        self.created = created
+        # the miners' time when captured, only different from created under a
+        # virtual clock
+        self.clock_time = clock_time if clock_time is not None else created
+        self._rows = {key: i for i, key in enumerate(keys)}
+        # where each miner's boards and fans start in their columns
+        self._boards = list(
+            itertools.accumulate(columns.get("board_count", []), initial=0)
+        )
+        self._fans = list(itertools.accumulate(columns.get("fan_count", []), initial=0))
+        # only what this checkpoint has, resolved once rather than per miner
+        self._miner_attrs = self._present(_MINER_ATTRS)
+        self._board_attrs = self._present(_BOARD_ATTRS)
+        self._average_attrs = self._present(_AVERAGE_ATTRS)
+        self._fan_attrs = self._present(_FAN_ATTRS)
+        self._windows = [
+            (i, columns[f"board_avg_{window}"])
+            for i, window in enumerate(AVERAGE_WINDOWS)
+            if f"board_avg_{window}" in columns
+        ]
+
+    def _present(self, attrs: tuple) -> list[tuple]:
+        return [
+            (attr, self.columns[name], convert)
+            for attr, name, convert in attrs
+            if name in self.columns
+        ]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._rows
+
+    @classmethod
+    def capture(
+        cls,
+        miners: Iterable[tuple[str, MinerSimulatorBackend]],
+        faults: FaultScheduler = None,
+        clock: Clock = REAL_CLOCK,
+    ) -> Checkpoint:
+        values = {name: [] for name in COLUMNS}
+        keys = []
+        pools: dict[tuple, int] = {}
+        for key, backend in miners:
+            # bring averages and temperatures up to now first
+            backend.tick()
+            keys.append(key)
+            values["init_time"].append(backend.init_time)
+            values["uptime_offset"].append(backend.uptime_offset)
+            values["light"].append(backend._light)
+            values["mining"].append(backend._mining)
+            values["overheated"].append(backend.overheated)
+            values["fan_manual"].append(backend.fan_manual)
+            values["fan_speed"].append(backend.fan_speed)
+            values["env_temp"].append(backend._env_temp)
+            values["last_tick"].append(backend._last_tick)
+            values["board_count"].append(len(backend._boards))
+            values["fan_count"].append(len(backend._fans))
+            values["pools"].append(
+                pools.setdefault(_pools_row(backend._pools), len(pools))
+            )
+
+            pending, counts = faults.state(backend) if faults else ({}, {})
+            for kind in FAULT_KINDS:
+                recovering, when, target = pending.get(kind, (None, 0.0, None))
+                if recovering is None:
+                    event = _NONE
+                else:
+                    event = _RECOVERY if recovering else _FAILURE
+                values[f"fault_{kind}_event"].append(event)
+                values[f"fault_{kind}_when"].append(when)
+                values[f"fault_{kind}_target"].append(-1 if target is None else target)
+                values[f"fault_{kind}_failures"].append(counts.get(f"fault_{kind}", 0))
+                values[f"fault_{kind}_recoveries"].append(
+                    counts.get(f"recover_{kind}", 0)
+                )
+
+            for board, avg in zip(backend._boards, backend._hashrate_avgs):
+                values["board_working"].append(board.working)
+                values["board_chips"].append(
+                    -1 if board._chips is None else board._chips
+                )
+                values["board_hashrate"].append(
+                    math.nan
+                    if board._hashrate is None
+                    else float(board._hashrate.into(HashUnit.H))
+                )
+                values["board_multiplier"].append(board.multiplier)
+                values["board_temp"].append(board.board_temp)
+                values["chip_temp"].append(board.chip_temp)
+                for window, value in zip(AVERAGE_WINDOWS, avg.values):
+                    values[f"board_avg_{window}"].append(value)
+                values["board_avg_total"].append(avg.total)
+                values["board_avg_start"].append(avg.start)
+                values["board_avg_last"].append(avg.last)
+            for fan in backend._fans:
+                values["fan_working"].append(fan.working)
+
+        columns = {
+            name: array.array(COLUMNS[name], column) for name, column in values.items()
+        }
+        return cls(
+            keys,
+            [list(map(list, row)) for row in pools],
+            columns,
+            created=time.time(),
+            clock_time=clock.now(),
+        )
+
+    def write(self, path: str) -> int:
+        """Write the checkpoint, replacing the file atomically.
+
+        Returns:
+            The size of the file in bytes.
+        """
+        offset = 0
+        layout = {}
+        for name, column in self.columns.items():
+            size = len(column) * column.itemsize
+            layout[name] = [column.typecode, offset, size]
+            offset += size
+        header = json.dumps(
+            {
+                "version": FORMAT_VERSION,
+                "created": self.created,
+                "clock_time": self.clock_time,
+                "byteorder": sys.byteorder,
+                "keys": self.keys,
+                "pools": self.pools,
+                "columns": layout,
+            }
+        ).encode()
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(MAGIC + _LENGTH.pack(len(header)) + header)
+            for column in self.columns.values():
+                column.tofile(f)
+        # a crash while writing leaves the previous checkpoint in place
+        os.replace(tmp, path)
+        return len(MAGIC) + _LENGTH.size + len(header) + offset
+
+    @classmethod
+    def read(cls, path: str) -> Checkpoint:
+        with open(path, "rb") as f:
+            data = f.read()
+        start = len(MAGIC) + _LENGTH.size
+        if data[: len(MAGIC)] != MAGIC or len(data) < start:
+            raise CheckpointError(f"{path} is not a checkpoint")
+        (length,) = _LENGTH.unpack_from(data, len(MAGIC))
+        header = json.loads(data[start : start + length])
+        if header["version"] > FORMAT_VERSION:
+            raise CheckpointError(
+                f"{path} is from a newer version (format {header['version']})"
+            )
+        body = memoryview(data)[start + length :]
+        columns = {}
+        for name, (typecode, offset, size) in header["columns"].items():
+            if name not in COLUMNS:
+                continue
+            column = array.array(typecode)
+            column.frombytes(body[offset : offset + size])
+            if header["byteorder"] != sys.byteorder:
+                column.byteswap()
+            columns[name] = column
+        return cls(
+            header["keys"],
+            header["pools"],
+            columns,
+            header["created"],
+            header.get("clock_time"),
+        )
+
+    def _value(self, name: str, row: int, default=None):
+        column = self.columns.get(name)
+        return column[row] if column is not None else default
+
+    def restore(self, key: str, backend: MinerSimulatorBackend) -> bool:
+        """Restore a miner's backend state.
+
+        Returns:
+            Whether the miner was in the checkpoint and could be restored.
+        """
+        row = self._rows.get(key)
+        if row is None:
+            return False
+        boards = self._value("board_count", row)
+        fans = self._value("fan_count", row)
+        if boards != len(backend._boards) or fans != len(backend._fans):
+            return False
+
+        _set(backend, self._miner_attrs, row)
+        pools = self._value("pools", row)
+        if pools is not None:
+            backend._pools = [
+                PoolInfo(
+                    url=url,
+                    port=port,
+                    user=user,
+                    pwd=pwd,
+                    difficulty=difficulty,
+                    alive=alive,
+                )
+                for url, port, user, pwd, difficulty, alive in self.pools[pools]
+            ]
+
+        first = self._boards[row]
+        for i, (board, avg) in enumerate(zip(backend._boards, backend._hashrate_avgs)):
+            index = first + i
+            _set(board, self._board_attrs, index)
+            _set(avg, self._average_attrs, index)
+            for j, column in self._windows:
+                avg.values[j] = column[index]
+        first = self._fans[row]
+        for i, fan in enumerate(backend._fans):
+            _set(fan, self._fan_attrs, first + i)
+
+        last_tick = self._value("last_tick", row)
+        if last_tick is not None:
+            backend._last_tick = last_tick
+        backend._update_fans()
+        backend._update_boards()
+        # pick up the restored inputs without moving time forward
+        backend._refresh(backend._last_tick)
+        backend.notify(CHANGE_RESTORE)
+        return True
+
+    def restore_faults(
+        self,
+        key: str,
+        backend: MinerSimulatorBackend,
+        faults: FaultScheduler,
+        rates=None,
+    ) -> bool:
+        """Restore a miner's pending faults and random draws, after `restore`."""
+        row = self._rows.get(key)
+        if row is None or f"fault_{FAULT_KINDS[0]}_event" not in self.columns:
+            return False
+        pending = {}
+        counts = {}
+        for kind in FAULT_KINDS:
+            event = self._value(f"fault_{kind}_event", row, _NONE)
+            if event != _NONE:
+                target = self._value(f"fault_{kind}_target", row, -1)
+                pending[kind] = (
+                    event == _RECOVERY,
+                    self._value(f"fault_{kind}_when", row),
+                    None if target < 0 else target,
+                )
+            for field, column in (("fault", "failures"), ("recover", "recoveries")):
+                count = self._value(f"fault_{kind}_{column}", row, 0)
+                if count:
+                    counts[f"{field}_{kind}"] = count
+        faults.restore(backend, pending, counts, rates)
+        return True
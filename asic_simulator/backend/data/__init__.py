@@ -1,48 +1,255 @@
 from __future__ import annotations
 
-import datetime
+import dataclasses
+import itertools
+from typing import Callable
 
+from asic_simulator.backend.data.averages import (
+    AVERAGE_ALL,
+    AVERAGE_WINDOWS,
+    RollingHashrate,
+)
 from asic_simulator.backend.data.boards import BoardInfo, BoardSimulator
+from asic_simulator.backend.data.counters import ShareCounters, SubmittedShares
 from asic_simulator.backend.data.fans import FanSimulator, FanInfo
+from asic_simulator.backend.data.hashrate import Hashrate, HashUnit
 from asic_simulator.backend.data.miner import MinerInfo
 from asic_simulator.backend.data.pools import PoolInfo
+from asic_simulator.backend.data.rng import MinerRNG
+from asic_simulator.backend.data import thermal
+from asic_simulator.clock import REAL_CLOCK, Clock
+from asic_simulator.timers import TimerHandle, TimerQueue
+
+# names passed to subscribers when a part of the backend state changes
+CHANGE_POOLS = "pools"
+CHANGE_LIGHT = "light"
+CHANGE_MINING = "mining"
+CHANGE_FANS = "fans"
+CHANGE_BOARDS = "boards"
+CHANGE_REBOOT = "reboot"
+CHANGE_ENV = "env"
+CHANGE_OVERHEAT = "overheat"
+CHANGE_RESTORE = "restore"
+
+# ids for miners created without one, fleets should pass their own
+_miner_ids = itertools.count()
 
 
 class MinerSimulatorBackend:
     def __init__(
-        self, miner_info: MinerInfo = MinerInfo(), pools_info: list[PoolInfo] = None
+        self,
+        miner_info: MinerInfo = MinerInfo(),
+        pools_info: list[PoolInfo] = None,
+        miner_id: int = None,
+        seed: int = None,
+        clock: Clock = None,
+        timers: TimerQueue = None,
     ):
         self.miner_info = miner_info
-        self.pools = (
-            pools if pools_info is not None else [PoolInfo(), PoolInfo(), PoolInfo()]
+        # every time the miner reports or keeps track of comes from here
+        self.clock = clock if clock is not None else REAL_CLOCK
+        # where the overheat shutdown is scheduled, fleets share one queue and
+        # a lone miner's simulator runs its own
+        self.timers = timers if timers is not None else TimerQueue(self.clock)
+        self.miner_id = miner_id if miner_id is not None else next(_miner_ids)
+        self.rng = MinerRNG(self.miner_id, seed)
+        # miner_info is shared by every miner of the model, per miner state lives here
+        self.mac = (
+            self.miner_info.mac if self.miner_info.mac is not None else self.rng.mac()
         )
-        self.env_temp: float = 35
-        self.init_time = round(datetime.datetime.now().timestamp())
-        self.light = False
-        self.mining = True
+        self.fan_manual = self.miner_info.fan_manual
+        self.fan_speed = self.miner_info.fan_speed
+        # incremented on every change, so consumers can cheaply check staleness
+        self.version = 0
+        self._subscribers: list[Callable[[MinerSimulatorBackend, str], None]] = []
+        self._pools = (
+            pools_info
+            if pools_info is not None
+            else [PoolInfo(), PoolInfo(), PoolInfo()]
+        )
+        # shares submitted by pool index while a stratum client runs, None
+        # without one and the counters are derived from the hashrate
+        self.pool_shares: dict[int, SubmittedShares] | None = None
+        # the pool the stratum client has a session with
+        self.stratum_pool: int | None = None
+        self._env_temp: float = 35
+        self.init_time = round(self.clock.now())
+        # pretend the miner has been up for a while when the simulator starts
+        self.uptime_offset = 10000
+        self._light = False
+        self._mining = True
+        # why the miner stopped mining, until it's restarted
+        self.overheated = False
+        self._overheat_timer: TimerHandle | None = None
         self._fans = [
             FanSimulator(self.miner_info.fan_info)
             for _ in range(self.miner_info.fan_count)
         ]
         self._boards = [
-            BoardSimulator(self.miner_info.board_info)
-            for _ in range(self.miner_info.board_count)
+            BoardSimulator(
+                self.miner_info.board_info, serial=self.rng.serial("board", i)
+            )
+            for i in range(self.miner_info.board_count)
+        ]
+        self._update_fans()
+        self._update_boards()
+        now = self.clock.now()
+        self._last_tick = now
+        self._hashrate_avgs = [
+            RollingHashrate(self._board_rate(board), now, uptime=self.elapsed)
+            for board in self._boards
         ]
+        self._refresh(now)
 
-    @property
-    def boards(self) -> list[BoardInfo]:
-        return [self.miner_info.board_info for _ in range(self.miner_info.board_count)]
+    def subscribe(
+        self, callback: Callable[[MinerSimulatorBackend, str], None]
+    ) -> Callable[[], None]:
+        """Register a callback to be called with (backend, change) on every change.
+
+        Returns:
+            A function which removes the subscription when called.
+        """
+        self._subscribers.append(callback)
+
+        def unsubscribe():
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+        return unsubscribe
+
+    def notify(self, change: str):
+        self.version += 1
+        for callback in list(self._subscribers):
+            callback(self, change)
 
     @property
     def elapsed(self) -> int:
-        return 10000 + round(datetime.datetime.now().timestamp()) - self.init_time
+        return self.uptime_offset + round(self.clock.now()) - self.init_time
+
+    @property
+    def active_pool(self) -> int | None:
+        for i, pool in enumerate(self._pools):
+            if pool.active:
+                return i
+        return None
+
+    @property
+    def pools(self) -> list[PoolInfo]:
+        return self._pools
+
+    @pools.setter
+    def pools(self, val: list[PoolInfo]):
+        self._pools = val
+        if self.pool_shares is not None:
+            self.pool_shares = {}
+        self.notify(CHANGE_POOLS)
+
+    def stratum_active(self, pool: int) -> bool:
+        """Whether a pool has a stratum session, every pool does without a client."""
+        if self.pool_shares is None:
+            return True
+        return pool == self.stratum_pool
+
+    @property
+    def env_temp(self) -> float:
+        return self._env_temp
+
+    @env_temp.setter
+    def env_temp(self, val: float):
+        self.tick()
+        self._env_temp = val
+        self.tick()
+        self.notify(CHANGE_ENV)
+
+    @property
+    def light(self) -> bool:
+        return self._light
+
+    @light.setter
+    def light(self, val: bool):
+        if val == self._light:
+            return
+        self._light = val
+        self.notify(CHANGE_LIGHT)
+
+    @property
+    def mining(self) -> bool:
+        return self._mining
+
+    @mining.setter
+    def mining(self, val: bool):
+        if val == self._mining:
+            return
+        self.tick()
+        self._mining = val
+        if val:
+            # starting mining again clears an overheat shutdown
+            self.overheated = False
+        self._update_boards()
+        self.tick()
+        self.notify(CHANGE_MINING)
+
+    def set_fan_control(self, manual: bool, speed: float):
+        self.tick()
+        self.fan_manual = manual
+        self.fan_speed = speed
+        self._update_fans()
+        self._update_boards()
+        self.tick()
+        self.notify(CHANGE_FANS)
+
+    def set_board_working(self, board: int, working: bool):
+        self.tick()
+        self._boards[board].working = working
+        self.tick()
+        self.notify(CHANGE_BOARDS)
+
+    def set_board_chips(self, board: int, chips: int | None):
+        """Set the number of working chips on a board, or None for all of them."""
+        self.tick()
+        self._boards[board].chips = chips
+        self.tick()
+        self.notify(CHANGE_BOARDS)
+
+    def set_hashrate_multiplier(self, multiplier: float):
+        """Scale the hashrate of every board, 1 for the model's normal rate."""
+        self.tick()
+        for board in self._boards:
+            board.multiplier = multiplier
+        self.tick()
+        self.notify(CHANGE_BOARDS)
+
+    def set_fan_working(self, fan: int, working: bool):
+        self.tick()
+        self._fans[fan].working = working
+        self.tick()
+        self.notify(CHANGE_FANS)
+
+    def set_pool_alive(self, pool: int, alive: bool):
+        self._pools[pool].alive = alive
+        self.notify(CHANGE_POOLS)
+
+    def reboot(self):
+        """Restart the miner, uptime, averages and counters start over."""
+        now = self.clock.now()
+        self._advance(now)
+        self.init_time = round(now)
+        self.uptime_offset = 0
+        self._mining = True
+        self.overheated = False
+        self._update_boards()
+        for board, avg in zip(self._boards, self._hashrate_avgs):
+            avg.reset(self._board_rate(board), now)
+        if self.pool_shares is not None:
+            self.pool_shares = {}
+        self._refresh(now)
+        self.notify(CHANGE_REBOOT)
 
     def _update_fans(self):
-        if self.miner_info.fan_manual:
+        if self.fan_manual:
             for fan in self._fans:
                 fan.rpm = round(
-                    self.miner_info.fan_info.max_speed
-                    * (self.miner_info.fan_speed / 100)
+                    self.miner_info.fan_info.max_speed * (self.fan_speed / 100)
                 )
         else:
             for fan in self._fans:
@@ -50,14 +257,147 @@ class MinerSimulatorBackend:
 
     @property
     def fans(self) -> list[FanSimulator]:
-        self._update_fans()
         return self._fans
 
     def _update_boards(self):
         for board in self._boards:
-            board.mining = self.mining
+            board.mining = self._mining
 
     @property
     def boards(self) -> list[BoardSimulator]:
-        self._update_boards()
+        self._advance(self.clock.now())
         return self._boards
+
+    @staticmethod
+    def _board_rate(board: BoardSimulator) -> float:
+        return float(board.hashrate.into(HashUnit.H))
+
+    def tick(self):
+        """Bring averages and temperatures up to date with the current state.
+
+        Must be called before and after anything that changes board hashrate,
+        fan speed or the environment.
+        """
+        now = self.clock.now()
+        self._advance(now)
+        self._refresh(now)
+
+    def _advance(self, now: float):
+        """Advance averages and temperatures to now, with the inputs unchanged."""
+        if now <= self._last_tick:
+            return
+        dt = now - self._last_tick
+        for board, avg in zip(self._boards, self._hashrate_avgs):
+            avg.advance(now)
+            thermal.advance(board, dt)
+        self._last_tick = now
+
+    def _refresh(self, now: float):
+        """Feed the current hashrate and cooling into the averages and temperatures."""
+        cooling = thermal.cooling(self._fans)
+        for board, avg in zip(self._boards, self._hashrate_avgs):
+            avg.update(self._board_rate(board), now)
+            thermal.update_targets(board, self._env_temp, cooling)
+        self._schedule_overheat(now)
+
+    def _schedule_overheat(self, now: float):
+        """Put the moment the chips reach the shutdown temperature on the timers.
+
+        Temperatures only change course when the inputs do, so the moment is
+        exact until the next `_refresh`, whether or not anybody polls.
+        """
+        if self._overheat_timer is not None:
+            self._overheat_timer.cancel()
+            self._overheat_timer = None
+        if not self._mining:
+            return
+        shutdown = min(
+            (
+                t
+                for t in (thermal.time_to_shutdown(b) for b in self._boards)
+                if t is not None
+            ),
+            default=None,
+        )
+        if shutdown is not None:
+            when = now + shutdown
+            self._overheat_timer = self.timers.call_at(when, self._overheat, when)
+
+    def _overheat(self, when: float):
+        """Stop mining, the chips reached the shutdown temperature at `when`."""
+        self._overheat_timer = None
+        self._advance(when)
+        self._mining = False
+        self.overheated = True
+        self._update_boards()
+        self._refresh(self._last_tick)
+        self.notify(CHANGE_OVERHEAT)
+
+    def board_hashrate_avg(self, board: int, window: str = AVERAGE_ALL) -> Hashrate:
+        """Get the average hashrate of a board over one of `AVERAGE_WINDOWS`, or since startup."""
+        self._advance(self.clock.now())
+        return Hashrate(self._hashrate_avgs[board].average(window), HashUnit.H)
+
+    def hashrate_avg(self, window: str = AVERAGE_ALL) -> Hashrate:
+        """Get the average hashrate of the miner over one of `AVERAGE_WINDOWS`, or since startup."""
+        self._advance(self.clock.now())
+        return Hashrate(
+            sum(avg.average(window) for avg in self._hashrate_avgs), HashUnit.H
+        )
+
+    def current_hashrate(self) -> float:
+        """The hashrate the boards are running at right now, in H/s."""
+        self._advance(self.clock.now())
+        return sum(avg.current for avg in self._hashrate_avgs)
+
+    def counters(self, board: int = None) -> ShareCounters:
+        """Get share counters for the miner, or a single board.
+
+        These are computed from the work done since startup, so reading them
+        is the only cost, there is nothing to update while nobody is looking.
+        """
+        now = self.clock.now()
+        self._advance(now)
+        avgs = self._hashrate_avgs if board is None else [self._hashrate_avgs[board]]
+        total_hashes = 0.0
+        hashrate = 0.0
+        for avg in avgs:
+            total_hashes += avg.total
+            hashrate += avg.current
+        active_pool = self.active_pool
+        if active_pool is None:
+            difficulty = PoolInfo.difficulty
+        else:
+            difficulty = self._pools[active_pool].difficulty
+        submitted = None
+        if board is None and self.pool_shares is not None:
+            submitted = SubmittedShares.total(self.pool_shares.values())
+        return ShareCounters(
+            total_hashes=total_hashes,
+            hashrate=hashrate,
+            elapsed=self.elapsed,
+            difficulty=difficulty,
+            now=now,
+            submitted=submitted,
+        )
+
+    def pool_counters(self) -> list[ShareCounters]:
+        """Get share counters for each pool.
+
+        Only the active pool gets derived shares, with a stratum client each
+        pool has the shares that were submitted to it.
+        """
+        counters = self.counters()
+        active_pool = self.active_pool
+        if self.pool_shares is None:
+            return [
+                counters if i == active_pool else ShareCounters(now=counters.now)
+                for i in range(len(self._pools))
+            ]
+        return [
+            dataclasses.replace(
+                counters if i == active_pool else ShareCounters(now=counters.now),
+                submitted=self.pool_shares.get(i, SubmittedShares()),
+            )
+            for i in range(len(self._pools))
+        ]
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import math
+
+# window name -> time constant in seconds
+AVERAGE_WINDOWS = {"5s": 5, "1m": 60, "5m": 300, "15m": 900, "30m": 1800}
+# pseudo-window for the mean since startup
+AVERAGE_ALL = "av"
+
+_WINDOW_INDEX = {name: i for i, name in enumerate(AVERAGE_WINDOWS)}
+_WINDOW_SECONDS = tuple(AVERAGE_WINDOWS.values())
+
+
+class RollingHashrate:
+    """Exponentially decayed hashrate averages for a single source.
+
+    The hashrate is treated as constant between updates, so the decay over any
+    gap is applied in closed form.  No samples are stored, each update is O(1)
+    in the number of windows, regardless of how long ago the last one was.
+    """
+
+    __slots__ = ("values", "current", "total", "start", "last")
+
+    def __init__(self, hashrate: float, now: float, uptime: float = 0):
+        # start warmed up, as if the source has been running at this rate
+        self.values = [hashrate for _ in AVERAGE_WINDOWS]
+        self.current = hashrate
+        self.total = hashrate * uptime
+        self.start = now - uptime
+        self.last = now
+
+    def update(self, hashrate: float, now: float):
+        """Account for the time since the last update, then switch to a new rate."""
+        self.advance(now)
+        self.current = hashrate
+
+    def advance(self, now: float):
+        dt = now - self.last
+        if dt <= 0:
+            return
+        for i, window in enumerate(_WINDOW_SECONDS):
+            decay = math.exp(-dt / window)
+            self.values[i] = self.current + (self.values[i] - self.current) * decay
+        self.total += self.current * dt
+        self.last = now
+
+    def reset(self, hashrate: float, now: float):
+        """Restart from nothing, like the averages after a reboot."""
+        self.values = [0.0 for _ in AVERAGE_WINDOWS]
+        self.current = hashrate
+        self.total = 0.0
+        self.start = now
+        self.last = now
+
+    def average(self, window: str) -> float:
+        if window == AVERAGE_ALL:
+            if self.last <= self.start:
+                return self.current
+            return self.total / (self.last - self.start)
+        return self.values[_WINDOW_INDEX[window]]
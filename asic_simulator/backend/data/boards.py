@@ -1,16 +1,28 @@
 from __future__ import annotations
 
+import functools
 from dataclasses import dataclass, field
 
 from asic_simulator.backend.data.hashrate import Hashrate, HashUnit
 
 
-@dataclass
+@functools.lru_cache(maxsize=None)
+def asic_string(chips: int) -> str:
+    """Get the chip status string for a board, "ooo ooo o" for 7 working chips."""
+    acs_str = "o" * chips
+    return " ".join([acs_str[i : i + 3] for i in range(0, len(acs_str), 3)])
+
+
+@dataclass(frozen=True)
 class BoardInfo:
     ideal_chips: int = 63
     chips: int = 63
     board_temp: float = 60
     chip_temp: float = 80
+    # chips above this temperature shut the miner down
+    shutdown_temp: float = 95
+    # seconds for temperatures to get ~63% of the way to a new steady state
+    thermal_time_constant: float = 60
     ideal_hashrate: Hashrate = field(default_factory=lambda: Hashrate(4, HashUnit.TH))
     hashrate: Hashrate = field(default_factory=lambda: Hashrate(4, HashUnit.TH))
 
@@ -18,22 +30,52 @@ class BoardInfo:
 @dataclass
 class BoardSimulator:
     info: BoardInfo
-    _chips: int = None
     chips: int = field(init=False)
+    # must come after chips, the dataclass assigns chips a default through the setter
+    _chips: int = None
     _hashrate: Hashrate = None
     # can't define this or calling .into() on Hashrate will fail.
     # usually defined for compatibility with fields()
     # hashrate: Hashrate = field(init=False)
     mining: bool = True
     working: bool = True
+    # scales whatever the board would otherwise hash at, for degraded or
+    # overclocked boards
+    multiplier: float = 1.0
+    serial: str = ""
+    # current temperatures, and the ones the board is heading towards
+    board_temp: float = None
+    chip_temp: float = None
+    target_board_temp: float = None
+    target_chip_temp: float = None
+
+    def __post_init__(self):
+        if self.board_temp is None:
+            self.board_temp = self.info.board_temp
+        if self.chip_temp is None:
+            self.chip_temp = self.info.chip_temp
+        if self.target_board_temp is None:
+            self.target_board_temp = self.board_temp
+        if self.target_chip_temp is None:
+            self.target_chip_temp = self.chip_temp
 
     @property
     def hashrate(self) -> Hashrate:
-        if self.mining and self.working:
-            if self._hashrate is not None:
-                return self._hashrate
-            return self.info.ideal_hashrate
-        return Hashrate(0)
+        if not (self.mining and self.working):
+            return Hashrate(0)
+        if self._hashrate is not None:
+            rate = self._hashrate
+        elif self._chips is not None:
+            # lost chips take their share of the hashrate with them
+            rate = Hashrate(
+                self.info.ideal_hashrate.hashrate * self._chips / self.info.ideal_chips,
+                self.info.ideal_hashrate.unit,
+            )
+        else:
+            rate = self.info.ideal_hashrate
+        if self.multiplier != 1:
+            return Hashrate(rate.hashrate * self.multiplier, rate.unit)
+        return rate
 
     @hashrate.setter
     def hashrate(self, val: Hashrate):
@@ -48,5 +90,5 @@ class BoardSimulator:
         return 0
 
     @chips.setter
-    def chips(self, val: Hashrate):
-        self._hashrate = val
+    def chips(self, val: int):
+        self._chips = val
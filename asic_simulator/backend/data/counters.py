@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Iterable
+
+# hashes needed on average to find a share of difficulty 1
+DIFF1_HASHES = 2**32
+
+REJECT_RATE = 0.001
+STALE_RATE = 0.0005
+HW_ERROR_RATE = 0.00001
+
+
+@dataclass
+class SubmittedShares:
+    """Shares submitted to a pool over stratum and what the pool made of them."""
+
+    accepted: int = 0
+    rejected: int = 0
+    stale: int = 0
+    difficulty_accepted: float = 0.0
+    difficulty_rejected: float = 0.0
+    difficulty_stale: float = 0.0
+    last_share_time: float = None
+
+    @classmethod
+    def total(cls, shares: Iterable[SubmittedShares]) -> SubmittedShares:
+        total = cls()
+        for s in shares:
+            total.accepted += s.accepted
+            total.rejected += s.rejected
+            total.stale += s.stale
+            total.difficulty_accepted += s.difficulty_accepted
+            total.difficulty_rejected += s.difficulty_rejected
+            total.difficulty_stale += s.difficulty_stale
+            if s.last_share_time is not None:
+                total.last_share_time = max(
+                    total.last_share_time or 0, s.last_share_time
+                )
+        return total
+
+    @property
+    def count(self) -> int:
+        return self.accepted + self.rejected + self.stale
+
+
+@dataclass
+class ShareCounters:
+    """Share counters derived from the amount of work done.
+
+    Nothing here is accumulated per share, every field is computed from the
+    total hashes and the current hashrate at read time, so the same inputs
+    always give the same counters.  Miners talking to a real pool pass the
+    pool's answers as `submitted`, which replace the derived share counts.
+    """
+
+    total_hashes: float = 0.0
+    hashrate: float = 0.0
+    elapsed: float = 0.0
+    difficulty: float = 100000
+    now: float = 0.0
+    submitted: SubmittedShares = None
+
+    @property
+    def diff1_work(self) -> int:
+        return int(self.total_hashes / DIFF1_HASHES)
+
+    @property
+    def shares(self) -> float:
+        return self.total_hashes / (DIFF1_HASHES * self.difficulty)
+
+    @property
+    def accepted(self) -> int:
+        if self.submitted is not None:
+            return self.submitted.accepted
+        return int(self.shares * (1 - REJECT_RATE - STALE_RATE))
+
+    @property
+    def rejected(self) -> int:
+        if self.submitted is not None:
+            return self.submitted.rejected
+        return int(self.shares * REJECT_RATE)
+
+    @property
+    def stale(self) -> int:
+        if self.submitted is not None:
+            return self.submitted.stale
+        return int(self.shares * STALE_RATE)
+
+    @property
+    def hardware_errors(self) -> int:
+        return int(self.diff1_work * HW_ERROR_RATE)
+
+    @property
+    def difficulty_accepted(self) -> float:
+        if self.submitted is not None:
+            return self.submitted.difficulty_accepted
+        return float(self.accepted * self.difficulty)
+
+    @property
+    def difficulty_rejected(self) -> float:
+        if self.submitted is not None:
+            return self.submitted.difficulty_rejected
+        return float(self.rejected * self.difficulty)
+
+    @property
+    def difficulty_stale(self) -> float:
+        if self.submitted is not None:
+            return self.submitted.difficulty_stale
+        return float(self.stale * self.difficulty)
+
+    @property
+    def total_mh(self) -> float:
+        return self.total_hashes / 10**6
+
+    @property
+    def best_share(self) -> int:
+        # the best of n diff 1 shares is roughly difficulty n
+        return self.diff1_work
+
+    @property
+    def hardware_pct(self) -> float:
+        if self.diff1_work == 0:
+            return 0.0
+        return round(self.hardware_errors / self.diff1_work * 100, 4)
+
+    @property
+    def _share_count(self) -> float:
+        if self.submitted is not None:
+            return self.submitted.count
+        return self.shares
+
+    @property
+    def rejected_pct(self) -> float:
+        if self._share_count < 1:
+            return 0.0
+        return round(self.rejected / self._share_count * 100, 4)
+
+    @property
+    def stale_pct(self) -> float:
+        if self._share_count < 1:
+            return 0.0
+        return round(self.stale / self._share_count * 100, 4)
+
+    @property
+    def utility(self) -> float:
+        """Accepted shares per minute."""
+        if self.elapsed <= 0:
+            return 0.0
+        return round(self.accepted / self.elapsed * 60, 2)
+
+    @property
+    def work_utility(self) -> float:
+        """Diff 1 shares per minute."""
+        if self.elapsed <= 0:
+            return 0.0
+        return round(self.diff1_work / self.elapsed * 60, 2)
+
+    @property
+    def last_share_time(self) -> int:
+        """Timestamp of the last share, assuming shares are found evenly spaced.
+
+        Falls back to the start time if the miner is not hashing.
+        """
+        if self.submitted is not None:
+            if self.submitted.last_share_time is None:
+                return round(self.now - self.elapsed)
+            return round(self.submitted.last_share_time)
+        if self.hashrate <= 0:
+            return round(self.now - self.elapsed)
+        interval = DIFF1_HASHES * self.difficulty / self.hashrate
+        return round(self.now - (self.shares % 1) * interval)
@@ -1,20 +1,28 @@
 from __future__ import annotations
 
-import random
+import functools
 from dataclasses import dataclass, field
 
 from asic_simulator.backend.data.boards import BoardInfo
 from asic_simulator.backend.data.fans import FanInfo
 
 
-@dataclass
+@dataclass(frozen=True)
 class MinerInfo:
+    """Static information about a model, shared by every miner of that model."""
+
     make: str = "Antminer"
     model: str = "S9"
-    mac: str = ":".join([f"{random.randint(0, 255):02X}" for _ in range(6)])
+    # generated from the miner's random stream if not set
+    mac: str | None = None
     board_count: int = 3
     board_info: BoardInfo = field(default_factory=lambda: BoardInfo())
     fan_count: int = 2
     fan_info: FanInfo = field(default_factory=lambda: FanInfo())
+    # defaults for the per miner fan settings on the backend
     fan_manual: bool = False
     fan_speed: float = 100
+
+    @functools.cached_property
+    def type(self) -> str:
+        return f"{self.make} {self.model}"
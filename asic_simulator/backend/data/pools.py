@@ -9,6 +9,9 @@ class PoolInfo:
     port: int = 3333
     user: str = "pool_username.real_worker"
     pwd: str = "123"
+    difficulty: float = 100000
+    # set to False to simulate the pool being unreachable
+    alive: bool = True
     full_url: str = field(init=False)
     active: bool = field(init=False)
 
@@ -24,7 +27,7 @@ class PoolInfo:
 
     @property
     def active(self):
-        return not any([self.url == "", self.user == ""])
+        return self.alive and not any([self.url == "", self.user == ""])
 
     @active.setter
     def active(self, _):
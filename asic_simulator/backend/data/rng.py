@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import hashlib
+import math
+import string
+
+from asic_simulator import settings
+
+_SERIAL_CHARS = string.digits + string.ascii_uppercase
+
+
+class MinerRNG:
+    """Counter based random stream for a single miner.
+
+    Every value is a keyed hash of (field, counter) where the key is derived
+    from the fleet seed and the miner id.  Any value can be produced on its own
+    without keeping state, so the same seed gives the same values regardless of
+    call order or which worker process owns the miner.
+    """
+
+    __slots__ = ("miner_id", "_key")
+
+    def __init__(self, miner_id: int, seed: int = None):
+        if seed is None:
+            seed = settings.SEED
+        self.miner_id = miner_id
+        self._key = hashlib.blake2b(
+            f"{seed}:{miner_id}".encode(), digest_size=32
+        ).digest()
+
+    def _digest(self, field: str, counter: int, size: int) -> bytes:
+        return hashlib.blake2b(
+            f"{field}:{counter}".encode(), key=self._key, digest_size=size
+        ).digest()
+
+    def bits(self, field: str, counter: int = 0) -> int:
+        """Get 64 random bits for a field and counter."""
+        return int.from_bytes(self._digest(field, counter, 8), "little")
+
+    def random(self, field: str, counter: int = 0) -> float:
+        """Get a float in [0, 1) for a field and counter."""
+        return (self.bits(field, counter) >> 11) * 2**-53
+
+    def uniform(self, field: str, counter: int, a: float, b: float) -> float:
+        return a + (b - a) * self.random(field, counter)
+
+    def randint(self, field: str, counter: int, a: int, b: int) -> int:
+        return a + self.bits(field, counter) % (b - a + 1)
+
+    def expovariate(self, field: str, counter: int, rate: float) -> float:
+        """Get an exponentially distributed value with the given rate."""
+        return -math.log(1.0 - self.random(field, counter)) / rate
+
+    def mac(self) -> str:
+        # the low 4 bytes are the miner id, so macs are unique across the fleet
+        prefix = self.bits("mac") & 0xFFFF
+        # set the locally administered bit and clear the multicast bit
+        prefix = (prefix & 0xFEFF) | 0x0200
+        value = (prefix << 32) | (self.miner_id & 0xFFFFFFFF)
+        return ":".join(f"{b:02X}" for b in value.to_bytes(6, "big"))
+
+    def serial(self, field: str, counter: int = 0, length: int = 16) -> str:
+        """Get an uppercase alphanumeric serial number, at most 64 characters."""
+        return "".join(
+            _SERIAL_CHARS[b % len(_SERIAL_CHARS)]
+            for b in self._digest(field, counter, length)
+        )
+
+    def hex(self, field: str, counter: int = 0, length: int = 16) -> str:
+        """Get a lowercase hex string, at most 128 characters."""
+        return self._digest(field, counter, (length + 1) // 2).hex()[:length]
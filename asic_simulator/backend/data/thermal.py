@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import math
+
+from asic_simulator.backend.data.boards import BoardSimulator
+from asic_simulator.backend.data.fans import FanSimulator
+
+# the env temp the BoardInfo temperatures are given at
+NOMINAL_ENV_TEMP = 35
+# fraction of the cooling left with the fans stopped
+MIN_COOLING = 0.2
+
+
+def cooling(fans: list[FanSimulator]) -> float:
+    """Get the cooling factor of a set of fans, 1 at full speed.
+
+    Never less than MIN_COOLING, whatever speed the fans were given.
+    """
+    if len(fans) == 0:
+        return 1.0
+    speeds = [fan.rpm / fan.info.max_speed for fan in fans]
+    speed = sum(min(1.0, max(0.0, s)) for s in speeds) / len(speeds)
+    return MIN_COOLING + (1 - MIN_COOLING) * speed
+
+
+def update_targets(board: BoardSimulator, env_temp: float, cooling_factor: float):
+    """Set the temperatures a board settles at with its current load and cooling.
+
+    Temperature rise over ambient scales with the load (hashrate relative to
+    ideal) and inversely with the cooling, so a board at full hashrate with fans
+    at full speed sits at the temperatures from its BoardInfo.
+    """
+    ideal = board.info.ideal_hashrate
+    if float(ideal) > 0:
+        load = float(board.hashrate.into(ideal.unit)) / float(ideal)
+    else:
+        load = 0.0
+    heat = load / cooling_factor
+    board.target_board_temp = (
+        env_temp + (board.info.board_temp - NOMINAL_ENV_TEMP) * heat
+    )
+    board.target_chip_temp = env_temp + (board.info.chip_temp - NOMINAL_ENV_TEMP) * heat
+
+
+def advance(board: BoardSimulator, dt: float):
+    """Move a board's temperatures towards their targets over dt seconds.
+
+    The response is first order, so this is exact for any dt as long as the
+    targets did not change in between.
+    """
+    if dt <= 0:
+        return
+    decay = math.exp(-dt / board.info.thermal_time_constant)
+    board.board_temp = (
+        board.target_board_temp + (board.board_temp - board.target_board_temp) * decay
+    )
+    board.chip_temp = (
+        board.target_chip_temp + (board.chip_temp - board.target_chip_temp) * decay
+    )
+
+
+def time_to_shutdown(board: BoardSimulator) -> float | None:
+    """Get the seconds until the chips reach the shutdown temperature, if ever."""
+    limit = board.info.shutdown_temp
+    if board.chip_temp >= limit:
+        return 0.0
+    if board.target_chip_temp <= limit:
+        return None
+    return board.info.thermal_time_constant * math.log(
+        (board.target_chip_temp - board.chip_temp) / (board.target_chip_temp - limit)
+    )
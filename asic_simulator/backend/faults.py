@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, fields
+
+from asic_simulator.backend.data import MinerSimulatorBackend
+from asic_simulator.timers import TimerHandle, TimerQueue
+
+FAULT_KINDS = ("board", "chips", "fan", "pool", "reboot")
+
+
+@dataclass
+class FaultRates:
+    # mean number of failures per miner per day, 0 disables the fault
+    board: float = 0.0
+    chips: float = 0.0
+    fan: float = 0.0
+    pool: float = 0.0
+    reboot: float = 0.0
+    # mean seconds until the fault recovers
+    board_recovery: float = 3600
+    chips_recovery: float = 4 * 3600
+    fan_recovery: float = 2 * 3600
+    pool_recovery: float = 600
+    reboot_recovery: float = 90
+    # fraction of a board's chips lost in a chips fault
+    chips_lost: float = 0.1
+
+    @classmethod
+    def from_dict(cls, data: dict) -> FaultRates:
+        names = {f.name for f in fields(cls)}
+        unknown = set(data) - names
+        if unknown:
+            raise ValueError(f"Unknown fault settings: {', '.join(sorted(unknown))}")
+        return cls(**data)
+
+
+class FaultScheduler:
+    """Schedules random failures and recoveries for many miners on one timer heap.
+
+    Each miner has at most one pending event per fault kind.  Failure times are
+    drawn from an exponential distribution with the configured daily rate, and
+    recovery times from one with the configured mean, using the miner's seeded
+    random stream so a rerun with the same seed fails the same way.
+    """
+
+    def __init__(self, rates: FaultRates = None, timers: TimerQueue = None):
+        self.rates = rates if rates is not None else FaultRates()
+        self.timers = timers if timers is not None else TimerQueue()
+        self._miners: dict[int, _MinerFaults] = {}
+
+    def __len__(self) -> int:
+        return len(self._miners)
+
+    def add(self, backend: MinerSimulatorBackend, rates: FaultRates = None):
+        faults = _MinerFaults(backend, rates if rates is not None else self.rates)
+        self.remove(backend)
+        self._miners[backend.miner_id] = faults
+        for kind in FAULT_KINDS:
+            self._schedule_failure(faults, kind)
+
+    def remove(self, backend: MinerSimulatorBackend):
+        faults = self._miners.pop(backend.miner_id, None)
+        if faults is None:
+            return
+        for handle in faults.pending.values():
+            handle.cancel()
+
+    def set_rates(self, backend: MinerSimulatorBackend, rates: FaultRates = None):
+        """Change a miner's fault rates, keeping the recoveries of active faults."""
+        faults = self._miners.get(backend.miner_id)
+        if faults is None:
+            self.add(backend, rates)
+            return
+        faults.rates = rates if rates is not None else self.rates
+        for kind in FAULT_KINDS:
+            pending = faults.pending.get(kind)
+            if pending is not None and pending.callback != self._fail:
+                continue
+            # failures are memoryless, redrawing the next one is exact
+            if pending is not None:
+                pending.cancel()
+                del faults.pending[kind]
+            self._schedule_failure(faults, kind)
+
+    def state(
+        self, backend: MinerSimulatorBackend
+    ) -> tuple[dict[str, tuple[bool, float, int | None]], dict[str, int]]:
+        """Get a miner's pending events and draw counts, to restore later.
+
+        Returns:
+            (recovering, when, target) of the pending event for each fault kind
+            that has one, and how many times each random stream was drawn from.
+        """
+        faults = self._miners.get(backend.miner_id)
+        if faults is None:
+            return {}, {}
+        pending = {}
+        for kind, handle in faults.pending.items():
+            if handle.callback == self._fail:
+                pending[kind] = (False, handle.when, None)
+            else:
+                pending[kind] = (True, handle.when, handle.args[2])
+        return pending, dict(faults.counts)
+
+    def restore(
+        self,
+        backend: MinerSimulatorBackend,
+        pending: dict[str, tuple[bool, float, int | None]],
+        counts: dict[str, int],
+        rates: FaultRates = None,
+    ):
+        """Put back the state from `state`, events that are due by now run next."""
+        faults = self._miners.get(backend.miner_id)
+        if faults is None:
+            faults = _MinerFaults(backend, rates if rates is not None else self.rates)
+            self._miners[backend.miner_id] = faults
+        for handle in faults.pending.values():
+            handle.cancel()
+        faults.pending = {}
+        faults.counts = dict(counts)
+        for kind in FAULT_KINDS:
+            if kind not in pending:
+                # the rates may have gone up since
+                self._schedule_failure(faults, kind)
+                continue
+            recovering, when, target = pending[kind]
+            if recovering:
+                handle = self.timers.call_at(when, self._recover, faults, kind, target)
+            else:
+                handle = self.timers.call_at(when, self._fail, faults, kind)
+            faults.pending[kind] = handle
+
+    def inject(self, backend: MinerSimulatorBackend, kind: str) -> bool:
+        """Fail a miner right away, recovering as if the fault happened naturally.
+
+        Returns:
+            False if the miner already has a fault of that kind, which is left to
+            recover when it was going to.
+        """
+        if kind not in FAULT_KINDS:
+            raise ValueError(f"Unknown fault kind: {kind}")
+        faults = self._miners.get(backend.miner_id)
+        if faults is None:
+            faults = _MinerFaults(backend, self.rates)
+            self._miners[backend.miner_id] = faults
+        pending = faults.pending.get(kind)
+        if pending is not None:
+            if pending.callback != self._fail:
+                return False
+            pending.cancel()
+            del faults.pending[kind]
+        self._fail(faults, kind)
+        return True
+
+    async def run(self):
+        await self.timers.run()
+
+    def _draw(self, faults: _MinerFaults, field: str, rate: float) -> float:
+        count = faults.counts.get(field, 0)
+        faults.counts[field] = count + 1
+        return faults.backend.rng.expovariate(field, count, rate)
+
+    def _schedule_failure(self, faults: _MinerFaults, kind: str):
+        per_day = getattr(faults.rates, kind)
+        if per_day <= 0:
+            faults.pending.pop(kind, None)
+            return
+        delay = self._draw(faults, f"fault_{kind}", per_day / 86400)
+        faults.pending[kind] = self.timers.call_later(delay, self._fail, faults, kind)
+
+    def _schedule_recovery(self, faults: _MinerFaults, kind: str, *args):
+        mean = getattr(faults.rates, f"{kind}_recovery")
+        delay = self._draw(faults, f"recover_{kind}", 1 / mean) if mean > 0 else 0
+        faults.pending[kind] = self.timers.call_later(
+            delay, self._recover, faults, kind, *args
+        )
+
+    def _fail(self, faults: _MinerFaults, kind: str):
+        backend = faults.backend
+        rng = backend.rng
+        count = faults.counts.get(f"fault_{kind}", 0)
+        target = None
+        if kind == "board" and backend.boards:
+            target = rng.randint(
+                "fault_board_target", count, 0, len(backend.boards) - 1
+            )
+            backend.set_board_working(target, False)
+        elif kind == "chips" and backend.boards:
+            target = rng.randint(
+                "fault_chips_target", count, 0, len(backend.boards) - 1
+            )
+            board = backend.boards[target]
+            lost = max(1, round(board.info.ideal_chips * faults.rates.chips_lost))
+            backend.set_board_chips(target, max(0, board.chips - lost))
+        elif kind == "fan" and backend.fans:
+            target = rng.randint("fault_fan_target", count, 0, len(backend.fans) - 1)
+            backend.set_fan_working(target, False)
+        elif kind == "pool":
+            target = backend.active_pool
+            if target is not None:
+                backend.set_pool_alive(target, False)
+        elif kind == "reboot":
+            backend.mining = False
+        self._schedule_recovery(faults, kind, target)
+
+    def _recover(self, faults: _MinerFaults, kind: str, target: int | None):
+        backend = faults.backend
+        if kind == "board" and target is not None:
+            backend.set_board_working(target, True)
+        elif kind == "chips" and target is not None:
+            backend.set_board_chips(target, None)
+        elif kind == "fan" and target is not None:
+            backend.set_fan_working(target, True)
+        elif kind == "pool" and target is not None:
+            # the pools may have been replaced while this one was down
+            if target < len(backend.pools):
+                backend.set_pool_alive(target, True)
+        elif kind == "reboot":
+            backend.reboot()
+        self._schedule_failure(faults, kind)
+
+
+class _MinerFaults:
+    __slots__ = ("backend", "rates", "pending", "counts")
+
+    def __init__(self, backend: MinerSimulatorBackend, rates: FaultRates):
+        self.backend = backend
+        self.rates = rates
+        self.pending: dict[str, TimerHandle] = {}
+        self.counts: dict[str, int] = {}
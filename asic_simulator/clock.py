@@ -0,0 +1,108 @@
+"""The time miners see.
+
+Backends, averages, "When" fields and scheduled events all read the time from a
+clock instead of the system, so a fleet can run a long scenario quickly:
+
+- `Clock` is real time,
+- `AcceleratedClock` starts at real time and runs `speed` times faster,
+- `ManualClock` stands still until it's stepped, see `TimerQueue.advance`.
+
+Reading a clock is a float, not a datetime object.
+"""
+from __future__ import annotations
+
+import time
+
+
+class Clock:
+    """Real time."""
+
+    __slots__ = ()
+    # whether the time is the fleet's own, and has to be carried over restarts
+    virtual = False
+
+    def now(self) -> float:
+        return time.time()
+
+    @property
+    def speed(self) -> float:
+        return 1.0
+
+    def delay(self, seconds: float) -> float | None:
+        """Real seconds until `seconds` of this clock's time have passed.
+
+        Returns:
+            None if that only happens when the clock is stepped.
+        """
+        return seconds
+
+
+class AcceleratedClock(Clock):
+    """Real time sped up, a speed of 60 runs an hour in a minute."""
+
+    __slots__ = ("_speed", "_origin", "_real_origin")
+    virtual = True
+
+    def __init__(self, speed: float, start: float = None):
+        if speed <= 0:
+            raise ValueError(f"Invalid clock speed: {speed}")
+        self._speed = float(speed)
+        self.set(start if start is not None else time.time())
+
+    def now(self) -> float:
+        return self._origin + (time.monotonic() - self._real_origin) * self._speed
+
+    @property
+    def speed(self) -> float:
+        return self._speed
+
+    def delay(self, seconds: float) -> float | None:
+        return seconds / self._speed
+
+    def set(self, when: float):
+        """Jump to a time, carrying on at the same speed from there."""
+        self._origin = when
+        self._real_origin = time.monotonic()
+
+
+class ManualClock(Clock):
+    """Time that only moves when it's stepped."""
+
+    __slots__ = ("_now",)
+    virtual = True
+
+    def __init__(self, start: float = None):
+        self._now = start if start is not None else time.time()
+
+    def now(self) -> float:
+        return self._now
+
+    @property
+    def speed(self) -> float:
+        return 0.0
+
+    def delay(self, seconds: float) -> float | None:
+        return 0.0 if seconds <= 0 else None
+
+    def set(self, when: float):
+        self._now = when
+
+
+REAL_CLOCK = Clock()
+
+
+def clock_from_conf(value: str | float | None) -> Clock:
+    """A clock from the manifest or command line, "real", "manual" or a speed
+    like 60 or "60x"."""
+    if value is None or value == "real":
+        return REAL_CLOCK
+    if value == "manual":
+        return ManualClock()
+    if isinstance(value, str):
+        try:
+            value = float(value.lower().rstrip("x"))
+        except ValueError:
+            raise ValueError(f"Unknown clock: {value}")
+    if value == 1:
+        return REAL_CLOCK
+    return AcceleratedClock(value)
@@ -0,0 +1,609 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import glob
+import os
+import signal
+import time
+from typing import Callable
+
+from asic_simulator import log
+from asic_simulator.admin import AdminHandler
+from asic_simulator.backend import MINER_INFO, MinerInfo
+from asic_simulator.backend.checkpoint import Checkpoint
+from asic_simulator.backend.data import MinerSimulatorBackend, PoolInfo
+from asic_simulator.backend.faults import FaultScheduler
+from asic_simulator.clock import clock_from_conf
+from asic_simulator.fleet.control import (
+    Selector,
+    apply_mutations,
+    mutation_from_dict,
+)
+from asic_simulator.fleet.manifest import (
+    FleetManifest,
+    MinerGroup,
+    MinerSpec,
+    load_manifest,
+)
+from asic_simulator.fleet.reload import ManifestDiff, diff_manifest, watch_file
+from asic_simulator.limits import INTERFACES, AccessLimiter
+from asic_simulator.metrics import METRICS
+from asic_simulator.monitor import LoopMonitor
+from asic_simulator.network import NetworkConditions
+from asic_simulator.replay import Replay, open_corpus
+from asic_simulator.simulators import SIMULATOR_TYPES
+from asic_simulator.stratum.client import USER_AGENT, USER_AGENTS, StratumClient
+from asic_simulator.timers import TimerQueue
+
+
+async def _gather_all(aws):
+    """Run awaitables together, raising the first error once all are done."""
+    results = await asyncio.gather(*aws, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+
+class FleetMiner:
+    """A running miner in a fleet."""
+
+    def __init__(self, spec: MinerSpec, simulator, stratum: StratumClient = None):
+        self.spec = spec
+        self.simulator = simulator
+        self.stratum = stratum
+        self.tasks: list[asyncio.Task] = []
+
+    @property
+    def backend(self) -> MinerSimulatorBackend:
+        return self.simulator.backend
+
+    async def start(self, shutdown_trigger=None):
+        await self.start_listeners(shutdown_trigger)
+        if self.stratum is not None:
+            self.stratum.start()
+
+    async def stop(self):
+        if self.stratum is not None:
+            self.stratum.stop()
+        await self.stop_listeners()
+
+    async def start_listeners(self, shutdown_trigger=None):
+        self.tasks = await self.simulator.start(
+            self.spec.host,
+            self.spec.ports,
+            rpc_only=self.spec.mode == "rpc",
+            shutdown_trigger=shutdown_trigger,
+        )
+
+    async def stop_listeners(self):
+        """Stop answering, the stratum session and its share counts carry on."""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+
+@dataclasses.dataclass
+class FleetStats:
+    started: float = None
+    built: int = 0
+    build_time: float = 0.0
+    # seconds from starting the fleet to the first request it answered
+    first_byte: float = None
+    ready_time: float = None
+    restored: int = 0
+
+    @property
+    def build_rate(self) -> float:
+        if self.build_time <= 0:
+            return 0.0
+        return self.built / self.build_time
+
+
+class Fleet:
+    """A set of simulated miners, built from a manifest and served on one loop.
+
+    Miners are built and started in batches, so the first ones answer while the
+    rest of the fleet is still being constructed.
+
+    Parameters:
+        manifest: The fleet to run.
+        path: Where the manifest was loaded from, for reloads.
+        worker: The index of this process when the fleet is split over several.
+        workers: How many processes the fleet is split over.
+        checkpoint: Where to save the state of the fleet, see `checkpoint`.
+    """
+
+    def __init__(
+        self,
+        manifest: FleetManifest,
+        path: str = None,
+        worker: int = 0,
+        workers: int = 1,
+        checkpoint: str = None,
+    ):
+        self.manifest = manifest
+        self.path = path
+        self.worker = worker
+        self.workers = workers
+        self.checkpoint_path = checkpoint
+        # the time of every miner and scheduled event, see asic_simulator.clock
+        self.clock = clock_from_conf(manifest.clock)
+        self.faults = FaultScheduler(manifest.faults, TimerQueue(self.clock))
+        # pollers see network conditions and rate limits in real time, whatever
+        # the miners' clock
+        self.timers = TimerQueue()
+        self.miners: dict[str, FleetMiner] = {}
+        self.stats = FleetStats()
+        self.admin = AdminHandler(self)
+        self.monitor = LoopMonitor()
+        self._monitor_task: asyncio.Task | None = None
+        self._admin_task: asyncio.Task | None = None
+        self._stopping: asyncio.Event | None = None
+        self._reloading = asyncio.Lock()
+        self._watch_task: asyncio.Task | None = None
+        self._checkpoint_task: asyncio.Task | None = None
+        # checkpoints to restore miners from as they are started
+        self._restoring: list[Checkpoint] = []
+        # miner id of every miner in the fleet, including other workers'
+        self._ids = {spec.key: spec.miner_id for spec in manifest.specs()}
+
+    @classmethod
+    def from_file(cls, path: str) -> Fleet:
+        return cls(load_manifest(path), path=path)
+
+    @staticmethod
+    def miner_type(spec: MinerSpec) -> tuple[MinerInfo, type]:
+        """The miner info and simulator class for a spec."""
+        try:
+            return (
+                MINER_INFO[spec.vendor][spec.firmware][spec.model],
+                SIMULATOR_TYPES[spec.vendor],
+            )
+        except KeyError:
+            raise ValueError(
+                f"Unknown miner: {spec.vendor} {spec.firmware} {spec.model}"
+            )
+
+    @staticmethod
+    def check_spec(spec: MinerSpec, corpus: str = None):
+        """Raise ValueError if a miner can't be built."""
+        Fleet.miner_type(spec)
+        if spec.replay and not open_corpus(corpus).model(spec.vendor, spec.model):
+            raise ValueError(f"No captures of {spec.vendor} {spec.model} in {corpus}")
+
+    def build_miner(self, spec: MinerSpec) -> FleetMiner:
+        miner_info, simulator_type = self.miner_type(spec)
+        backend = MinerSimulatorBackend(
+            miner_info,
+            pools_info=spec.make_pools(),
+            miner_id=spec.miner_id,
+            seed=self.manifest.seed,
+            clock=self.clock,
+            timers=self.faults.timers,
+        )
+        replay = None
+        if spec.replay:
+            replay = Replay(
+                open_corpus(self.manifest.corpus), spec.vendor, spec.model, backend
+            )
+        # every miner gets these, so a reload can degrade the network or limit
+        # the access of any of them
+        network = NetworkConditions(spec.network, self.timers, backend.rng)
+        limiters = {
+            interface: AccessLimiter(spec.limits.get(interface), self.timers)
+            for interface in INTERFACES
+        }
+        return FleetMiner(
+            spec,
+            simulator_type(backend, replay=replay, network=network, limiters=limiters),
+            self._stratum_client(spec, backend) if spec.stratum else None,
+        )
+
+    def _stratum_client(
+        self, spec: MinerSpec, backend: MinerSimulatorBackend
+    ) -> StratumClient:
+        # on the fault timers, which the fleet runs anyway
+        return StratumClient(
+            backend,
+            self.faults.timers,
+            source=spec.host,
+            user_agent=USER_AGENTS.get(spec.vendor, USER_AGENT),
+        )
+
+    async def start(self, specs: list[MinerSpec] = None):
+        if self._stopping is None:
+            self._stopping = asyncio.Event()
+        self.stats.started = time.perf_counter()
+        batch = []
+        for spec in specs if specs is not None else self.manifest.specs():
+            build_start = time.perf_counter()
+            batch.append(self.build_miner(spec))
+            self.stats.build_time += time.perf_counter() - build_start
+            # building is synchronous, let started miners answer in between
+            await asyncio.sleep(0)
+            if len(batch) >= self.manifest.batch_size:
+                await self._start_batch(batch)
+                batch = []
+        if batch:
+            await self._start_batch(batch)
+        self.stats.ready_time = time.perf_counter() - self.stats.started
+        log.startup(
+            f"{self.stats.built} miners ready in {self.stats.ready_time:.2f}s "
+            f"({self.stats.build_rate:.0f} miners/s constructed)"
+        )
+
+    async def _start_batch(self, batch: list[FleetMiner]):
+        restored = {}
+        for miner in batch:
+            for checkpoint in self._restoring:
+                if checkpoint.restore(miner.spec.key, miner.backend):
+                    restored[miner.spec.key] = checkpoint
+                    break
+        results = await asyncio.gather(
+            *(miner.start(shutdown_trigger=self._stopping.wait) for miner in batch),
+            return_exceptions=True,
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            # the batch starts whole or not at all, stop the miners that did start
+            await asyncio.gather(
+                *(
+                    miner.stop()
+                    for miner, result in zip(batch, results)
+                    if not isinstance(result, BaseException)
+                )
+            )
+            raise errors[0]
+        for miner in batch:
+            self.miners[miner.spec.key] = miner
+            checkpoint = restored.get(miner.spec.key)
+            if checkpoint is None or not checkpoint.restore_faults(
+                miner.spec.key, miner.backend, self.faults, miner.spec.faults
+            ):
+                self.faults.add(miner.backend, miner.spec.faults)
+        self.stats.restored += len(restored)
+        first_batch = self.stats.built == 0
+        self.stats.built += len(batch)
+        if first_batch:
+            METRICS.add_waiter(self._first_request)
+        # let the batch that was just started serve before building the next
+        await asyncio.sleep(0)
+
+    def _first_request(self):
+        self.stats.first_byte = time.perf_counter() - self.stats.started
+        log.startup(f"first response after {self.stats.first_byte * 1000:.1f}ms")
+
+    def control(self, selector: dict, mutations: list[dict]) -> int:
+        """Apply mutations to the selected miners, see `fleet.control` for the format.
+
+        Returns:
+            The number of miners changed.
+        """
+        selected = Selector.from_dict(selector).select(self.miners)
+        return apply_mutations(selected, [mutation_from_dict(m) for m in mutations])
+
+    async def reload(self, manifest: FleetManifest) -> ManifestDiff:
+        """Change the running fleet to match a new manifest, see `fleet.reload`.
+
+        The seed, admin port and clock can't change while running, the ones the
+        fleet was started with are kept.
+        """
+        manifest.seed = self.manifest.seed
+        manifest.admin_port = self.manifest.admin_port
+        manifest.clock = self.manifest.clock
+        specs = manifest.specs()
+        # fail before anything is changed
+        for spec in specs:
+            self.check_spec(spec, manifest.corpus)
+        async with self._reloading:
+            diff = diff_manifest(
+                {key: miner.spec for key, miner in self.miners.items()},
+                self._ids,
+                specs,
+                self.worker,
+                self.workers,
+            )
+            # built before anything is changed, so a bad miner fails here
+            built = [self.build_miner(spec) for spec in diff.rebuild + diff.start]
+            old_manifest, old_ids = self.manifest, self._ids
+            stopped = [self.miners[key] for key in diff.stop]
+            stopped += [self.miners[spec.key] for spec in diff.rebuild]
+            restarted = [self.miners[spec.key] for spec in diff.restart]
+            updated = [
+                (self.miners[spec.key], spec) for spec in diff.update + diff.restart
+            ]
+            old_specs = [(miner, miner.spec) for miner, _ in updated]
+            # pending faults of the stopped miners, in case they come back
+            fault_states = [self.faults.state(miner.backend) for miner in stopped]
+            self.manifest = manifest
+            self._ids = diff.ids
+            try:
+                for miner in stopped:
+                    del self.miners[miner.spec.key]
+                    self.faults.remove(miner.backend)
+                # the old listeners have to be gone before new ones bind
+                await asyncio.gather(
+                    *(miner.stop() for miner in stopped),
+                    *(miner.stop_listeners() for miner in restarted),
+                )
+                for miner, spec in updated:
+                    self._update_miner(miner, spec)
+                await _gather_all(
+                    miner.start_listeners(self._stopping.wait) for miner in restarted
+                )
+                for i in range(0, len(built), manifest.batch_size):
+                    await self._start_batch(built[i : i + manifest.batch_size])
+            except Exception:
+                # put the fleet back the way it was
+                self.manifest, self._ids = old_manifest, old_ids
+                started = [m for m in built if self.miners.get(m.spec.key) is m]
+                for miner in started:
+                    del self.miners[miner.spec.key]
+                    self.faults.remove(miner.backend)
+                await asyncio.gather(
+                    *(miner.stop() for miner in started),
+                    *(miner.stop_listeners() for miner in restarted),
+                )
+                for miner, spec in old_specs:
+                    self._update_miner(miner, spec)
+                for miner, (pending, counts) in zip(stopped, fault_states):
+                    self.miners[miner.spec.key] = miner
+                    self.faults.restore(
+                        miner.backend, pending, counts, miner.spec.faults
+                    )
+                try:
+                    await _gather_all(
+                        [
+                            *(miner.start(self._stopping.wait) for miner in stopped),
+                            *(
+                                miner.start_listeners(self._stopping.wait)
+                                for miner in restarted
+                            ),
+                        ]
+                    )
+                except OSError as e:
+                    log.failure(
+                        "STARTUP", "restarting miners after a failed reload: %s", e
+                    )
+                raise
+        log.startup(
+            "reloaded: %s",
+            ", ".join(f"{n} {change}" for change, n in diff.summary().items()),
+        )
+        return diff
+
+    async def reload_file(self) -> ManifestDiff:
+        if self.path is None:
+            raise ValueError("The fleet wasn't loaded from a file")
+        return await self.reload(load_manifest(self.path))
+
+    def _update_miner(self, miner: FleetMiner, spec: MinerSpec):
+        old, miner.spec = miner.spec, spec
+        if spec.pools != old.pools:
+            pools = spec.make_pools()
+            miner.backend.pools = (
+                pools if pools is not None else [PoolInfo(), PoolInfo(), PoolInfo()]
+            )
+        if spec.faults != old.faults:
+            self.faults.set_rates(miner.backend, spec.faults)
+        if spec.network != old.network:
+            miner.simulator.network.profile = spec.network
+        if spec.limits != old.limits:
+            for interface, limiter in miner.simulator.limiters.items():
+                limiter.set_limits(spec.limits.get(interface))
+        if spec.stratum != old.stratum:
+            if miner.stratum is not None:
+                miner.stratum.stop()
+                miner.stratum = None
+            if spec.stratum:
+                miner.stratum = self._stratum_client(spec, miner.backend)
+                miner.stratum.start()
+
+    async def _reload_file_logged(self):
+        try:
+            await self.reload_file()
+        except (OSError, ValueError, TypeError, RuntimeError) as e:
+            log.failure("STARTUP", "reload of %s failed: %s", self.path, e)
+
+    def watch(self, interval: float = None):
+        """Reload the fleet whenever its manifest file changes."""
+        if self.path is None:
+            raise ValueError("The fleet wasn't loaded from a file")
+        args = () if interval is None else (interval,)
+        self._watch_task = asyncio.create_task(
+            watch_file(self.path, self._reload_file_logged, *args)
+        )
+
+    @property
+    def checkpoint_file(self) -> str | None:
+        """The checkpoint this process writes, workers each write their own."""
+        if self.checkpoint_path is None or self.workers == 1:
+            return self.checkpoint_path
+        return f"{self.checkpoint_path}.{self.worker}"
+
+    async def checkpoint(self, path: str = None) -> tuple[str, int, int]:
+        """Save the state of every miner in this process.
+
+        The state is captured at once on the loop, writing the file happens in
+        a thread.
+
+        Returns:
+            The path written, the number of miners and the size in bytes.
+        """
+        path = path if path is not None else self.checkpoint_file
+        if path is None:
+            raise ValueError("No checkpoint path given")
+        start = time.perf_counter()
+        checkpoint = Checkpoint.capture(
+            ((key, miner.backend) for key, miner in self.miners.items()),
+            self.faults,
+            self.clock,
+        )
+        size = await asyncio.get_running_loop().run_in_executor(
+            None, checkpoint.write, path
+        )
+        log.startup(
+            "checkpoint of %s miners written to %s (%s bytes) in %.0fms",
+            len(checkpoint),
+            path,
+            size,
+            (time.perf_counter() - start) * 1000,
+        )
+        return path, len(checkpoint), size
+
+    def load_checkpoints(self) -> list[Checkpoint]:
+        """Read the checkpoints written by every worker, whatever their number was."""
+        if self.checkpoint_path is None:
+            return []
+        paths = [
+            path
+            for path in glob.glob(f"{glob.escape(self.checkpoint_path)}.*")
+            if path.rpartition(".")[2].isdigit()
+        ]
+        if os.path.exists(self.checkpoint_path):
+            paths.append(self.checkpoint_path)
+        checkpoints = []
+        for path in sorted(paths):
+            start = time.perf_counter()
+            try:
+                checkpoints.append(Checkpoint.read(path))
+            except (OSError, ValueError) as e:
+                # start fresh rather than not at all
+                log.failure("STARTUP", "can't restore from %s: %s", path, e)
+                continue
+            log.startup(
+                "read checkpoint of %s miners from %s in %.0fms",
+                len(checkpoints[-1]),
+                path,
+                (time.perf_counter() - start) * 1000,
+            )
+        # a miner in several of them, after changing the number of workers, gets
+        # its latest state
+        checkpoints.sort(key=lambda checkpoint: checkpoint.created or 0, reverse=True)
+        return checkpoints
+
+    def advance_clock(self, seconds: float) -> int:
+        """Step a manual clock, running the faults and shares due on the way.
+
+        Returns:
+            The number of events run.
+        """
+        return self.faults.timers.advance(seconds)
+
+    async def _checkpoint_every(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.checkpoint()
+            except (OSError, ValueError) as e:
+                log.failure("STARTUP", "checkpoint failed: %s", e)
+
+    def start_admin(self, host: str = "127.0.0.1", port: int = None):
+        if self._stopping is None:
+            self._stopping = asyncio.Event()
+        port = port if port is not None else self.manifest.admin_port
+        self._admin_task = asyncio.create_task(
+            self.admin.run(host, port, shutdown_trigger=self._stopping.wait)
+        )
+        log.startup(f"admin api on {host}:{port}")
+
+    def install_signal_handlers(self):
+        """SIGUSR1 starts or stops a cProfile session of this process, SIGHUP
+        reloads the manifest file, SIGINT and SIGTERM cancel the running task
+        so the fleet stops cleanly."""
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, task.cancel)
+            except NotImplementedError:
+                # windows, KeyboardInterrupt still stops it, without the cleanup
+                break
+        if hasattr(signal, "SIGUSR1"):
+            loop.add_signal_handler(signal.SIGUSR1, self.admin.profiler.toggle)
+        if hasattr(signal, "SIGHUP") and self.path is not None:
+            loop.add_signal_handler(
+                signal.SIGHUP,
+                lambda: asyncio.ensure_future(self._reload_file_logged()),
+            )
+
+    async def stop(self):
+        if self._stopping is not None:
+            self._stopping.set()
+        if self._admin_task is not None:
+            await asyncio.gather(self._admin_task, return_exceptions=True)
+            self._admin_task = None
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+            self._monitor_task = None
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            self._watch_task = None
+        if self._checkpoint_task is not None:
+            self._checkpoint_task.cancel()
+            self._checkpoint_task = None
+        METRICS.remove_waiter(self._first_request)
+        if self.checkpoint_path is not None and self.miners:
+            try:
+                await self.checkpoint()
+            except (OSError, ValueError) as e:
+                log.failure("STARTUP", "checkpoint failed: %s", e)
+        await asyncio.gather(*(miner.stop() for miner in self.miners.values()))
+        for miner in self.miners.values():
+            self.faults.remove(miner.backend)
+        self.miners = {}
+
+    async def serve(
+        self,
+        specs: list[MinerSpec] = None,
+        admin_port: int = None,
+        on_ready: Callable[[], None] = None,
+        watch: bool = False,
+        restore: bool = False,
+        checkpoint_interval: float = None,
+    ):
+        """Start the fleet and run until cancelled.
+
+        Parameters:
+            specs: The miners to run, all of the manifest by default.
+            admin_port: Overrides the manifest's admin port.
+            on_ready: Called once every miner is listening.
+            watch: Reload when the manifest file changes.
+            restore: Start miners with the state from the checkpoint, if any.
+            checkpoint_interval: Seconds between checkpoints, there is always
+                one when the fleet stops.
+        """
+        self.install_signal_handlers()
+        self._monitor_task = asyncio.create_task(self.monitor.run())
+        admin_port = admin_port if admin_port is not None else self.manifest.admin_port
+        if admin_port is not None:
+            self.start_admin(port=admin_port)
+        if restore:
+            self._restoring = self.load_checkpoints()
+            if self._restoring and self.clock.virtual:
+                # carry on from the time the miners were at, not real time
+                self.clock.set(max(c.clock_time or 0 for c in self._restoring))
+        await self.start(specs)
+        if self._restoring:
+            log.startup("%s miners restored from checkpoints", self.stats.restored)
+            self._restoring = []
+        if on_ready is not None:
+            on_ready()
+        if watch:
+            self.watch()
+        if checkpoint_interval and self.checkpoint_path is not None:
+            self._checkpoint_task = asyncio.create_task(
+                self._checkpoint_every(checkpoint_interval)
+            )
+        try:
+            await asyncio.gather(self.faults.run(), self.timers.run())
+        finally:
+            await self.stop()
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except asyncio.CancelledError:
+            pass
@@ -0,0 +1,239 @@
+"""Bulk control of a running fleet.
+
+A control request selects miners and applies mutations to all of them:
+
+    {
+        "selector": {"model": "S19j", "address": "127.0.1.0/24", "fraction": 0.05},
+        "mutations": [
+            {"action": "mining", "mining": false},
+            {"action": "board", "board": 2, "working": false},
+            {"action": "fan", "pwm": 50},
+            {"action": "pools", "pools": [{"url": "stratum+tcp://pool:3333", "user": "w"}]},
+            {"action": "hashrate", "multiplier": 0.8},
+            {"action": "reboot"}
+        ]
+    }
+
+Mutations check their fields when they are read, and every mutation is checked
+against every selected miner before anything is changed.  Then all of them are
+applied without yielding to the event loop, so no request ever sees a partly
+applied change.
+"""
+from __future__ import annotations
+
+import dataclasses
+import ipaddress
+import math
+import random
+from dataclasses import dataclass, field, fields
+from typing import TYPE_CHECKING
+
+from asic_simulator.backend.data import MinerSimulatorBackend, PoolInfo
+from asic_simulator.fleet.manifest import pool_from_conf
+
+if TYPE_CHECKING:
+    from asic_simulator.fleet import FleetMiner
+
+
+def _address_range(address: str) -> tuple[int, int]:
+    """First and last address as ints, from "a.b.c.d", "a-b" or a CIDR network."""
+    if "/" in address:
+        network = ipaddress.ip_network(address, strict=False)
+        return int(network[0]), int(network[-1])
+    first, _, last = address.partition("-")
+    first = int(ipaddress.ip_address(first.strip()))
+    last = int(ipaddress.ip_address(last.strip())) if last else first
+    return first, last
+
+
+@dataclass
+class Selector:
+    """Which miners a control request applies to, every field narrows it down."""
+
+    vendor: str = None
+    firmware: str = None
+    model: str = None
+    address: str = None
+    keys: list[str] = None
+    fraction: float = None
+    # makes random fractions repeatable
+    seed: int = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> Selector:
+        unknown = set(data) - {f.name for f in fields(cls)}
+        if unknown:
+            raise ValueError(f"Unknown selector fields: {', '.join(sorted(unknown))}")
+        selector = cls(**data)
+        if selector.fraction is not None and not 0 <= selector.fraction <= 1:
+            raise ValueError(f"Invalid fraction: {selector.fraction}")
+        if selector.address is not None:
+            _address_range(selector.address)
+        return selector
+
+    def select(self, miners: dict[str, FleetMiner]) -> list[FleetMiner]:
+        if self.keys is not None:
+            candidates = [miners[k] for k in self.keys if k in miners]
+        else:
+            candidates = list(miners.values())
+        if self.address is not None:
+            first, last = _address_range(self.address)
+        selected = []
+        for miner in candidates:
+            spec = miner.spec
+            if self.vendor is not None and spec.vendor != self.vendor:
+                continue
+            if self.firmware is not None and spec.firmware != self.firmware:
+                continue
+            if self.model is not None and spec.model != self.model:
+                continue
+            if self.address is not None and not (
+                first <= int(ipaddress.ip_address(spec.host)) <= last
+            ):
+                continue
+            selected.append(miner)
+        if self.fraction is not None:
+            count = round(len(selected) * self.fraction)
+            selected = random.Random(self.seed).sample(selected, count)
+        return selected
+
+
+def _check_type(name: str, value, types: type | tuple[type, ...]):
+    # bools are ints too, but only valid where a bool is expected
+    if not isinstance(value, types) or (isinstance(value, bool) and types is not bool):
+        raise ValueError(f"Invalid {name}: {value!r}")
+
+
+class Mutation:
+    action: str = None
+
+    def check(self, backend: MinerSimulatorBackend):
+        """Raise ValueError if the mutation can't be applied to this miner."""
+
+    def apply(self, backend: MinerSimulatorBackend):
+        raise NotImplementedError
+
+
+@dataclass
+class SetMining(Mutation):
+    action = "mining"
+    mining: bool = False
+
+    def __post_init__(self):
+        _check_type("mining", self.mining, bool)
+
+    def apply(self, backend: MinerSimulatorBackend):
+        backend.mining = self.mining
+
+
+@dataclass
+class SetBoard(Mutation):
+    action = "board"
+    board: int = 0
+    working: bool = False
+
+    def __post_init__(self):
+        _check_type("board", self.board, int)
+        _check_type("working", self.working, bool)
+
+    def check(self, backend: MinerSimulatorBackend):
+        if not 0 <= self.board < backend.miner_info.board_count:
+            raise ValueError(f"{backend.miner_info.type} has no board {self.board}")
+
+    def apply(self, backend: MinerSimulatorBackend):
+        backend.set_board_working(self.board, self.working)
+
+
+@dataclass
+class SetFan(Mutation):
+    action = "fan"
+    # None hands the fans back to automatic control
+    pwm: float = None
+
+    def __post_init__(self):
+        if self.pwm is not None:
+            _check_type("fan pwm", self.pwm, (int, float))
+            if not (math.isfinite(self.pwm) and 0 <= self.pwm <= 100):
+                raise ValueError(f"Invalid fan pwm: {self.pwm}")
+
+    def apply(self, backend: MinerSimulatorBackend):
+        if self.pwm is None:
+            backend.set_fan_control(manual=False, speed=backend.fan_speed)
+        else:
+            backend.set_fan_control(manual=True, speed=self.pwm)
+
+
+@dataclass
+class SetPools(Mutation):
+    action = "pools"
+    pools: list[dict] = field(default_factory=list)
+
+    def __post_init__(self):
+        _check_type("pools", self.pools, list)
+        self._pools: list[PoolInfo] = []
+        for pool in self.pools:
+            _check_type("pool", pool, dict)
+            if "url" not in pool or "user" not in pool:
+                raise ValueError("Pools need a url and a user")
+            try:
+                self._pools.append(pool_from_conf(**pool))
+            except (AttributeError, TypeError, ValueError) as e:
+                raise ValueError(f"Invalid pool {pool['url']!r}: {e}")
+
+    def apply(self, backend: MinerSimulatorBackend):
+        # every miner gets its own pools, their state changes independently
+        backend.pools = [dataclasses.replace(pool) for pool in self._pools]
+
+
+@dataclass
+class SetHashrate(Mutation):
+    action = "hashrate"
+    multiplier: float = 1.0
+
+    def __post_init__(self):
+        _check_type("hashrate multiplier", self.multiplier, (int, float))
+        if not (math.isfinite(self.multiplier) and self.multiplier >= 0):
+            raise ValueError(f"Invalid hashrate multiplier: {self.multiplier}")
+
+    def apply(self, backend: MinerSimulatorBackend):
+        backend.set_hashrate_multiplier(self.multiplier)
+
+
+@dataclass
+class Reboot(Mutation):
+    action = "reboot"
+
+    def apply(self, backend: MinerSimulatorBackend):
+        backend.reboot()
+
+
+MUTATIONS = {
+    m.action: m for m in (SetMining, SetBoard, SetFan, SetPools, SetHashrate, Reboot)
+}
+
+
+def mutation_from_dict(data: dict) -> Mutation:
+    data = dict(data)
+    action = data.pop("action", None)
+    if action not in MUTATIONS:
+        raise ValueError(f"Unknown action: {action}")
+    try:
+        return MUTATIONS[action](**data)
+    except TypeError as e:
+        raise ValueError(f"Invalid {action} mutation: {e}")
+
+
+def apply_mutations(miners: list[FleetMiner], mutations: list[Mutation]) -> int:
+    """Check every mutation on every miner, then apply them all.
+
+    Returns:
+        The number of miners changed.
+    """
+    for miner in miners:
+        for mutation in mutations:
+            mutation.check(miner.backend)
+    # no awaits from here on, the change is atomic as far as requests can tell
+    for miner in miners:
+        for mutation in mutations:
+            mutation.apply(miner.backend)
+    return len(miners)
@@ -0,0 +1,220 @@
+"""Fleet manifests, describing a set of simulated miners.
+
+A manifest is a JSON or TOML file like this:
+
+    seed = 42          # optional, defaults to ASIC_SIMULATOR_SEED
+    batch_size = 500   # optional, miners built and started at a time
+    admin_port = 9400  # optional, local admin API with /metrics
+    corpus = "captures.bin"  # optional, recorded responses, see asic_simulator.replay
+    clock = 60         # optional, "real", "manual" or a speed, see asic_simulator.clock
+
+    [faults]           # optional, fleet wide fault rates, see FaultRates
+    board = 0.05
+
+    [network]          # optional, fleet wide network conditions, see NetworkProfile
+    latency = 0.05
+
+    [limits.rpc]       # optional, fleet wide access limits, see asic_simulator.limits
+    concurrency = 1
+
+    [[miners]]
+    vendor = "antminer"
+    firmware = "stock"     # optional
+    model = "S19j"
+    count = 100            # optional, defaults to 1
+    address = "127.0.1.1"  # first address, incremented for each miner
+    mode = "full"          # optional, "full" or "rpc"
+    ports = {rpc = 4028}   # optional, per vendor defaults
+    pools = [{url = "stratum+tcp://pool.io:3333", user = "worker", pass = "x"}]
+    faults = {fan = 1.0}   # optional, overrides the fleet wide rates
+    replay = true          # optional, answer from the corpus where it has a capture
+    stratum = true         # optional, mine on the active pool, see asic_simulator.stratum
+    network = {reset = 0.01}  # optional, overrides the fleet wide network conditions
+    limits = {web = {rate = 2}}  # optional, overrides the fleet wide access limits
+"""
+from __future__ import annotations
+
+import ipaddress
+import json
+import os
+from dataclasses import asdict, dataclass, field
+
+from asic_simulator.backend.data import PoolInfo
+from asic_simulator.backend.faults import FaultRates
+from asic_simulator.clock import clock_from_conf
+from asic_simulator.limits import AccessLimits, limits_from_dict
+from asic_simulator.network import NetworkProfile
+
+try:
+    import tomllib
+except ImportError:
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+MODES = ("full", "rpc")
+
+
+@dataclass
+class MinerSpec:
+    """A single miner, expanded from a group in the manifest."""
+
+    miner_id: int
+    vendor: str
+    firmware: str
+    model: str
+    host: str
+    ports: dict = field(default_factory=dict)
+    mode: str = "full"
+    pools: list[dict] = None
+    faults: FaultRates = None
+    replay: bool = False
+    stratum: bool = False
+    # None is an undisturbed network
+    network: NetworkProfile = None
+    # by interface, the ones missing are unlimited
+    limits: dict[str, AccessLimits] = field(default_factory=dict)
+
+    @property
+    def key(self) -> str:
+        return f"{self.host}:{self.ports.get('rpc', 4028)}"
+
+    def make_pools(self) -> list[PoolInfo] | None:
+        if self.pools is None:
+            return None
+        return [pool_from_conf(**p) for p in self.pools]
+
+
+@dataclass
+class MinerGroup:
+    vendor: str
+    model: str
+    address: str
+    firmware: str = "stock"
+    count: int = 1
+    mode: str = "full"
+    ports: dict = field(default_factory=dict)
+    pools: list[dict] = None
+    faults: dict = None
+    replay: bool = False
+    stratum: bool = False
+    network: dict = None
+    limits: dict = None
+
+    def expand(
+        self,
+        first_id: int,
+        fleet_faults: FaultRates,
+        fleet_network: NetworkProfile = None,
+        fleet_limits: dict[str, AccessLimits] = None,
+    ) -> list[MinerSpec]:
+        start = ipaddress.ip_address(self.address)
+        if start.is_unspecified and self.count > 1:
+            raise ValueError(f"Only one miner can listen on {self.address}")
+        faults = fleet_faults
+        if self.faults is not None:
+            faults = FaultRates.from_dict({**asdict(fleet_faults), **self.faults})
+        network = fleet_network if fleet_network is not None else NetworkProfile()
+        if self.network is not None:
+            network = NetworkProfile.from_dict({**asdict(network), **self.network})
+        limits = fleet_limits or {}
+        if self.limits is not None:
+            limits = limits_from_dict(self.limits, limits)
+        return [
+            MinerSpec(
+                miner_id=first_id + i,
+                vendor=self.vendor,
+                firmware=self.firmware,
+                model=self.model,
+                host=str(start + i),
+                ports=self.ports,
+                mode=self.mode,
+                pools=self.pools,
+                faults=faults,
+                replay=self.replay,
+                stratum=self.stratum,
+                network=network if network.enabled else None,
+                limits=limits,
+            )
+            for i in range(self.count)
+        ]
+
+
+@dataclass
+class FleetManifest:
+    groups: list[MinerGroup] = field(default_factory=list)
+    seed: int = None
+    batch_size: int = 500
+    admin_port: int = None
+    corpus: str = None
+    faults: FaultRates = field(default_factory=FaultRates)
+    network: NetworkProfile = field(default_factory=NetworkProfile)
+    limits: dict[str, AccessLimits] = field(default_factory=dict)
+    clock: str | float = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> FleetManifest:
+        data = dict(data)
+        groups = []
+        for group in data.pop("miners", []):
+            group = MinerGroup(**group)
+            if group.mode not in MODES:
+                raise ValueError(f"Unknown mode: {group.mode}")
+            if group.count < 0:
+                raise ValueError(f"Invalid miner count: {group.count}")
+            if group.replay and data.get("corpus") is None:
+                raise ValueError("Replaying miners need a corpus")
+            groups.append(group)
+        faults = FaultRates.from_dict(data.pop("faults", {}))
+        network = NetworkProfile.from_dict(data.pop("network", {}))
+        limits = limits_from_dict(data.pop("limits", {}))
+        # fail on a bad clock now rather than when the fleet starts
+        clock_from_conf(data.get("clock"))
+        return cls(groups=groups, faults=faults, network=network, limits=limits, **data)
+
+    def specs(self) -> list[MinerSpec]:
+        specs = []
+        for group in self.groups:
+            specs.extend(
+                group.expand(len(specs), self.faults, self.network, self.limits)
+            )
+        keys = set()
+        for spec in specs:
+            if spec.key in keys:
+                raise ValueError(f"Duplicate miner address: {spec.key}")
+            keys.add(spec.key)
+        return specs
+
+    def __len__(self) -> int:
+        return sum(group.count for group in self.groups)
+
+
+def pool_from_conf(url: str, user: str, **conf) -> PoolInfo:
+    """Create a pool from the format used by the miner configs, url, user and pass."""
+    pwd = conf.get("pass", conf.get("pwd", ""))
+    if url == "":
+        return PoolInfo(url="", port="", user=user, pwd=pwd)
+    address = url.split("://")[-1]
+    host, _, port = address.partition(":")
+    pool = PoolInfo(url=host, port=int(port) if port else 3333, user=user, pwd=pwd)
+    if "difficulty" in conf:
+        pool.difficulty = float(conf["difficulty"])
+    return pool
+
+
+def load_manifest(path: str) -> FleetManifest:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".toml":
+        if tomllib is None:
+            raise RuntimeError(
+                "Reading TOML manifests needs python 3.11 or tomli, use JSON instead."
+            )
+        with open(path, "rb") as f:
+            data = tomllib.load(f)
+    elif ext == ".json":
+        with open(path) as f:
+            data = json.load(f)
+    else:
+        raise ValueError(f"Unknown manifest format: {ext}")
+    return FleetManifest.from_dict(data)
@@ -0,0 +1,133 @@
+"""Reloading a running fleet from a changed manifest.
+
+Miners are matched by key (address and RPC port).  Miners missing from the new
+manifest stop, new ones start, and the rest keep their backend, so their
+uptime, averages and active faults carry on:
+
+- pool, fault, network and limit changes are applied to the running miner,
+- a different mode or ports restarts that miner's listeners,
+- a different model replaces the miner with a new one,
+- anything else is left alone.
+
+A reload that fails part way, like a new miner's port being taken, puts the
+fleet back the way it was.
+
+Miner ids seed each miner's random stream and MAC, so running miners keep
+theirs even if the manifest numbers them differently now, and new miners only
+get their manifest id if no running miner has it.
+"""
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import os
+import zlib
+from typing import Awaitable, Callable
+
+from asic_simulator import log
+from asic_simulator.fleet.manifest import MinerSpec
+
+# changing these needs a new backend
+REBUILD_FIELDS = ("vendor", "firmware", "model", "replay")
+# and these new listeners
+RESTART_FIELDS = ("ports", "mode")
+WATCH_INTERVAL = 2.0
+
+
+@dataclasses.dataclass
+class ManifestDiff:
+    start: list[MinerSpec] = dataclasses.field(default_factory=list)
+    stop: list[str] = dataclasses.field(default_factory=list)
+    rebuild: list[MinerSpec] = dataclasses.field(default_factory=list)
+    restart: list[MinerSpec] = dataclasses.field(default_factory=list)
+    update: list[MinerSpec] = dataclasses.field(default_factory=list)
+    # miner id of every key in the new manifest, across all workers
+    ids: dict[str, int] = dataclasses.field(default_factory=dict)
+
+    def summary(self) -> dict[str, int]:
+        return {
+            "started": len(self.start),
+            "stopped": len(self.stop),
+            "rebuilt": len(self.rebuild),
+            "restarted": len(self.restart),
+            "updated": len(self.update),
+        }
+
+
+def owner(key: str, workers: int) -> int:
+    """The worker that runs a miner added by a reload."""
+    return zlib.crc32(key.encode()) % workers
+
+
+def diff_manifest(
+    running: dict[str, MinerSpec],
+    ids: dict[str, int],
+    specs: list[MinerSpec],
+    worker: int = 0,
+    workers: int = 1,
+) -> ManifestDiff:
+    """Work out what has to change to go from the running miners to `specs`.
+
+    Parameters:
+        running: The specs of the miners this worker runs, by key.
+        ids: The miner id of every key in the fleet, across all workers.
+        specs: Every miner in the new manifest.
+        worker: The index of this worker.
+        workers: How many workers the fleet is split over.  Miners keep their
+            worker, new ones are spread over them by key.
+    """
+    diff = ManifestDiff()
+    keys = {spec.key for spec in specs}
+    kept = {key: i for key, i in ids.items() if key in keys}
+    used = set(kept.values())
+    next_id = max([*used, *(spec.miner_id for spec in specs)], default=-1) + 1
+    for spec in specs:
+        if spec.key in kept:
+            miner_id = kept[spec.key]
+        elif spec.miner_id not in used:
+            miner_id = spec.miner_id
+        else:
+            miner_id = next_id
+            next_id += 1
+        used.add(miner_id)
+        diff.ids[spec.key] = miner_id
+        spec = dataclasses.replace(spec, miner_id=miner_id)
+
+        old = running.get(spec.key)
+        if old is None:
+            if spec.key not in ids and owner(spec.key, workers) == worker:
+                diff.start.append(spec)
+        elif any(getattr(old, f) != getattr(spec, f) for f in REBUILD_FIELDS):
+            diff.rebuild.append(spec)
+        elif any(getattr(old, f) != getattr(spec, f) for f in RESTART_FIELDS):
+            diff.restart.append(spec)
+        elif old != spec:
+            diff.update.append(spec)
+    diff.stop = [key for key in running if key not in keys]
+    return diff
+
+
+async def watch_file(
+    path: str,
+    on_change: Callable[[], Awaitable[None]],
+    interval: float = WATCH_INTERVAL,
+):
+    """Call `on_change` whenever the file's modification time or size changes."""
+
+    def _stat():
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    last = _stat()
+    while True:
+        await asyncio.sleep(interval)
+        current = _stat()
+        # a file being rewritten may be missing for a moment, wait for it
+        if current is None or current == last:
+            continue
+        last = current
+        log.startup("%s changed, reloading", path)
+        await on_change()
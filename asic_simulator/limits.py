@@ -0,0 +1,297 @@
+"""Limits on how much a miner's API servers answer at once.
+
+Real firmware serializes its API: cgminer's RPC thread answers one connection at
+a time and the web servers only run a few CGI scripts in parallel, so pollers
+that open too many connections see them stall or fail.  Each interface of a
+miner can be limited to a number of concurrent requests and a token bucket
+request rate, and requests over the limits are either
+
+- queued until there is room ("queue"), up to `queue` waiting if it's set,
+- closed without an answer ("refuse"), or
+- reset ("reset").
+
+Admitting a request is O(1) and takes no task or timer, only queued requests
+wait, on a future that a finished request or a timer on the fleet's shared
+TimerQueue resolves.
+"""
+from __future__ import annotations
+
+import asyncio
+import collections
+from dataclasses import asdict, dataclass, fields
+
+from asic_simulator.metrics import METRICS, Metrics
+from asic_simulator.network import reset_connection
+from asic_simulator.timers import TimerHandle, TimerQueue
+
+INTERFACES = ("rpc", "web")
+OVERLOAD = ("queue", "refuse", "reset")
+# bytes read from a refused connection, RPC requests are far smaller
+REQUEST_SIZE = 65536
+
+
+@dataclass
+class AccessLimits:
+    # requests answered at once, 0 is unlimited
+    concurrency: int = 0
+    # requests per second, 0 is unlimited, and how many can come at once after a
+    # quiet period, at least one
+    rate: float = 0.0
+    burst: float = 0.0
+    # what happens to requests over the limits, see OVERLOAD
+    overload: str = "queue"
+    # most requests waiting when queueing, more are refused, 0 is unlimited
+    queue: int = 0
+
+    @classmethod
+    def from_dict(cls, data: dict) -> AccessLimits:
+        names = {f.name for f in fields(cls)}
+        unknown = set(data) - names
+        if unknown:
+            raise ValueError(f"Unknown limit settings: {', '.join(sorted(unknown))}")
+        limits = cls(**data)
+        if limits.overload not in OVERLOAD:
+            raise ValueError(f"Unknown overload behavior: {limits.overload}")
+        for name in ("concurrency", "rate", "burst", "queue"):
+            if getattr(limits, name) < 0:
+                raise ValueError(f"Invalid limit {name}: {getattr(limits, name)}")
+        return limits
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.concurrency or self.rate)
+
+    @property
+    def bucket_size(self) -> float:
+        return max(1.0, self.burst)
+
+
+def limits_from_dict(
+    data: dict, base: dict[str, AccessLimits] = None
+) -> dict[str, AccessLimits]:
+    """Read the limits of each interface, like {"rpc": {"concurrency": 1}}.
+
+    Parameters:
+        data: The settings to change, by interface.
+        base: The limits they change, by interface.
+
+    Returns:
+        The limits of every interface that has any.
+    """
+    unknown = set(data) - set(INTERFACES)
+    if unknown:
+        raise ValueError(f"Unknown limited interfaces: {', '.join(sorted(unknown))}")
+    base = base or {}
+    result = {}
+    for interface in INTERFACES:
+        settings = asdict(base[interface]) if interface in base else {}
+        limits = AccessLimits.from_dict({**settings, **data.get(interface, {})})
+        if limits.enabled:
+            result[interface] = limits
+    return result
+
+
+class LimitStats:
+    """Requests of every limited miner interface of the process."""
+
+    def __init__(self, metrics: Metrics = METRICS):
+        self.queued = 0
+        self.rejected = 0
+        self.waiting = 0
+        metrics.add_collector(self.collect)
+
+    def collect(self) -> list[str]:
+        total = "asic_simulator_limited_requests_total"
+        waiting = "asic_simulator_limited_requests_waiting"
+        return [
+            f"# HELP {total} Requests over a miner's access limits, by outcome.",
+            f"# TYPE {total} counter",
+            f'{total}{{outcome="queued"}} {self.queued}',
+            f'{total}{{outcome="rejected"}} {self.rejected}',
+            f"# HELP {waiting} Requests queued for a miner's access limits.",
+            f"# TYPE {waiting} gauge",
+            f"{waiting} {self.waiting}",
+        ]
+
+
+LIMIT_STATS = LimitStats()
+
+
+class AccessLimiter:
+    """Admits the requests of one interface of a miner within its limits.
+
+    A request is either admitted right away, waits in `wait`, or is turned away
+    with `reject`.  Every admitted request has to be released when it's done.
+    None limits admit everything, they can be replaced while the miner runs.
+    """
+
+    __slots__ = (
+        "limits",
+        "timers",
+        "stats",
+        "active",
+        "tokens",
+        "updated",
+        "_waiters",
+        "_refill",
+    )
+
+    def __init__(
+        self,
+        limits: AccessLimits | None,
+        timers: TimerQueue,
+        stats: LimitStats = LIMIT_STATS,
+    ):
+        self.limits = limits
+        self.timers = timers
+        self.stats = stats
+        self.active = 0
+        self.tokens = limits.bucket_size if limits is not None else 0.0
+        self.updated = timers.now()
+        self._waiters: collections.deque[asyncio.Future] = collections.deque()
+        # wakes the first waiter once the bucket has a token for it
+        self._refill: TimerHandle | None = None
+
+    def set_limits(self, limits: AccessLimits | None):
+        self.limits = limits
+        self.tokens = limits.bucket_size if limits is not None else 0.0
+        self.updated = self.timers.now()
+        if self._refill is not None:
+            self._refill.cancel()
+            self._refill = None
+        self._wake()
+
+    def admit(self) -> bool:
+        """Admit a request if it's within the limits and nothing is queued."""
+        if self._waiters or not self._available():
+            return False
+        self._take()
+        return True
+
+    async def wait(self) -> bool:
+        """Wait until a request is admitted.
+
+        Returns:
+            False if the request isn't queued but has to be rejected.
+        """
+        limits = self.limits
+        if limits is not None and (
+            limits.overload != "queue"
+            or (limits.queue and len(self._waiters) >= limits.queue)
+        ):
+            self.stats.rejected += 1
+            return False
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self.stats.queued += 1
+        self.stats.waiting += 1
+        self._wake()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # admitted just as the request was cancelled
+                self.release()
+            raise
+        finally:
+            self.stats.waiting -= 1
+        return True
+
+    async def reject(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Turn away a connection without an answer."""
+        if self.limits is not None and self.limits.overload == "reset":
+            reset_connection(writer)
+            return
+        try:
+            # closing with the request unread would reset the connection too
+            await reader.read(REQUEST_SIZE)
+        except OSError:
+            pass
+        writer.close()
+
+    def release(self):
+        self.active -= 1
+        if self._waiters:
+            self._wake()
+
+    def _available(self) -> bool:
+        limits = self.limits
+        if limits is None:
+            return True
+        if limits.concurrency and self.active >= limits.concurrency:
+            return False
+        if limits.rate:
+            now = self.timers.now()
+            self.tokens = min(
+                limits.bucket_size, self.tokens + (now - self.updated) * limits.rate
+            )
+            self.updated = now
+            if self.tokens < 1:
+                return False
+        return True
+
+    def _take(self):
+        self.active += 1
+        if self.limits is not None and self.limits.rate:
+            self.tokens -= 1
+
+    def _wake(self):
+        waiters = self._waiters
+        while waiters:
+            if waiters[0].done():
+                # cancelled while waiting
+                waiters.popleft()
+                continue
+            if not self._available():
+                break
+            self._take()
+            waiters.popleft().set_result(None)
+        limits = self.limits
+        if (
+            waiters
+            and self._refill is None
+            and limits.rate
+            and not (limits.concurrency and self.active >= limits.concurrency)
+        ):
+            # short of tokens, not slots, nothing else would wake the queue
+            self._refill = self.timers.call_later(
+                (1 - self.tokens) / limits.rate, self._refilled
+            )
+
+    def _refilled(self):
+        self._refill = None
+        self._wake()
+
+
+class LimitMiddleware:
+    """ASGI middleware holding a web server's requests to its miner's limits.
+
+    Refused requests are answered 503, reset ones get their headers and then
+    the connection is closed, ASGI has no access to the socket.
+    """
+
+    def __init__(self, app, limiter: AccessLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        limiter = self.limiter
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        if not limiter.admit() and not await limiter.wait():
+            reset = limiter.limits is not None and limiter.limits.overload == "reset"
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 503,
+                    "headers": [] if reset else [(b"content-length", b"0")],
+                }
+            )
+            if not reset:
+                await send({"type": "http.response.body", "body": b""})
+            # otherwise hypercorn closes the connection, the body never ended
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
@@ -1,4 +1,19 @@
+"""Simulator logging.
+
+Messages take printf style arguments, `log.success("RPC", "%s, new_api", cmd)`,
+and are only formatted once they are known to be written.  `configure` can move
+writing to a background thread, limit how many messages per second each
+category (RPC, WEB, ...) writes, or turn logging off entirely.
+
+Failures are written at WARNING, so a higher level quiets the successes but
+keeps them, and they are sampled apart from successes so a busy category does
+not use up the allowance its errors need.
+"""
+import atexit
 import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
 
 try:
     import colorama
@@ -22,29 +37,159 @@ except ImportError:
     COLOR = False
     logging.basicConfig(level=logging.INFO, format="%(message)s")
 
+if COLOR:
+    SUCCESS_FORMAT = (
+        "[[bold white]MinerSimulator[/]][[bold green]%s - ✓[/]]: [italic blue]%s[/]"
+    )
+    FAILURE_FORMAT = (
+        "[[bold white]MinerSimulator[/]][[bold red]%s - ✗[/]]: [italic blue]%s[/]"
+    )
+    STARTUP_FORMAT = (
+        "[[bold white]MinerSimulator[/]][[bold yellow]%s[/]]: [italic blue]%s[/]"
+    )
+else:
+    SUCCESS_FORMAT = "[MinerSimulator][%s - ✓]: %s"
+    FAILURE_FORMAT = "[MinerSimulator][%s - ✗]: %s"
+    STARTUP_FORMAT = "[MinerSimulator][%s]: %s"
 
-def success(fn_type: str, message: str):
-    if COLOR:
-        logging.info(
-            f"[[bold white]MinerSimulator[/]][[bold green]{fn_type} - ✓[/]]: [italic blue]{message}[/]"
-        )
-    else:
-        logging.info(f"[MinerSimulator][{fn_type} - ✓]: {message}")
+_logger = logging.getLogger()
+# the handlers that actually write, kept aside while a background thread runs
+_handlers = list(_logger.handlers)
+_listener: QueueListener = None
+_enabled = True
+_rates: dict[str, float] = {}
+_default_rate: float = None
+_samplers: dict = {}
+_failure_samplers: dict = {}
 
 
-def failure(fn_type: str, message: str):
-    if COLOR:
-        logging.info(
-            f"[[bold white]MinerSimulator[/]][[bold red]{fn_type} - ✗[/]]: [italic blue]{message}[/]"
-        )
-    else:
-        logging.info(f"[MinerSimulator][{fn_type} - ✗]: {message}")
+class _Message:
+    """A message with its arguments, formatted when the record is written."""
+
+    __slots__ = ("message", "args")
+
+    def __init__(self, message: str, args: tuple):
+        self.message = message
+        self.args = args
+
+    def __str__(self):
+        return self.message % self.args if self.args else self.message
+
+
+class _Sampler:
+    """Let through at most `rate` messages of a category per second."""
+
+    __slots__ = ("rate", "level", "window", "count", "suppressed")
+
+    def __init__(self, rate: float, level: int = logging.INFO):
+        self.rate = rate
+        # suppressed messages are reported at the level they would have had
+        self.level = level
+        self.window = 0
+        self.count = 0
+        self.suppressed = 0
+
+    def allow(self, fn_type: str) -> bool:
+        window = int(time.monotonic())
+        if window != self.window:
+            if self.suppressed:
+                _logger.log(
+                    self.level,
+                    STARTUP_FORMAT,
+                    fn_type,
+                    f"{self.suppressed} messages suppressed by sampling",
+                )
+            self.window = window
+            self.count = 0
+            self.suppressed = 0
+        if self.count < self.rate:
+            self.count += 1
+            return True
+        self.suppressed += 1
+        return False
+
+
+class _BackgroundHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the queue never leaves the process, so skip formatting the message
+        # here and let the listener thread do it
+        return record
 
 
-def startup(message: str):
-    if COLOR:
-        logging.info(
-            f"[[bold white]MinerSimulator[/]][[bold yellow]STARTUP[/]]: [italic blue]{message}[/]"
-        )
+def configure(
+    level: int | str = None,
+    enabled: bool = True,
+    background: bool = False,
+    rate: float = None,
+    rates: dict[str, float] = None,
+):
+    """Set up logging for this process.
+
+    Parameters:
+        level: The log level, messages below it are never formatted.
+        enabled: Whether to log at all, when off logging calls return at once.
+        background: Write records from a thread instead of the event loop.
+        rate: Messages per second allowed for each category, None for no limit.
+        rates: Per category overrides of `rate`.
+    """
+    global _enabled, _rates, _default_rate, _samplers, _failure_samplers, _listener
+
+    if level is not None:
+        _logger.setLevel(level)
+    _enabled = enabled
+    _rates = {k: v for k, v in (rates or {}).items() if v is not None}
+    _default_rate = rate
+    _samplers = {}
+    _failure_samplers = {}
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if background:
+        records = queue.SimpleQueue()
+        _listener = QueueListener(records, *_handlers, respect_handler_level=True)
+        _logger.handlers = [_BackgroundHandler(records)]
+        _listener.start()
     else:
-        logging.info(f"[MinerSimulator][STARTUP]: {message}")
+        _logger.handlers = list(_handlers)
+
+
+def flush():
+    """Stop the background thread, if any, once it has written all records."""
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+        _logger.handlers = list(_handlers)
+
+
+atexit.register(flush)
+
+
+def _should_log(fn_type: str, level: int, samplers: dict) -> bool:
+    if not _enabled or not _logger.isEnabledFor(level):
+        return False
+    sampler = samplers.get(fn_type)
+    if sampler is None:
+        rate = _rates.get(fn_type, _default_rate)
+        if rate is None:
+            return True
+        sampler = samplers[fn_type] = _Sampler(rate, level)
+    return sampler.allow(fn_type)
+
+
+def success(fn_type: str, message: str, *args):
+    if _should_log(fn_type, logging.INFO, _samplers):
+        _logger.info(SUCCESS_FORMAT, fn_type, _Message(message, args))
+
+
+def failure(fn_type: str, message: str, *args):
+    if _should_log(fn_type, logging.WARNING, _failure_samplers):
+        _logger.warning(FAILURE_FORMAT, fn_type, _Message(message, args))
+
+
+def startup(message: str, *args):
+    # startup messages are rare and always wanted, they are never sampled
+    if _enabled and _logger.isEnabledFor(logging.INFO):
+        _logger.info(STARTUP_FORMAT, "STARTUP", _Message(message, args))
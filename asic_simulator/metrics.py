@@ -0,0 +1,272 @@
+"""Request metrics for the simulated miners, rendered in Prometheus text format.
+
+Every handler records into the process wide `METRICS`, labelled by vendor,
+interface (rpc or web) and command.  Recording is a dict lookup, a bisect and a
+few integer additions, so it can stay on for load tests.
+
+Handlers record the synchronous part of answering a command, which is also how
+long they held up the event loop, so commands over `slow_threshold` are counted
+and logged as slow.  Other components (the loop monitor) add their own lines
+with `add_collector`, and can wait for the next request with `add_waiter`.
+"""
+from __future__ import annotations
+
+import bisect
+import weakref
+from typing import Callable
+
+from asic_simulator import log
+
+# seconds, the simulator should answer well under a millisecond
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+)
+
+# seconds a single command may hold the event loop before it counts as slow
+SLOW_THRESHOLD = 0.01
+
+# label used for commands the handler doesn't know, keeps client typos and
+# garbage from growing the label set without bound
+UNKNOWN_COMMAND = "unknown"
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        # the last slot counts values above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((f"{bound:g}", total))
+        result.append(("+Inf", self.count))
+        return result
+
+    def render(self, name: str, labels: str = "") -> list[str]:
+        """The bucket, sum and count samples, without HELP and TYPE lines."""
+        sep = "," if labels else ""
+        lines = [
+            f'{name}_bucket{{{labels}{sep}le="{bound}"}} {count}'
+            for bound, count in self.cumulative()
+        ]
+        labels = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{labels} {self.sum}")
+        lines.append(f"{name}_count{labels} {self.count}")
+        return lines
+
+
+class CommandStats:
+    __slots__ = ("requests", "errors", "slow", "bytes_in", "bytes_out", "latency")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.slow = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latency = Histogram()
+
+
+class InFlight:
+    """Counts the connections or requests currently being served by one server."""
+
+    __slots__ = ("count", "group", "__weakref__")
+
+    def __init__(self, group: InFlightGroup = None):
+        self.count = 0
+        self.group = group
+
+    def __enter__(self):
+        self.count += 1
+        if self.group is not None:
+            self.group.count += 1
+
+    def __exit__(self, *exc_info):
+        self.count -= 1
+        if self.group is not None:
+            self.group.count -= 1
+
+
+class InFlightGroup:
+    """The in flight counts of every server of a vendor/interface.
+
+    Exported as the total and the busiest server rather than a series per
+    server, which would be one per miner.
+    """
+
+    __slots__ = ("count", "servers")
+
+    def __init__(self):
+        self.count = 0
+        # stopped miners' servers drop out by themselves
+        self.servers: weakref.WeakSet[InFlight] = weakref.WeakSet()
+
+    def server(self) -> InFlight:
+        in_flight = InFlight(self)
+        self.servers.add(in_flight)
+        return in_flight
+
+    @property
+    def max(self) -> int:
+        return max((server.count for server in self.servers), default=0)
+
+
+class InFlightMiddleware:
+    """ASGI middleware counting the HTTP requests in flight on a web server."""
+
+    def __init__(self, app, in_flight: InFlight):
+        self.app = app
+        self.in_flight = in_flight
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        with self.in_flight:
+            return await self.app(scope, receive, send)
+
+
+class Metrics:
+    def __init__(self, slow_threshold: float = SLOW_THRESHOLD):
+        self.slow_threshold = slow_threshold
+        self.commands: dict[tuple[str, str, str], CommandStats] = {}
+        self.connections: dict[tuple[str, str], InFlightGroup] = {}
+        self.collectors: list[Callable[[], list[str]]] = []
+        self.waiters: list[Callable[[], None]] = []
+
+    def in_flight(self, vendor: str, interface: str) -> InFlight:
+        """A new server's in flight counter, counted with its vendor/interface."""
+        key = (vendor, interface)
+        if key not in self.connections:
+            self.connections[key] = InFlightGroup()
+        return self.connections[key].server()
+
+    def add_collector(self, collector: Callable[[], list[str]]):
+        """Add a callable returning extra exposition lines, rendered last."""
+        self.collectors.append(collector)
+
+    def remove_collector(self, collector: Callable[[], list[str]]):
+        if collector in self.collectors:
+            self.collectors.remove(collector)
+
+    def add_waiter(self, waiter: Callable[[], None]):
+        """Add a callable to call once, when the next request is recorded."""
+        self.waiters.append(waiter)
+
+    def remove_waiter(self, waiter: Callable[[], None]):
+        if waiter in self.waiters:
+            self.waiters.remove(waiter)
+
+    def observe(
+        self,
+        vendor: str,
+        interface: str,
+        command: str,
+        latency: float,
+        error: bool = False,
+        bytes_in: int = 0,
+        bytes_out: int = 0,
+    ):
+        key = (vendor, interface, command)
+        stats = self.commands.get(key)
+        if stats is None:
+            stats = self.commands[key] = CommandStats()
+        stats.requests += 1
+        stats.errors += error
+        stats.bytes_in += bytes_in
+        stats.bytes_out += bytes_out
+        stats.latency.observe(latency)
+        if latency >= self.slow_threshold:
+            stats.slow += 1
+            log.failure(
+                "SLOW",
+                "%s %s %s blocked the loop for %.1fms",
+                vendor,
+                interface,
+                command,
+                latency * 1000,
+            )
+        if self.waiters:
+            waiters, self.waiters = self.waiters, []
+            for waiter in waiters:
+                waiter()
+
+    def reset(self):
+        self.commands = {}
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        counters = [
+            ("requests_total", "Requests handled.", "requests"),
+            ("errors_total", "Requests answered with an error.", "errors"),
+            ("slow_total", "Requests that blocked the event loop too long.", "slow"),
+            ("received_bytes_total", "Request bytes received.", "bytes_in"),
+            ("sent_bytes_total", "Response bytes sent.", "bytes_out"),
+        ]
+        items = sorted(self.commands.items())
+        for name, help_text, attr in counters:
+            lines.append(f"# HELP asic_simulator_{name} {help_text}")
+            lines.append(f"# TYPE asic_simulator_{name} counter")
+            for key, stats in items:
+                lines.append(
+                    f"asic_simulator_{name}{{{_labels(key)}}} {getattr(stats, attr)}"
+                )
+
+        name = "asic_simulator_request_duration_seconds"
+        lines.append(f"# HELP {name} Time spent answering a request.")
+        lines.append(f"# TYPE {name} histogram")
+        for key, stats in items:
+            lines.extend(stats.latency.render(name, _labels(key)))
+
+        groups = sorted(self.connections.items())
+        for name, help_text, attr in (
+            ("in_flight", "Connections or requests being served.", "count"),
+            (
+                "in_flight_max",
+                "Connections or requests being served by the busiest server.",
+                "max",
+            ),
+        ):
+            lines.append(f"# HELP asic_simulator_{name} {help_text}")
+            lines.append(f"# TYPE asic_simulator_{name} gauge")
+            for (vendor, interface), group in groups:
+                lines.append(
+                    f'asic_simulator_{name}{{vendor="{vendor}",interface="{interface}"}}'
+                    f" {getattr(group, attr)}"
+                )
+
+        for collector in self.collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+def _labels(key: tuple[str, str, str]) -> str:
+    vendor, interface, command = key
+    return f'vendor="{vendor}",interface="{interface}",command="{command}"'
+
+
+METRICS = Metrics()
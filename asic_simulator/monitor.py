@@ -0,0 +1,73 @@
+"""Event loop saturation monitoring.
+
+The monitor sleeps for a fixed interval and measures how late it wakes up.  On
+an idle loop the lag is close to zero; when handlers hold the loop it grows,
+before clients polling the miners start timing out.  Which commands held it is
+recorded by `METRICS` as slow requests.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+
+from asic_simulator import log
+from asic_simulator.metrics import METRICS, Histogram, Metrics
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class LoopMonitor:
+    def __init__(
+        self,
+        interval: float = 0.5,
+        warn_lag: float = 0.25,
+        max_window: float = 60,
+        metrics: Metrics = METRICS,
+    ):
+        self.interval = interval
+        self.warn_lag = warn_lag
+        self.lag = 0.0
+        # (time, lag) of the measurements in the last max_window seconds
+        self.max_window = max_window
+        self.recent: deque[tuple[float, float]] = deque()
+        self.histogram = Histogram(LAG_BUCKETS)
+        self.metrics = metrics
+
+    async def run(self):
+        # exported while running only, so stopped fleets leave no duplicates
+        self.metrics.add_collector(self.collect)
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                start = loop.time()
+                await asyncio.sleep(self.interval)
+                self.lag = max(0.0, loop.time() - start - self.interval)
+                now = time.monotonic()
+                self.recent.append((now, self.lag))
+                while self.recent[0][0] < now - self.max_window:
+                    self.recent.popleft()
+                self.histogram.observe(self.lag)
+                if self.lag >= self.warn_lag:
+                    log.failure("LOOP", "event loop lagging by %.0fms", self.lag * 1000)
+        finally:
+            self.metrics.remove_collector(self.collect)
+
+    @property
+    def max_lag(self) -> float:
+        """The largest lag measured in the last `max_window` seconds."""
+        since = time.monotonic() - self.max_window
+        return max((lag for t, lag in self.recent if t >= since), default=0.0)
+
+    def collect(self) -> list[str]:
+        return [
+            "# HELP asic_simulator_loop_lag_seconds Last measured event loop lag.",
+            "# TYPE asic_simulator_loop_lag_seconds gauge",
+            f"asic_simulator_loop_lag_seconds {self.lag}",
+            f"# HELP asic_simulator_loop_lag_max_seconds Largest loop lag in the last {self.max_window:g}s.",
+            "# TYPE asic_simulator_loop_lag_max_seconds gauge",
+            f"asic_simulator_loop_lag_max_seconds {self.max_lag}",
+            "# HELP asic_simulator_loop_lag_histogram_seconds Event loop lag.",
+            "# TYPE asic_simulator_loop_lag_histogram_seconds histogram",
+            *self.histogram.render("asic_simulator_loop_lag_histogram_seconds"),
+        ]
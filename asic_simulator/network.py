@@ -0,0 +1,304 @@
+"""Degraded networks between the miners and whoever is polling them.
+
+A network profile adds latency with jitter to every response, resets or never
+answers some connections, cuts some responses short and throttles the rest to a
+bandwidth, written in small segments so clients see partial reads.
+
+Every delay is a timer on one shared TimerQueue, chained so a connection has at
+most one pending timer, rather than a sleeping task per connection.  Thousands
+of degraded miners cost heap entries, not loop handles.
+"""
+from __future__ import annotations
+
+import asyncio
+import socket
+import struct
+from dataclasses import dataclass, fields
+from typing import Callable
+
+from asic_simulator.backend.data.rng import MinerRNG
+from asic_simulator.metrics import METRICS, Metrics
+from asic_simulator.timers import TimerQueue
+
+# seconds an RPC connection that gets no response is held open before it's closed,
+# web requests are held until the client gives up
+NO_RESPONSE_HOLD = 60
+# bytes per write when throttling without a segment size, about one TCP segment
+DEFAULT_SEGMENT = 1460
+
+DELIVER = "delivered"
+RESET = "reset"
+NO_RESPONSE = "no_response"
+TRUNCATE = "truncated"
+FATES = (DELIVER, RESET, NO_RESPONSE, TRUNCATE)
+
+
+@dataclass
+class NetworkProfile:
+    # seconds added before each response, and the most that varies either way
+    latency: float = 0.0
+    jitter: float = 0.0
+    # probability that a connection is reset, never answered, or cut off partway
+    # through the response
+    reset: float = 0.0
+    no_response: float = 0.0
+    truncate: float = 0.0
+    # bytes per second sent, 0 is unlimited
+    bandwidth: float = 0.0
+    # bytes per write, 0 writes a response at once unless it's throttled
+    segment: int = 0
+
+    @classmethod
+    def from_dict(cls, data: dict) -> NetworkProfile:
+        names = {f.name for f in fields(cls)}
+        unknown = set(data) - names
+        if unknown:
+            raise ValueError(f"Unknown network settings: {', '.join(sorted(unknown))}")
+        profile = cls(**data)
+        for f in fields(cls):
+            if getattr(profile, f.name) < 0:
+                raise ValueError(
+                    f"Invalid network {f.name}: {getattr(profile, f.name)}"
+                )
+        if profile.reset + profile.no_response + profile.truncate > 1:
+            raise ValueError("Network reset, no_response and truncate add up to over 1")
+        return profile
+
+    @property
+    def enabled(self) -> bool:
+        return any(getattr(self, f.name) for f in fields(self))
+
+    @property
+    def segment_size(self) -> int:
+        if self.segment:
+            return int(self.segment)
+        return DEFAULT_SEGMENT if self.bandwidth else 0
+
+
+class NetworkStats:
+    """Responses of every degraded miner of the process, by what happened to them."""
+
+    def __init__(self, metrics: Metrics = METRICS):
+        self.responses = dict.fromkeys(FATES, 0)
+        metrics.add_collector(self.collect)
+
+    def collect(self) -> list[str]:
+        name = "asic_simulator_network_responses_total"
+        return [
+            f"# HELP {name} Responses sent through a network profile, by fate.",
+            f"# TYPE {name} counter",
+            *(f'{name}{{fate="{fate}"}} {n}' for fate, n in self.responses.items()),
+        ]
+
+
+NETWORK_STATS = NetworkStats()
+
+
+def _resolve(future: asyncio.Future):
+    # the waiting request may have been cancelled since
+    if not future.done():
+        future.set_result(None)
+
+
+def reset_connection(writer: asyncio.StreamWriter):
+    """Close a connection with RST, like a crashed or overloaded server."""
+    sock = writer.get_extra_info("socket")
+    if sock is not None:
+        try:
+            # no lingering means the close sends RST instead of FIN
+            sock.setsockopt(
+                socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0)
+            )
+        except OSError:
+            pass
+    writer.transport.abort()
+
+
+class NetworkConditions:
+    """The network of one miner, shaping its responses on a shared timer queue.
+
+    The profile can be replaced while the miner runs, None sends responses
+    untouched.
+    """
+
+    __slots__ = ("profile", "timers", "rng", "stats", "_count")
+
+    def __init__(
+        self,
+        profile: NetworkProfile | None,
+        timers: TimerQueue,
+        rng: MinerRNG,
+        stats: NetworkStats = NETWORK_STATS,
+    ):
+        self.profile = profile
+        self.timers = timers
+        self.rng = rng
+        self.stats = stats
+        self._count = 0
+
+    def plan(self, size: int) -> tuple[str, float, int]:
+        """Draw what happens to a response of `size` bytes.
+
+        Returns:
+            Its fate, the seconds until it happens and how many bytes are sent.
+        """
+        profile = self.profile
+        count = self._count
+        self._count += 1
+        rng = self.rng
+        delay = profile.latency
+        if profile.jitter:
+            delay += rng.uniform("net_jitter", count, -profile.jitter, profile.jitter)
+        fate = DELIVER
+        if profile.reset or profile.no_response or profile.truncate:
+            roll = rng.random("net_fate", count)
+            if roll < profile.reset:
+                fate = RESET
+            elif roll < profile.reset + profile.no_response:
+                fate = NO_RESPONSE
+            elif roll < profile.reset + profile.no_response + profile.truncate:
+                fate = TRUNCATE
+                size = rng.randint("net_cut", count, 0, max(0, size - 1))
+        self.stats.responses[fate] += 1
+        return fate, max(0.0, delay), size
+
+    def pace(self, size: int) -> float:
+        """Seconds it takes to send `size` bytes."""
+        profile = self.profile
+        if profile is None or not profile.bandwidth:
+            return 0.0
+        return size / profile.bandwidth
+
+    def send(
+        self,
+        writer: asyncio.StreamWriter,
+        data: bytes,
+        done: Callable[[], None] = None,
+    ):
+        """Send a whole response and close the connection, in the background.
+
+        `done` is called once the connection is closed, however that happens.
+        """
+        fate, delay, size = self.plan(len(data))
+        if fate == RESET:
+            self.timers.call_later(delay, self._close, writer, done, True)
+        elif fate == NO_RESPONSE:
+            self.timers.call_later(
+                delay + NO_RESPONSE_HOLD, self._close, writer, done, False
+            )
+        else:
+            self.timers.call_later(delay, self._write, writer, data[:size], 0, done)
+
+    def _write(
+        self,
+        writer: asyncio.StreamWriter,
+        data: bytes,
+        offset: int,
+        done: Callable[[], None] | None,
+    ):
+        if writer.transport.is_closing():
+            # the client gave up
+            self._close(writer, done, False)
+            return
+        segment = self.profile.segment_size if self.profile is not None else 0
+        end = offset + segment if segment else len(data)
+        writer.write(data[offset:end])
+        if end >= len(data):
+            self._close(writer, done, False)
+            return
+        # the next segment is written on a later loop iteration at least, so it
+        # reaches the client as a separate read
+        self.timers.call_later(
+            self.pace(end - offset), self._write, writer, data, end, done
+        )
+
+    def _close(
+        self, writer: asyncio.StreamWriter, done: Callable[[], None] | None, reset: bool
+    ):
+        if reset:
+            reset_connection(writer)
+        else:
+            writer.close()
+        if done is not None:
+            done()
+
+    def wait(self, delay: float) -> asyncio.Future:
+        """A future resolved after `delay` seconds."""
+        future = asyncio.get_running_loop().create_future()
+        self.timers.call_later(delay, _resolve, future)
+        return future
+
+
+async def _disconnected(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+class NetworkMiddleware:
+    """ASGI middleware giving a web server its miner's network conditions.
+
+    ASGI has no access to the connection, so a reset closes it right after the
+    response headers, without a body.  Clients see the same broken response.
+    A request that gets no response is held, without sending anything, until
+    the client gives up, returning early would make the server answer 500.
+    """
+
+    def __init__(self, app, network: NetworkConditions):
+        self.app = app
+        self.network = network
+
+    async def __call__(self, scope, receive, send):
+        network = self.network
+        if scope["type"] != "http" or network.profile is None:
+            return await self.app(scope, receive, send)
+        started = None
+        # once the response is cut off, the rest of it is dropped
+        dropped = False
+
+        async def shaped_send(message):
+            nonlocal started, dropped
+            if dropped:
+                return
+            if message["type"] == "http.response.start":
+                started = message
+                return
+            if message["type"] != "http.response.body" or network.profile is None:
+                return await send(message)
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if started is not None:
+                fate, delay, size = network.plan(len(body))
+                if fate == NO_RESPONSE:
+                    dropped = True
+                    await _disconnected(receive)
+                    return
+                if delay:
+                    await network.wait(delay)
+                await send(started)
+                started = None
+                if fate != DELIVER:
+                    # hypercorn closes a connection whose body never ended
+                    dropped = True
+                    if fate != TRUNCATE:
+                        return
+                    body, more_body = body[:size], True
+            await self._send_segments(send, body, more_body)
+
+        await self.app(scope, receive, shaped_send)
+
+    async def _send_segments(self, send, body: bytes, more_body: bool):
+        network = self.network
+        segment = network.profile.segment_size if network.profile is not None else 0
+        if not segment:
+            segment = max(1, len(body))
+        for offset in range(0, max(1, len(body)), segment):
+            if offset:
+                await network.wait(network.pace(segment))
+            end = offset + segment
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": body[offset:end],
+                    "more_body": more_body or end < len(body),
+                }
+            )
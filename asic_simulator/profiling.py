@@ -0,0 +1,171 @@
+"""On demand profiling of a running simulator process.
+
+A session profiles the event loop thread until it is stopped or its duration
+runs out, then writes its results to a directory under `PROFILE_DIR`:
+
+    all.prof / all.txt       everything, for snakeviz or pstats
+    <Handler>.txt            the part spent in each miner handler's code
+
+Kinds are "cprofile", "tracemalloc" (allocation snapshot) and "sampling"
+(pyinstrument, if installed).
+"""
+from __future__ import annotations
+
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import re
+import time
+import tracemalloc
+
+from asic_simulator import log
+from asic_simulator.settings import PROFILE_DIR
+from asic_simulator.simulators.antminer.rpc import AntminerRPCHandler
+from asic_simulator.simulators.antminer.web import AntminerWebHandler
+from asic_simulator.simulators.whatsminer.rpc import WhatsminerRPCHandler
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+PROFILED_HANDLERS = (AntminerRPCHandler, AntminerWebHandler, WhatsminerRPCHandler)
+PROFILE_KINDS = ("cprofile", "tracemalloc", "sampling")
+# lines per report, the interesting part is always at the top
+REPORT_LIMIT = 60
+# frames kept per allocation, so allocations made below a handler count for it
+TRACE_FRAMES = 16
+
+
+class ProfilingError(Exception):
+    pass
+
+
+class Profiler:
+    """One profiling session at a time for this process."""
+
+    def __init__(self, directory: str = PROFILE_DIR):
+        self.directory = directory
+        self.kind: str | None = None
+        self.started: float | None = None
+        self._profile = None
+        self._stop_handle: asyncio.TimerHandle | None = None
+
+    @property
+    def running(self) -> bool:
+        return self.kind is not None
+
+    def status(self) -> dict:
+        return {
+            "running": self.running,
+            "kind": self.kind,
+            "elapsed": time.time() - self.started if self.running else None,
+        }
+
+    def start(self, kind: str = "cprofile", duration: float = None):
+        """Start a session, stopping it by itself after `duration` seconds."""
+        if self.running:
+            raise ProfilingError(f"A {self.kind} session is already running")
+        if kind not in PROFILE_KINDS:
+            raise ProfilingError(f"Unknown profile kind: {kind}")
+        if kind == "sampling" and pyinstrument is None:
+            raise ProfilingError("Sampling profiles need pyinstrument installed")
+
+        if kind == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        elif kind == "tracemalloc":
+            tracemalloc.start(TRACE_FRAMES)
+        else:
+            self._profile = pyinstrument.Profiler()
+            self._profile.start()
+        self.kind = kind
+        self.started = time.time()
+        if duration is not None:
+            self._stop_handle = asyncio.get_running_loop().call_later(
+                duration, self.stop
+            )
+        log.startup("%s profiling started", kind)
+
+    def stop(self) -> str:
+        """Stop the session and write its results.
+
+        Returns:
+            The directory the results were written to.
+        """
+        if not self.running:
+            raise ProfilingError("No profiling session is running")
+        if self._stop_handle is not None:
+            self._stop_handle.cancel()
+            self._stop_handle = None
+
+        path = os.path.join(
+            self.directory,
+            time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))
+            + f"-{os.getpid()}-{self.kind}",
+        )
+        os.makedirs(path, exist_ok=True)
+        if self.kind == "cprofile":
+            self._profile.disable()
+            self._write_cprofile(path)
+        elif self.kind == "tracemalloc":
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            self._write_tracemalloc(snapshot, path)
+        else:
+            self._profile.stop()
+            with open(os.path.join(path, "all.html"), "w") as f:
+                f.write(self._profile.output_html())
+            with open(os.path.join(path, "all.txt"), "w") as f:
+                f.write(self._profile.output_text())
+
+        log.startup("%s profile written to %s", self.kind, path)
+        self.kind = None
+        self.started = None
+        self._profile = None
+        return path
+
+    def toggle(self, kind: str = "cprofile"):
+        if self.running:
+            self.stop()
+        else:
+            self.start(kind)
+
+    def _write_cprofile(self, path: str):
+        self._profile.dump_stats(os.path.join(path, "all.prof"))
+        self._write_report(path, "all", None)
+        for handler in PROFILED_HANDLERS:
+            # restrict to functions defined in the handler's module
+            pattern = re.escape(_module_file(handler))
+            self._write_report(path, handler.__name__, pattern)
+
+    def _write_report(self, path: str, name: str, pattern: str | None):
+        out = io.StringIO()
+        stats = pstats.Stats(self._profile, stream=out)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE)
+        if pattern is None:
+            stats.print_stats(REPORT_LIMIT)
+        else:
+            stats.print_stats(pattern, REPORT_LIMIT)
+        with open(os.path.join(path, f"{name}.txt"), "w") as f:
+            f.write(out.getvalue())
+
+    @staticmethod
+    def _write_tracemalloc(snapshot: tracemalloc.Snapshot, path: str):
+        snapshot.dump(os.path.join(path, "all.snapshot"))
+        reports = {"all": snapshot}
+        for handler in PROFILED_HANDLERS:
+            reports[handler.__name__] = snapshot.filter_traces(
+                [tracemalloc.Filter(True, "*" + _module_file(handler), all_frames=True)]
+            )
+        for name, report in reports.items():
+            with open(os.path.join(path, f"{name}.txt"), "w") as f:
+                for stat in report.statistics("lineno")[:REPORT_LIMIT]:
+                    f.write(f"{stat}\n")
+
+
+def _module_file(cls: type) -> str:
+    # relative to the import root, code objects may hold either kind of path
+    return os.path.join(*cls.__module__.split(".")) + ".py"
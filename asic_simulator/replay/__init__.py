@@ -0,0 +1,128 @@
+"""Answering with responses recorded from real miners.
+
+A replaying miner serves the captures of its model from a corpus (see
+`replay.corpus`, recorded with `python -m asic_simulator.replay.record`) for
+every command that has one, and falls back to the generated responses for
+the rest.  Captures are picked per miner, so miners of the same model differ
+when there are several.
+
+Fields that would give a replay away are stamped from the miner's backend on
+every response: timestamps (`When`), uptime (`Elapsed`) and hashrate
+averages (`GHS 5s`, `MHS av`, `rate_30m`, ...).  Lists with hashrates in
+more than one entry are taken to be per board, and get the board's rate.
+"""
+from __future__ import annotations
+
+import functools
+import json
+import re
+
+from asic_simulator.backend.data import MinerSimulatorBackend
+from asic_simulator.backend.data.averages import AVERAGE_ALL
+from asic_simulator.backend.data.hashrate import HashUnit
+from asic_simulator.replay.corpus import (
+    Corpus,
+    CorpusError,
+    CorpusWriter,
+    open_corpus,
+)
+
+WHEN_FIELDS = ("When", "when")
+ELAPSED_FIELDS = ("Elapsed", "elapsed", "Device Elapsed")
+# cgminer style, "GHS 5s", "MHS av"
+_HS_FIELD = re.compile(r"^([KMGTP])HS (5s|1m|5m|15m|30m|av)$")
+# antminer new api and web, "rate_5s", "rate_avg", with the unit in "rate_unit"
+_RATE_FIELD = re.compile(r"^rate_(5s|1m|5m|15m|30m|avg)$")
+
+
+def _rate_stamp(key: str, parent: dict) -> tuple | None:
+    match = _HS_FIELD.match(key)
+    if match is not None:
+        return HashUnit[f"{match[1]}H"], match[2]
+    match = _RATE_FIELD.match(key)
+    if match is not None:
+        try:
+            unit = HashUnit[str(parent.get("rate_unit", "GH/s")).split("/")[0]]
+        except KeyError:
+            unit = HashUnit.GH
+        window = AVERAGE_ALL if match[1] == "avg" else match[1]
+        return unit, window
+    return None
+
+
+def _has_rate(value) -> bool:
+    return isinstance(value, dict) and any(
+        _rate_stamp(key, value) is not None for key in value
+    )
+
+
+def _plan(data, path: tuple = (), board: int = None) -> list[tuple]:
+    """Find the fields to stamp, as (path, kind, args)."""
+    plan = []
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if isinstance(value, (dict, list)):
+                plan.extend(_plan(value, (*path, key), board))
+            elif not isinstance(value, (int, float)) or isinstance(value, bool):
+                continue
+            elif key in WHEN_FIELDS:
+                plan.append(((*path, key), "when", isinstance(value, float)))
+            elif key in ELAPSED_FIELDS:
+                plan.append(((*path, key), "elapsed", None))
+            elif (rate := _rate_stamp(key, data)) is not None:
+                plan.append(((*path, key), "rate", (*rate, board)))
+    elif isinstance(data, list):
+        per_board = sum(_has_rate(item) for item in data) > 1
+        for i, item in enumerate(data):
+            plan.extend(_plan(item, (*path, i), i if per_board else board))
+    return plan
+
+
+@functools.lru_cache(maxsize=4096)
+def _capture_plan(corpus: Corpus, capture: tuple[int, int]) -> list[tuple]:
+    # shared by every miner serving this capture
+    return _plan(json.loads(corpus.read(capture)))
+
+
+class Replay:
+    def __init__(
+        self,
+        corpus: Corpus,
+        vendor: str,
+        model: str,
+        backend: MinerSimulatorBackend,
+    ):
+        self.corpus = corpus
+        self.backend = backend
+        self.captures = corpus.model(vendor, model)
+        if not self.captures:
+            raise ValueError(f"No captures of {vendor} {model} in {corpus.path}")
+
+    def response(self, interface: str, command: str) -> dict | None:
+        """A recorded response to a command, or None if there isn't one."""
+        captures = self.captures.get(f"{interface}/{command}")
+        if not captures:
+            return None
+        capture = captures[self.backend.miner_id % len(captures)]
+        data = json.loads(self.corpus.read(capture))
+        now = self.backend.clock.now()
+        for path, kind, args in _capture_plan(self.corpus, capture):
+            parent = data
+            for key in path[:-1]:
+                parent = parent[key]
+            parent[path[-1]] = self._stamp(kind, args, now)
+        return data
+
+    def _stamp(self, kind: str, args, now: float):
+        if kind == "when":
+            return now if args else round(now)
+        if kind == "elapsed":
+            return self.backend.elapsed
+        unit, window, board = args
+        if board is None:
+            rate = self.backend.hashrate_avg(window)
+        elif board < len(self.backend.boards):
+            rate = self.backend.board_hashrate_avg(board, window)
+        else:
+            return 0.0
+        return round(float(rate.into(unit)), 2)
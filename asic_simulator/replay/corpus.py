@@ -0,0 +1,114 @@
+"""On disk corpus of responses captured from real miners.
+
+    magic   b"ASICRPL1"
+    u64     offset of the index
+    u64     length of the index
+    ...     the responses, compact JSON, back to back
+    index   JSON, {"created": ..., "models": {"antminer/S19j": {"rpc/stats": [[offset, length], ...]}}}
+
+Readers map the file read only, so every process replaying from the same
+corpus shares a single copy through the page cache, and a response is only
+paged in once some miner serves it.
+"""
+from __future__ import annotations
+
+import functools
+import json
+import mmap
+import os
+import struct
+import time
+
+MAGIC = b"ASICRPL1"
+_HEADER = struct.Struct("<8sQQ")
+
+
+class CorpusError(ValueError):
+    pass
+
+
+def model_key(vendor: str, model: str) -> str:
+    return f"{vendor}/{model}"
+
+
+class Corpus:
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise CorpusError(f"{path} is empty")
+        if len(self._map) < _HEADER.size:
+            raise CorpusError(f"{path} is not a replay corpus")
+        magic, offset, length = _HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise CorpusError(f"{path} is not a replay corpus")
+        index = json.loads(self._map[offset : offset + length])
+        self.created: float = index.get("created")
+        self.models: dict[str, dict[str, list[tuple[int, int]]]] = {
+            model: {
+                key: [tuple(capture) for capture in captures]
+                for key, captures in entries.items()
+            }
+            for model, entries in index["models"].items()
+        }
+
+    def model(self, vendor: str, model: str) -> dict[str, list[tuple[int, int]]]:
+        """The captures of a model by `<interface>/<command>`, empty if there are none."""
+        return self.models.get(model_key(vendor, model), {})
+
+    def read(self, capture: tuple[int, int]) -> bytes:
+        offset, length = capture
+        return self._map[offset : offset + length]
+
+    def close(self):
+        self._map.close()
+
+
+@functools.lru_cache(maxsize=None)
+def open_corpus(path: str) -> Corpus:
+    """Open a corpus, once per process however many miners replay from it."""
+    return Corpus(path)
+
+
+class CorpusWriter:
+    def __init__(self):
+        self._data = bytearray()
+        self.models: dict[str, dict[str, list[tuple[int, int]]]] = {}
+
+    @classmethod
+    def from_corpus(cls, corpus: Corpus) -> CorpusWriter:
+        """Start from the captures of an existing corpus, to add more to it."""
+        writer = cls()
+        for model, entries in corpus.models.items():
+            for key, captures in entries.items():
+                for capture in captures:
+                    writer._add(model, key, corpus.read(capture))
+        return writer
+
+    def add(self, vendor: str, model: str, interface: str, command: str, data: dict):
+        raw = json.dumps(data, separators=(",", ":")).encode()
+        self._add(model_key(vendor, model), f"{interface}/{command}", raw)
+
+    def _add(self, model: str, key: str, raw: bytes):
+        offset = _HEADER.size + len(self._data)
+        self._data += raw
+        self.models.setdefault(model, {}).setdefault(key, []).append((offset, len(raw)))
+
+    def __len__(self) -> int:
+        return sum(
+            len(captures)
+            for entries in self.models.values()
+            for captures in entries.values()
+        )
+
+    def write(self, path: str):
+        index = json.dumps({"created": time.time(), "models": self.models}).encode()
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, _HEADER.size + len(self._data), len(index)))
+            f.write(self._data)
+            f.write(index)
+        # replace rather than rewrite, processes mapping the old file keep it
+        os.replace(tmp, path)
@@ -0,0 +1,165 @@
+"""Record real miners' responses into a replay corpus.
+
+    python -m asic_simulator.replay.record -o captures.bin \\
+        --vendor antminer --model S19j 10.0.0.10 10.0.0.11
+
+Every read only command the simulator answers is sent to each miner over
+RPC, and for Antminers over the web interface too.  Recording several miners
+of a model gives replaying miners a variety of captures to pick from.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import socket
+import sys
+import urllib.error
+import urllib.request
+
+from asic_simulator.replay.corpus import Corpus, CorpusError, CorpusWriter
+
+# "new_stats" is stats with new_api set, as the simulator names it
+RPC_COMMANDS = {
+    "antminer": ["stats", "summary", "pools", "devs", "version", "new_stats"],
+    "whatsminer": [
+        "summary",
+        "devs",
+        "edevs",
+        "devdetails",
+        "pools",
+        "status",
+        "get_version",
+        "get_psu",
+        "get_miner_info",
+    ],
+}
+WEB_COMMANDS = {
+    "antminer": [
+        "stats",
+        "summary",
+        "pools",
+        "chart",
+        "miner_type",
+        "get_miner_conf",
+        "get_system_info",
+        "get_network_info",
+        "get_blink_status",
+    ],
+}
+
+
+def parse_response(raw: bytes) -> dict:
+    """Parse a cgminer style response, working around the usual firmware bugs."""
+    text = raw.decode(errors="replace").rstrip("\x00").strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        # some firmware leave out the comma between objects
+        return json.loads(text.replace("}{", "},{"))
+
+
+def rpc_command(host: str, port: int, command: str, timeout: float) -> dict:
+    if command.startswith("new_"):
+        payload = {"command": command[4:], "new_api": True}
+    else:
+        payload = {"command": command}
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        sock.sendall(json.dumps(payload).encode())
+        data = b""
+        while chunk := sock.recv(65536):
+            data += chunk
+    return parse_response(data)
+
+
+def web_command(
+    host: str, port: int, command: str, username: str, password: str, timeout: float
+) -> dict:
+    url = f"http://{host}:{port}/cgi-bin/{command}.cgi"
+    passwords = urllib.request.HTTPPasswordMgrWithDefaultRealm()
+    passwords.add_password(None, url, username, password)
+    opener = urllib.request.build_opener(
+        urllib.request.HTTPDigestAuthHandler(passwords)
+    )
+    with opener.open(url, timeout=timeout) as response:
+        return parse_response(response.read())
+
+
+def record(writer: CorpusWriter, args: argparse.Namespace, host: str) -> int:
+    """Capture every command from one miner.
+
+    Returns:
+        The number of responses captured.
+    """
+    requests = [
+        ("rpc", command, rpc_command, (host, args.rpc_port, command, args.timeout))
+        for command in RPC_COMMANDS[args.vendor]
+    ]
+    if not args.no_web:
+        requests += [
+            (
+                "web",
+                command,
+                web_command,
+                (
+                    host,
+                    args.web_port,
+                    command,
+                    args.username,
+                    args.password,
+                    args.timeout,
+                ),
+            )
+            for command in WEB_COMMANDS.get(args.vendor, [])
+        ]
+    captured = 0
+    for interface, command, request, request_args in requests:
+        try:
+            data = request(*request_args)
+        except (OSError, urllib.error.URLError, ValueError) as e:
+            print(f"{host} {interface} {command}: {e}", file=sys.stderr)
+            continue
+        writer.add(args.vendor, args.model, interface, command, data)
+        captured += 1
+    return captured
+
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("hosts", nargs="+", help="miners to record")
+    parser.add_argument("-o", "--output", required=True, help="corpus file")
+    parser.add_argument(
+        "--append", action="store_true", help="add to the corpus instead of replacing"
+    )
+    parser.add_argument("--vendor", choices=RPC_COMMANDS, required=True)
+    parser.add_argument(
+        "--model", required=True, help="the simulator's name for the model, e.g. S19j"
+    )
+    parser.add_argument("--rpc-port", type=int, default=4028)
+    parser.add_argument("--web-port", type=int, default=80)
+    parser.add_argument("--no-web", action="store_true", help="only record RPC")
+    parser.add_argument("--username", default="root")
+    parser.add_argument("--password", default="root")
+    parser.add_argument("--timeout", type=float, default=10)
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] = None):
+    args = parse_args(argv)
+    writer = CorpusWriter()
+    if args.append and os.path.exists(args.output):
+        try:
+            corpus = Corpus(args.output)
+        except CorpusError as e:
+            raise SystemExit(str(e))
+        writer = CorpusWriter.from_corpus(corpus)
+        corpus.close()
+    captured = sum(record(writer, args, host) for host in args.hosts)
+    if captured == 0:
+        raise SystemExit("Nothing recorded")
+    writer.write(args.output)
+    print(f"{captured} responses recorded, {len(writer)} in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,3 +4,9 @@ BASE_DIR = os.path.dirname(__file__)
 
 SSL_PUBLIC_KEY = os.path.join(BASE_DIR, "ssl", "self-signed.pub.pem")
 SSL_PRIVATE_KEY = os.path.join(BASE_DIR, "ssl", "self-signed.priv.pem")
+
+# fleet wide seed for all simulated randomness, reruns with the same seed match
+SEED = int(os.getenv("ASIC_SIMULATOR_SEED", "0"))
+
+# where profiling sessions started from the admin api or a signal are written
+PROFILE_DIR = os.getenv("ASIC_SIMULATOR_PROFILE_DIR", "profiles")
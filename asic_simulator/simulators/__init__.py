@@ -22,6 +22,11 @@ if (
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
 
+SIMULATOR_TYPES = {
+    "antminer": AntminerSimulator,
+    "whatsminer": WhatsminerSimulator,
+}
+
 MINER_SIMULATORS = {
     "antminer": {
         "stock": {
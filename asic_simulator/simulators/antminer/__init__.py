@@ -1,16 +1,47 @@
 import asyncio
+import functools
+from typing import Awaitable, Callable
 
 from asic_simulator import log
 from asic_simulator.backend import MinerSimulatorBackend, HashUnit
+from asic_simulator.limits import AccessLimiter
+from asic_simulator.network import NetworkConditions
+from asic_simulator.replay import Replay
 from asic_simulator.simulators.antminer.rpc import AntminerRPCHandler
 from asic_simulator.simulators.antminer.web import AntminerWebHandler
 
 
 class AntminerSimulator:
-    def __init__(self, backend: MinerSimulatorBackend, hr_unit: HashUnit = HashUnit.GH):
+    PORTS = {"rpc": 4028, "web": 80}
+
+    def __init__(
+        self,
+        backend: MinerSimulatorBackend,
+        hr_unit: HashUnit = HashUnit.GH,
+        replay: Replay = None,
+        network: NetworkConditions = None,
+        limiters: dict[str, AccessLimiter] = None,
+    ):
         self.backend = backend
-        self.rpc = AntminerRPCHandler(backend)
-        self.web = AntminerWebHandler(backend, hr_unit)
+        self.network = network
+        # by interface, "rpc" and "web"
+        self.limiters = limiters if limiters is not None else {}
+        self.rpc = AntminerRPCHandler(
+            backend, replay=replay, network=network, limiter=self.limiters.get("rpc")
+        )
+        self.hr_unit = hr_unit
+        self.replay = replay
+
+    @functools.cached_property
+    def web(self) -> AntminerWebHandler:
+        # built on first use, rpc only miners never pay for the web app
+        return AntminerWebHandler(
+            self.backend,
+            self.hr_unit,
+            self.replay,
+            self.network,
+            self.limiters.get("web"),
+        )
 
     def run(self):
         log.startup(
@@ -18,7 +49,31 @@ class AntminerSimulator:
         )
         log.startup("startup complete")
 
-        async def _run():
-            await asyncio.gather(self.rpc.run(), self.web.run())
+        asyncio.run(self.serve())
+
+    async def serve(self, host: str = "0.0.0.0", ports: dict = None):
+        # a lone miner runs its backend's timers, fleets run a shared queue
+        await asyncio.gather(*await self.start(host, ports), self.backend.timers.run())
+
+    async def start(
+        self,
+        host: str = "0.0.0.0",
+        ports: dict = None,
+        rpc_only: bool = False,
+        shutdown_trigger: Callable[[], Awaitable[None]] = None,
+    ) -> list[asyncio.Task]:
+        """Start listening, returning once the RPC server accepts connections.
 
-        asyncio.run(_run())
+        Returns:
+            The tasks serving each interface, cancel them to stop the miner.
+        """
+        ports = {**self.PORTS, **(ports or {})}
+        rpc_server = await self.rpc.start(host, ports["rpc"])
+        tasks = [asyncio.create_task(rpc_server.serve_forever())]
+        if not rpc_only:
+            tasks.append(
+                asyncio.create_task(
+                    self.web.run(host, ports["web"], shutdown_trigger=shutdown_trigger)
+                )
+            )
+        return tasks
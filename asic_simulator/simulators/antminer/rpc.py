@@ -1,17 +1,33 @@
 import asyncio
 import datetime
 import json
+import time
+from typing import Callable
 
 from asic_simulator import log
 from asic_simulator.backend import MinerSimulatorBackend, HashUnit
+from asic_simulator.backend.data.boards import asic_string
+from asic_simulator.limits import AccessLimiter
+from asic_simulator.metrics import METRICS, UNKNOWN_COMMAND
+from asic_simulator.network import NetworkConditions
+from asic_simulator.replay import Replay
 
 
 class AntminerRPCHandler:
     def __init__(
-        self, backend: MinerSimulatorBackend, hash_unit: HashUnit = HashUnit.GH
+        self,
+        backend: MinerSimulatorBackend,
+        hash_unit: HashUnit = HashUnit.GH,
+        replay: Replay = None,
+        network: NetworkConditions = None,
+        limiter: AccessLimiter = None,
     ):
         self.hash_unit = hash_unit
         self.backend = backend
+        self.replay = replay
+        self.network = network
+        self.limiter = limiter
+        self._in_flight = METRICS.in_flight("antminer", "rpc")
         self.commands = {
             "devs": self.devs,
             "pools": self.pools,
@@ -21,43 +37,113 @@ class AntminerRPCHandler:
             "new_stats": self.new_stats,
         }
 
-    async def run(self):
-        server = await asyncio.start_server(self._handle_client, "0.0.0.0", 4028)
+    async def run(self, host: str = "0.0.0.0", port: int = 4028):
+        server = await self.start(host, port)
         async with server:
             await server.serve_forever()
 
+    async def start(self, host: str = "0.0.0.0", port: int = 4028) -> asyncio.Server:
+        return await asyncio.start_server(self._handle_client, host, port)
+
     async def _handle_client(
         self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
     ):
-        raw_data = await reader.read(1000)
-        str_data = raw_data.decode()
+        limiter = self.limiter
+        if limiter is None:
+            return await self._answer(reader, writer)
+        if not limiter.admit() and not await limiter.wait():
+            await limiter.reject(reader, writer)
+            return
+        handed_off = False
         try:
-            data = json.loads(str_data)
-        except json.JSONDecodeError:
-            writer.write(json.dumps(self._handle_failure()).encode())
+            handed_off = await self._answer(reader, writer, limiter.release)
+        finally:
+            if not handed_off:
+                limiter.release()
+
+    async def _answer(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        done: Callable[[], None] = None,
+    ) -> bool:
+        """Read a request and send its response.
+
+        Returns:
+            Whether the response was left to the network, which calls `done`
+            once it's sent.
+        """
+        with self._in_flight:
+            raw_data = await reader.read(1000)
+            start = time.perf_counter()
+            try:
+                data = json.loads(raw_data.decode())
+            except ValueError:
+                # not utf-8 or not json
+                data = None
+            if not isinstance(data, dict):
+                label, ok, result = UNKNOWN_COMMAND, False, self._handle_failure()
+            else:
+                command = data.get("command")
+                params = {i: data[i] for i in data if not i == "command"}
+                try:
+                    label, ok, result = self._dispatch(command, **params)
+                except (TypeError, ValueError) as e:
+                    # parameters the command doesn't take
+                    log.failure("RPC", "%s: %s", command, e)
+                    label = command if command in self.commands else UNKNOWN_COMMAND
+                    ok, result = False, self._handle_failure()
+
+            response = json.dumps(result).encode()
+            METRICS.observe(
+                "antminer",
+                "rpc",
+                label,
+                time.perf_counter() - start,
+                error=not ok,
+                bytes_in=len(raw_data),
+                bytes_out=len(response),
+            )
+            network = self.network
+            if network is not None and network.profile is not None:
+                # sent on the network's timers, nothing waits for it here
+                network.send(writer, response, done)
+                return True
+            writer.write(response)
             await writer.drain()
             writer.close()
-            return
+            return False
 
-        command = data.get("command")
-        params = {i: data[i] for i in data if not i == "command"}
-        result = self.handle_command(command, **params)
+    def handle_command(self, command: str, **params):
+        return self._dispatch(command, **params)[2]
 
-        writer.write(json.dumps(result).encode())
-        await writer.drain()
-        writer.close()
+    def _dispatch(self, command: str, **params) -> tuple[str, bool, dict]:
+        """Answer a command.
 
-    def handle_command(self, command: str, **params):
+        Returns:
+            The command name to record metrics under, whether it succeeded and
+            the response.
+        """
+        if self.replay is not None:
+            name = f"new_{command}" if params.get("new_api") else command
+            response = self.replay.response("rpc", name)
+            if response is not None:
+                log.success("RPC", "%s, replayed", name)
+                return name, True, response
         if "new_api" in params:
             if params["new_api"]:
                 if f"new_{command}" in self.commands:
-                    log.success("RPC", f"{command}, new_api")
-                    return self._handle_success(f"new_{command}")
+                    log.success("RPC", "%s, new_api", command)
+                    return (
+                        f"new_{command}",
+                        True,
+                        self._handle_success(f"new_{command}"),
+                    )
         elif command in self.commands:
             log.success("RPC", command)
-            return self._handle_success(command, **params)
+            return command, True, self._handle_success(command, **params)
         log.failure("RPC", command)
-        return self._handle_failure()
+        return UNKNOWN_COMMAND, False, self._handle_failure()
 
     def _handle_failure(self):
         return {
@@ -67,7 +153,7 @@ class AntminerRPCHandler:
                     "Description": "cgminer 1.0.0",
                     "Msg": "Invalid command",
                     "STATUS": "E",
-                    "When": round(datetime.datetime.now().timestamp()),
+                    "When": round(self.backend.clock.now()),
                 }
             ],
             "id": 1,
@@ -85,15 +171,18 @@ class AntminerRPCHandler:
                     "Description": "cgminer 1.0.0",
                     "Msg": command_res["msg"],
                     "STATUS": "S",
-                    "When": round(datetime.datetime.now().timestamp()),
+                    "When": round(self.backend.clock.now()),
                 }
             ],
             **command_res["result"],
             "id": 1,
         }
 
+    def _rate(self, window: str) -> float:
+        return round(float(self.backend.hashrate_avg(window).into(self.hash_unit)), 2)
+
     def devs(self):
-        ts = round(datetime.datetime.now().timestamp())
+        counters = self.backend.counters()
         return {
             "code": 9,
             "msg": "1 ASC(s)",
@@ -101,29 +190,29 @@ class AntminerRPCHandler:
                 "DEVS": [
                     {
                         "ASC": 0,
-                        "Accepted": 10000,
+                        "Accepted": counters.accepted,
                         "Device Elapsed": self.backend.elapsed,
-                        "Device Hardware%": 1.0,
-                        "Device Rejected": 0.0,
-                        "Diff1 Work": 0,
-                        "Difficulty Accepted": 1000000000,
-                        "Difficulty Rejected": 1000000,
+                        "Device Hardware%": counters.hardware_pct,
+                        "Device Rejected": counters.rejected_pct,
+                        "Diff1 Work": counters.diff1_work,
+                        "Difficulty Accepted": counters.difficulty_accepted,
+                        "Difficulty Rejected": counters.difficulty_rejected,
                         "Enabled": "Y",
-                        "Hardware Errors": 1,
+                        "Hardware Errors": counters.hardware_errors,
                         "ID": 0,
-                        "Last Share Difficulty": ts
-                        - 11,  # for some reason this is a timestamp
-                        "Last Share Pool": 0,
-                        "Last Share Time": ts - 10,
-                        "Last Valid Work": ts - 11,
+                        # for some reason this is a timestamp
+                        "Last Share Difficulty": counters.last_share_time - 1,
+                        "Last Share Pool": self.backend.active_pool or 0,
+                        "Last Share Time": counters.last_share_time,
+                        "Last Valid Work": counters.last_share_time - 1,
                         "MHS 5s": 0.0,  # not handled by devs
                         "MHS av": 0.0,  # not handled by devs
                         "Name": "BTM_SOC",
-                        "Rejected": 100,
+                        "Rejected": counters.rejected,
                         "Status": "Alive",
                         "Tenperature": 0.0,  # not handled by devs
                         "Total MH": 0.0,  # not handled by devs
-                        "Utility": 0.0,
+                        "Utility": counters.utility,
                     }
                 ]
             },
@@ -136,43 +225,48 @@ class AntminerRPCHandler:
             "result": {
                 "POOLS": [
                     {
-                        "Accepted": 10000,
-                        "Best Share": 1000000000.0,
-                        "Diff": "100K",
-                        "Diff1 Shares": 0,
-                        "Difficulty Accepted": 1000000000.0,
-                        "Difficulty Rejected": 1000000.0,
-                        "Difficulty Stale": 0.0,
+                        "Accepted": c.accepted,
+                        "Best Share": float(c.best_share),
+                        "Diff": f"{p.difficulty / 1000:g}K",
+                        "Diff1 Shares": c.diff1_work,
+                        "Difficulty Accepted": c.difficulty_accepted,
+                        "Difficulty Rejected": c.difficulty_rejected,
+                        "Difficulty Stale": c.difficulty_stale,
                         "Discarded": 100000,
                         "Get Failures": 3,
                         "Getworks": 9000,
                         "Has GBT": False,
                         "Has Stratum": True,
-                        "Last Share Difficulty": 100000.0,
-                        "Last Share Time": "0:00:02",
+                        "Last Share Difficulty": float(p.difficulty),
+                        "Last Share Time": str(
+                            datetime.timedelta(seconds=round(c.now - c.last_share_time))
+                        ),
                         "Long Poll": "N",
                         "POOL": i,
-                        "Pool Rejected%": 0.0,
-                        "Pool Stale%%": 0.0,
+                        "Pool Rejected%": c.rejected_pct,
+                        "Pool Stale%%": c.stale_pct,
                         "Priority": 0,
                         "Proxy": "",
                         "Proxy Type": "",
                         "Quota": 1,
-                        "Rejected": 100,
+                        "Rejected": c.rejected,
                         "Remote Failures": 0,
-                        "Stale": 0,
+                        "Stale": c.stale,
                         "Status": "Alive" if p.active else "Dead",
-                        "Stratum Active": True,
+                        "Stratum Active": self.backend.stratum_active(i),
                         "Stratum URL": p.url,
                         "URL": p.full_url,
                         "User": p.user,
                     }
-                    for i, p in enumerate(self.backend.pools)
+                    for i, (p, c) in enumerate(
+                        zip(self.backend.pools, self.backend.pool_counters())
+                    )
                 ],
             },
         }
 
     def stats(self):
+        boards = self.backend.boards
         fan_data = {f"fan{i+1}": 0 for i in range(4)}
         for i, fan in enumerate(self.backend.fans):
             fan_data[f"fan{i+1}"] = fan.rpm
@@ -190,26 +284,25 @@ class AntminerRPCHandler:
             **{f"temp_pic{i+1}": "0-0-0-0" for i in range(4)},
         }
         for board in range(self.backend.miner_info.board_count):
-            acs_str = "o" * self.backend.boards[board].chips
-            board_data[f"chain_acn{board+1}"] = self.backend.boards[board].chips
-            board_data[f"chain_acs{board+1}"] = " ".join(
-                [acs_str[i : i + 3] for i in range(0, len(acs_str), 3)]
-            )
-            board_data[f"chain_hw{board+1}"] = 10
+            board_data[f"chain_acn{board+1}"] = boards[board].chips
+            board_data[f"chain_acs{board+1}"] = asic_string(boards[board].chips)
+            board_data[f"chain_hw{board+1}"] = self.backend.counters(
+                board
+            ).hardware_errors
             board_data[f"chain_rate{board+1}"] = str(
-                float(self.backend.boards[board].hashrate.into(self.hash_unit))
+                float(self.backend.board_hashrate_avg(board, "5s").into(self.hash_unit))
             )
             board_data[f"freq{board+1}"] = 545
-            board_data[f"temp{board+1}"] = self.backend.boards[board].info.board_temp
-            board_data[f"temp2_{board+1}"] = self.backend.boards[board].info.chip_temp
+            board_data[f"temp{board+1}"] = round(boards[board].board_temp)
+            board_data[f"temp2_{board+1}"] = round(boards[board].chip_temp)
             board_data[f"temp_chip{board+1}"] = "-".join(
-                [str(self.backend.boards[board].info.chip_temp) for _ in range(4)]
+                [str(round(boards[board].chip_temp)) for _ in range(4)]
             )
             board_data[f"temp_pcb{board+1}"] = "-".join(
-                [str(self.backend.boards[board].info.board_temp) for _ in range(4)]
+                [str(round(boards[board].board_temp)) for _ in range(4)]
             )
             board_data[f"temp_pic{board+1}"] = "-".join(
-                [str(self.backend.boards[board].info.board_temp) for _ in range(4)]
+                [str(round(boards[board].board_temp)) for _ in range(4)]
             )
 
         return {
@@ -221,29 +314,13 @@ class AntminerRPCHandler:
                         "BMMiner": "1.0.0",
                         "CompileTime": "Fri Sep 15 14:39:20 CST 2023",
                         "Miner": "uart_trans.1.3",
-                        "Type": f"{self.backend.miner_info.make} {self.backend.miner_info.model}",
+                        "Type": self.backend.miner_info.type,
                     },
                     {
                         "Calls": 0,
                         "Elapsed": self.backend.elapsed,
-                        "GHS 5s": round(
-                            sum(
-                                [
-                                    float(b.hashrate.into(self.hash_unit))
-                                    for b in self.backend.boards
-                                ]
-                            ),
-                            2,
-                        ),
-                        "GHS av": round(
-                            sum(
-                                [
-                                    float(b.hashrate.into(self.hash_unit))
-                                    for b in self.backend.boards
-                                ]
-                            ),
-                            2,
-                        ),
+                        "GHS 5s": self._rate("5s"),
+                        "GHS av": self._rate("av"),
                         "ID": "BTM_SOC0",
                         "Max": 0,
                         "Min": 99999999,
@@ -252,38 +329,24 @@ class AntminerRPCHandler:
                         "Wait": 0,
                         "fan_num": self.backend.miner_info.fan_count,
                         "frequency": 545,
-                        "miner_count": len(self.backend.boards),
+                        "miner_count": len(boards),
                         "miner_id": "no miner id now",
                         "miner_version": "uart_trans.1.3",
                         "no_matching_work": 30,
-                        "rate_30m": round(
-                            sum(
-                                [
-                                    float(b.hashrate.into(self.hash_unit))
-                                    for b in self.backend.boards
-                                ]
-                            ),
-                            2,
-                        ),
+                        "rate_30m": self._rate("30m"),
                         "rate_unit": "GH",
-                        "temp_max": 0,
-                        "temp_num": len(self.backend.boards),
-                        "total rate": round(
-                            sum(
-                                [
-                                    float(b.hashrate.into(self.hash_unit))
-                                    for b in self.backend.boards
-                                ]
-                            ),
-                            2,
+                        "temp_max": round(
+                            max((b.chip_temp for b in boards), default=0)
                         ),
-                        "total_acn": sum([b.chips for b in self.backend.boards]),
+                        "temp_num": len(boards),
+                        "total rate": self._rate("5s"),
+                        "total_acn": sum([b.chips for b in boards]),
                         "total_freqavg": 545,
                         "total_rateideal": round(
                             sum(
                                 [
                                     float(b.info.ideal_hashrate.into(self.hash_unit))
-                                    for b in self.backend.boards
+                                    for b in boards
                                 ]
                             ),
                             2,
@@ -296,63 +359,40 @@ class AntminerRPCHandler:
         }
 
     def summary(self):
+        counters = self.backend.counters()
         return {
             "code": 11,
             "msg": "Summary",
             "result": {
                 "SUMMARY": [
                     {
-                        "Accepted": 1000,
-                        "Best Share": 1000000000,
-                        "Device Hardware%": 1.0,
-                        "Device Rejected%": 0.0,
-                        "Difficulty Accepted": 1000000000.0,
-                        "Difficulty Rejected": 1000000.0,
-                        "Difficulty Stale": 0.0,
+                        "Accepted": counters.accepted,
+                        "Best Share": counters.best_share,
+                        "Device Hardware%": counters.hardware_pct,
+                        "Device Rejected%": counters.rejected_pct,
+                        "Difficulty Accepted": counters.difficulty_accepted,
+                        "Difficulty Rejected": counters.difficulty_rejected,
+                        "Difficulty Stale": counters.difficulty_stale,
                         "Discarded": 100000,
                         "Elapsed": self.backend.elapsed,
                         "Found Blocks": 0,
-                        "GHS 30m": round(
-                            sum(
-                                [
-                                    float(b.hashrate.into(self.hash_unit))
-                                    for b in self.backend.boards
-                                ]
-                            ),
-                            2,
-                        ),
-                        "GHS 5s": round(
-                            sum(
-                                [
-                                    float(b.hashrate.into(self.hash_unit))
-                                    for b in self.backend.boards
-                                ]
-                            ),
-                            2,
-                        ),
-                        "GHS av": round(
-                            sum(
-                                [
-                                    float(b.hashrate.into(self.hash_unit))
-                                    for b in self.backend.boards
-                                ]
-                            ),
-                            2,
-                        ),
+                        "GHS 30m": self._rate("30m"),
+                        "GHS 5s": self._rate("5s"),
+                        "GHS av": self._rate("av"),
                         "Get Failures": 3,
                         "Getwork": 9000,
-                        "Hardware Errors": 1,
+                        "Hardware Errors": counters.hardware_errors,
                         "Last getwork": 1000000000,
                         "Local Work": 100000,
                         "Network Blocks": 400,
-                        "Pool Rejected%": 0.0,
-                        "Pool Stale%": 0.0,
-                        "Rejected": 100,
+                        "Pool Rejected%": counters.rejected_pct,
+                        "Pool Stale%": counters.stale_pct,
+                        "Rejected": counters.rejected,
                         "Remote Failures": 0,
-                        "Stale": 10,
-                        "Total MH": 10000000000000.0,
-                        "Utility": 10.00,
-                        "Work Utility": 1000000.00,
+                        "Stale": counters.stale,
+                        "Total MH": counters.total_mh,
+                        "Utility": counters.utility,
+                        "Work Utility": counters.work_utility,
                     }
                 ]
             },
@@ -369,13 +409,14 @@ class AntminerRPCHandler:
                         "BMMiner": "1.0.0",
                         "CompileTime": "Fri Sep 15 14:39:20 CST 2023",
                         "Miner": "uart_trans.1.3",
-                        "Type": f"{self.backend.miner_info.make} {self.backend.miner_info.model}",
+                        "Type": self.backend.miner_info.type,
                     }
                 ]
             },
         }
 
     def new_stats(self):
+        boards = self.backend.boards
         return {
             "msg": "stats",
             "code": 22,
@@ -383,44 +424,20 @@ class AntminerRPCHandler:
                 "STATS": [
                     {
                         "elapsed": self.backend.elapsed,
-                        "rate_5s": round(
-                            sum(
-                                [
-                                    round(float(val.hashrate.into(self.hash_unit)), 2)
-                                    for val in self.backend.boards
-                                ]
-                            ),
-                            2,
-                        ),
-                        "rate_30m": round(
-                            sum(
-                                [
-                                    round(float(val.hashrate.into(self.hash_unit)), 2)
-                                    for val in self.backend.boards
-                                ]
-                            ),
-                            2,
-                        ),
-                        "rate_avg": round(
-                            sum(
-                                [
-                                    round(float(val.hashrate.into(self.hash_unit)), 2)
-                                    for val in self.backend.boards
-                                ]
-                            ),
-                            2,
-                        ),
+                        "rate_5s": self._rate("5s"),
+                        "rate_30m": self._rate("30m"),
+                        "rate_avg": self._rate("av"),
                         "rate_ideal": round(
                             sum(
                                 [
                                     round(float(val.hashrate.into(self.hash_unit)), 2)
-                                    for val in self.backend.boards
+                                    for val in boards
                                 ]
                             ),
                             2,
                         ),
                         "rate_unit": str(self.hash_unit),
-                        "chain_num": len(self.backend.boards),
+                        "chain_num": len(boards),
                         "fan_num": self.backend.miner_info.fan_count,
                         "fan": [fan.rpm for fan in self.backend.fans],
                         "hwp_total": 0.0,
@@ -438,31 +455,25 @@ class AntminerRPCHandler:
                                         2,
                                     )
                                 ),
-                                "rate_real": float(
-                                    round(float(val.hashrate.into(self.hash_unit)), 2)
+                                "rate_real": round(
+                                    float(
+                                        self.backend.board_hashrate_avg(i, "5s").into(
+                                            self.hash_unit
+                                        )
+                                    ),
+                                    2,
                                 ),
                                 "asic_num": val.chips,
-                                "asic": " ".join(
-                                    [
-                                        "".join(["o" * val.chips])[i : i + 3]
-                                        for i in range(0, val.chips, 3)
-                                    ]
-                                ),
-                                "temp_pic": [
-                                    round(val.info.board_temp) for _ in range(4)
-                                ],
-                                "temp_pcb": [
-                                    round(val.info.board_temp) for _ in range(4)
-                                ],
-                                "temp_chip": [
-                                    round(val.info.chip_temp) for _ in range(4)
-                                ],
-                                "hw": 0,
+                                "asic": asic_string(val.chips),
+                                "temp_pic": [round(val.board_temp) for _ in range(4)],
+                                "temp_pcb": [round(val.board_temp) for _ in range(4)],
+                                "temp_chip": [round(val.chip_temp) for _ in range(4)],
+                                "hw": self.backend.counters(i).hardware_errors,
                                 "eeprom_loaded": True,
-                                "sn": f"REALSERIALNUMBER{i}",
+                                "sn": val.serial,
                                 "hwp": 0.0,
                             }
-                            for i, val in enumerate(self.backend.boards)
+                            for i, val in enumerate(boards)
                         ],
                     }
                 ],
@@ -1,28 +1,46 @@
 from __future__ import annotations
 
 import datetime
+import functools
 import json
+import math
 import os
-import random
 import secrets
 import socket
-from typing import Union
+import time
+from typing import Awaitable, Callable, Union
 
 import hypercorn
 from fastapi import APIRouter, HTTPException, FastAPI, Depends
+from fastapi.encoders import jsonable_encoder
 from fastapi.requests import Request
-from fastapi.responses import FileResponse, Response
+from fastapi.responses import FileResponse, JSONResponse, Response
 from fastapi.security import HTTPDigest
 from hypercorn.asyncio import serve
 
 from asic_simulator import log
 from asic_simulator.backend import MinerSimulatorBackend, HashUnit
 from asic_simulator.backend.data import PoolInfo
+from asic_simulator.backend.data.boards import asic_string
+from asic_simulator.limits import AccessLimiter, LimitMiddleware
+from asic_simulator.metrics import (
+    METRICS,
+    UNKNOWN_COMMAND,
+    InFlightMiddleware,
+)
+from asic_simulator.network import NetworkConditions, NetworkMiddleware
+from asic_simulator.replay import Replay
 
 security = HTTPDigest(realm="antMiner Configuration")
 KEY = secrets.token_hex(32)
 
 
+@functools.lru_cache(maxsize=None)
+def _local_address() -> str:
+    # a blocking dns lookup, only done once per process
+    return socket.gethostbyname_ex(socket.gethostname())[-1][-1]
+
+
 async def auth(
     request: Request,
     response: Response,
@@ -51,9 +69,20 @@ async def auth(
 
 
 class AntminerWebHandler:
-    def __init__(self, backend: MinerSimulatorBackend, hr_unit: HashUnit):
+    def __init__(
+        self,
+        backend: MinerSimulatorBackend,
+        hr_unit: HashUnit,
+        replay: Replay = None,
+        network: NetworkConditions = None,
+        limiter: AccessLimiter = None,
+    ):
         self.backend = backend
         self.hr_unit = hr_unit
+        self.replay = replay
+        self.network = network
+        self.limiter = limiter
+        self.host = "0.0.0.0"
         self.router = APIRouter(dependencies=[Depends(auth)])
         self.get_commands = {
             "summary": self.summary,
@@ -97,15 +126,35 @@ class AntminerWebHandler:
             "/cgi-bin/{command}", self.handle_post_command, methods=["POST"]
         )
 
-    async def run(self):
+    async def run(
+        self,
+        host: str = "0.0.0.0",
+        port: int = 80,
+        shutdown_trigger: Callable[[], Awaitable[None]] = None,
+    ):
+        self.host = host
         app = FastAPI()
         app.include_router(self.router)
+        if self.network is not None:
+            app = NetworkMiddleware(app, self.network)
+        if self.limiter is not None:
+            app = LimitMiddleware(app, self.limiter)
         cfg = hypercorn.Config()
-        cfg.bind = "0.0.0.0:80"
+        cfg.bind = f"{host}:{port}"
 
         cfg.loglevel = "ERROR"
 
-        await serve(app, cfg)
+        in_flight = METRICS.in_flight("antminer", "web")
+        await serve(
+            InFlightMiddleware(app, in_flight), cfg, shutdown_trigger=shutdown_trigger
+        )
+
+    @property
+    def ip_address(self) -> str:
+        # miners in a fleet bind their own address, report that one
+        if self.host != "0.0.0.0":
+            return self.host
+        return _local_address()
 
     def html_pages(self, path: str):
         return FileResponse(os.path.join(self.web_dir, path))
@@ -119,23 +168,78 @@ class AntminerWebHandler:
     def translation_files(self, path: str):
         return FileResponse(os.path.join(self.web_dir, "i18n", path))
 
-    async def handle_get_command(self, command: str):
+    async def handle_get_command(self, response: Response, command: str):
+        start = time.perf_counter()
         command = command.replace(".cgi", "")
+        if self.replay is not None:
+            replayed = self.replay.response("web", command)
+            if replayed is not None:
+                log.success("WEB", "%s, replayed", command)
+                return self._respond(response, command, replayed, start)
         if command in self.get_commands:
+            try:
+                result = self.get_commands[command]()
+            except Exception:
+                self._observe_failure(start, command=command)
+                raise
             log.success("WEB", command)
-            return self.get_commands[command]()
+            return self._respond(response, command, result, start)
         log.failure("WEB", command)
+        self._observe_failure(start)
         raise HTTPException(404)
 
-    async def handle_post_command(self, request: Request, command: str):
+    async def handle_post_command(
+        self, request: Request, response: Response, command: str
+    ):
+        body = await request.body()
+        start = time.perf_counter()
         command = command.replace(".cgi", "")
-        req_data = json.loads(await request.body())
         if command in self.post_commands:
+            try:
+                result = self.post_commands[command](**json.loads(body))
+            except (TypeError, ValueError) as e:
+                # a body that isn't a json object, or fields the command doesn't take
+                log.failure("WEB", "%s: %s", command, e)
+                self._observe_failure(start, len(body), command)
+                raise HTTPException(400, str(e))
+            except Exception:
+                self._observe_failure(start, len(body), command)
+                raise
             log.success("WEB", command)
-            return self.post_commands[command](**req_data)
+            return self._respond(response, command, result, start, len(body))
         log.failure("WEB", command)
+        self._observe_failure(start, len(body))
         raise HTTPException(404)
 
+    def _respond(
+        self, response: Response, command: str, result, start: float, bytes_in: int = 0
+    ) -> JSONResponse:
+        # serialize here rather than in fastapi so the size can be recorded,
+        # keeping the headers (session cookie) set by the auth dependency
+        json_response = JSONResponse(jsonable_encoder(result))
+        json_response.raw_headers.extend(response.raw_headers)
+        METRICS.observe(
+            "antminer",
+            "web",
+            command,
+            time.perf_counter() - start,
+            bytes_in=bytes_in,
+            bytes_out=len(json_response.body),
+        )
+        return json_response
+
+    def _observe_failure(
+        self, start: float, bytes_in: int = 0, command: str = UNKNOWN_COMMAND
+    ):
+        METRICS.observe(
+            "antminer",
+            "web",
+            command,
+            time.perf_counter() - start,
+            error=True,
+            bytes_in=bytes_in,
+        )
+
     def blink(self, blink: Union[str, bool]):
         if blink == "true" or blink is True:
             self.backend.light = True
@@ -144,61 +248,42 @@ class AntminerWebHandler:
             self.backend.light = False
             return {"code": "B100"}
 
+    def _rate(self, window: str) -> float:
+        return round(float(self.backend.hashrate_avg(window).into(self.hr_unit)), 2)
+
     def summary(self):
+        boards = self.backend.boards
+        counters = self.backend.counters()
         return {
             "STATUS": {
                 "STATUS": "S",
-                "when": datetime.datetime.now().timestamp(),
+                "when": self.backend.clock.now(),
                 "Msg": "summary",
                 "api_version": "1.0.0",
             },
             "INFO": {
                 "miner_version": "49.0.1.3",
                 "CompileTime": "Fri Sep 15 14:39:20 CST 2023",
-                "type": f"{self.backend.miner_info.make} {self.backend.miner_info.model}",
+                "type": self.backend.miner_info.type,
             },
             "SUMMARY": [
                 {
                     "elapsed": self.backend.elapsed,
-                    "rate_5s": round(
-                        sum(
-                            [
-                                round(float(val.hashrate.into(self.hr_unit)), 2)
-                                for val in self.backend.boards
-                            ]
-                        ),
-                        2,
-                    ),
-                    "rate_30m": round(
-                        sum(
-                            [
-                                round(float(val.hashrate.into(self.hr_unit)), 2)
-                                for val in self.backend.boards
-                            ]
-                        ),
-                        2,
-                    ),
-                    "rate_avg": round(
-                        sum(
-                            [
-                                round(float(val.hashrate.into(self.hr_unit)), 2)
-                                for val in self.backend.boards
-                            ]
-                        ),
-                        2,
-                    ),
+                    "rate_5s": self._rate("5s"),
+                    "rate_30m": self._rate("30m"),
+                    "rate_avg": self._rate("av"),
                     "rate_ideal": round(
                         sum(
                             [
                                 round(float(val.hashrate.into(self.hr_unit)), 2)
-                                for val in self.backend.boards
+                                for val in boards
                             ]
                         ),
                         2,
                     ),
                     "rate_unit": str(self.hr_unit),
-                    "hw_all": 1598,
-                    "bestshare": 10000000000,
+                    "hw_all": counters.hardware_errors,
+                    "bestshare": counters.best_share,
                     "status": [
                         {
                             "type": "rate",
@@ -206,7 +291,7 @@ class AntminerWebHandler:
                             "code": -1,
                             "msg": "Low hashrate",
                         }
-                        if sum([float(b.hashrate) for b in self.backend.boards]) == 0
+                        if sum([float(b.hashrate) for b in boards]) == 0
                         else {"type": "rate", "status": "s", "code": 0, "msg": ""},
                         {
                             "type": "network",
@@ -224,7 +309,14 @@ class AntminerWebHandler:
                         }
                         if any(not f.working for f in self.backend.fans)
                         else {"type": "fans", "status": "s", "code": 0, "msg": ""},
-                        {"type": "temp", "status": "s", "code": 0, "msg": ""},
+                        {
+                            "type": "temp",
+                            "status": "e",
+                            "code": -1,
+                            "msg": "Temperature too high",
+                        }
+                        if self.backend.overheated
+                        else {"type": "temp", "status": "s", "code": 0, "msg": ""},
                     ],
                 }
             ],
@@ -244,8 +336,9 @@ class AntminerWebHandler:
             "api-network": True,
             "api-groups": "A:stats:pools:devs:summary:version",
             "api-allow": "A:0/0,W:*",
-            "bitmain-fan-ctrl": self.backend.miner_info.fan_manual,
-            "bitmain-fan-pwm": str(self.backend.miner_info.fan_speed),
+            "bitmain-fan-ctrl": self.backend.fan_manual,
+            # whole numbers like the firmware's "50", not "50.0"
+            "bitmain-fan-pwm": f"{self.backend.fan_speed:g}",
             "bitmain-use-vil": True,
             "bitmain-freq": "675",
             "bitmain-voltage": "1400",
@@ -260,12 +353,12 @@ class AntminerWebHandler:
 
     def get_system_info(self):
         return {
-            "minertype": f"{self.backend.miner_info.make} {self.backend.miner_info.model}",
+            "minertype": self.backend.miner_info.type,
             "nettype": "DHCP",
             "netdevice": "eth0",
-            "macaddr": self.backend.miner_info.mac,
+            "macaddr": self.backend.mac,
             "hostname": "Antminer",
-            "ipaddress": socket.gethostbyname_ex(socket.gethostname())[-1][-1],
+            "ipaddress": self.ip_address,
             "netmask": "255.255.255.0",
             "gateway": "",
             "dnsservers": "",
@@ -279,8 +372,8 @@ class AntminerWebHandler:
         return {
             "nettype": "DHCP",
             "netdevice": "eth0",
-            "macaddr": self.backend.miner_info.mac,
-            "ipaddress": socket.gethostbyname_ex(socket.gethostname())[-1][-1],
+            "macaddr": self.backend.mac,
+            "ipaddress": self.ip_address,
             "netmask": "255.255.255.0",
             "conf_nettype": "DHCP",
             "conf_hostname": "Antminer",
@@ -294,14 +387,14 @@ class AntminerWebHandler:
         return {
             "STATUS": {
                 "STATUS": "S",
-                "when": datetime.datetime.now().timestamp(),
+                "when": self.backend.clock.now(),
                 "Msg": "rate",
                 "api_version": "1.0.0",
             },
             "INFO": {
                 "miner_version": "49.0.1.3",
                 "CompileTime": "Fri Sep 15 14:39:20 CST 2023",
-                "type": f"{self.backend.miner_info.make} {self.backend.miner_info.model}",
+                "type": self.backend.miner_info.type,
             },
             "RATE": [
                 {
@@ -323,23 +416,24 @@ class AntminerWebHandler:
 
     def miner_type(self):
         return {
-            "miner_type": f"{self.backend.miner_info.make} {self.backend.miner_info.model}",
+            "miner_type": self.backend.miner_info.type,
             "subtype": "AMLCtrl_BHB42601",
             "fw_version": "Fri Sep 15 14:39:20 CST 2023",
         }
 
     def pools(self):
+        counters = self.backend.pool_counters()
         return {
             "STATUS": {
                 "STATUS": "S",
-                "when": datetime.datetime.now().timestamp(),
+                "when": self.backend.clock.now(),
                 "Msg": "pools",
                 "api_version": "1.0.0",
             },
             "INFO": {
                 "miner_version": "49.0.1.3",
                 "CompileTime": "Fri Sep 15 14:39:20 CST 2023",
-                "type": f"{self.backend.miner_info.make} {self.backend.miner_info.model}",
+                "type": self.backend.miner_info.type,
             },
             "POOLS": [
                 {
@@ -349,17 +443,21 @@ class AntminerWebHandler:
                     "status": "Alive" if self.backend.pools[i].active else "Dead",
                     "priority": 0,
                     "getworks": 9000,
-                    "accepted": 10000,
-                    "rejected": 0,
+                    "accepted": counters[i].accepted,
+                    "rejected": counters[i].rejected,
                     "discarded": 100000,
-                    "stale": 0,
-                    "diff": "100K",
-                    "diff1": 0,
-                    "diffa": 1000000000,
-                    "diffr": 1000000,
-                    "diffs": 0,
-                    "lsdiff": 100000,
-                    "lstime": "0:00:02",
+                    "stale": counters[i].stale,
+                    "diff": f"{self.backend.pools[i].difficulty / 1000:g}K",
+                    "diff1": counters[i].diff1_work,
+                    "diffa": counters[i].difficulty_accepted,
+                    "diffr": counters[i].difficulty_rejected,
+                    "diffs": counters[i].difficulty_stale,
+                    "lsdiff": self.backend.pools[i].difficulty,
+                    "lstime": str(
+                        datetime.timedelta(
+                            seconds=round(counters[i].now - counters[i].last_share_time)
+                        )
+                    ),
                 }
                 if len(self.backend.pools) > i
                 else {
@@ -386,53 +484,34 @@ class AntminerWebHandler:
         }
 
     def stats(self):
+        boards = self.backend.boards
+        # jitter changes once a second, the same for every poll within it
+        jitter_step = round(self.backend.clock.now())
         return {
             "STATUS": {
                 "STATUS": "S",
-                "when": datetime.datetime.now().timestamp(),
+                "when": self.backend.clock.now(),
                 "Msg": "stats",
                 "api_version": "1.0.0",
             },
             "INFO": {
                 "miner_version": "49.0.1.3",
                 "CompileTime": "Fri Sep 15 14:39:20 CST 2023",
-                "type": f"{self.backend.miner_info.make} {self.backend.miner_info.model}",
+                "type": self.backend.miner_info.type,
             },
             "STATS": [
                 {
                     "elapsed": self.backend.elapsed,
-                    "rate_5s": round(
-                        sum(
-                            [
-                                round(float(val.hashrate.into(self.hr_unit)), 2)
-                                for val in self.backend.boards
-                            ]
-                        ),
-                        2,
-                    ),
-                    "rate_30m": round(
-                        sum(
-                            [
-                                round(float(val.hashrate.into(self.hr_unit)), 2)
-                                for val in self.backend.boards
-                            ]
-                        ),
-                        2,
-                    ),
-                    "rate_avg": round(
-                        sum(
-                            [
-                                round(float(val.hashrate.into(self.hr_unit)), 2)
-                                for val in self.backend.boards
-                            ]
-                        ),
-                        2,
-                    ),
+                    "rate_5s": self._rate("5s"),
+                    "rate_30m": self._rate("30m"),
+                    "rate_avg": self._rate("av"),
                     "rate_ideal": round(
                         sum(
                             [
                                 round(
-                                    random.uniform(
+                                    self.backend.rng.uniform(
+                                        f"rate_ideal{i}",
+                                        jitter_step,
                                         float(
                                             val.info.ideal_hashrate.into(self.hr_unit)
                                         )
@@ -444,13 +523,13 @@ class AntminerWebHandler:
                                     ),
                                     2,
                                 )
-                                for val in self.backend.boards
+                                for i, val in enumerate(boards)
                             ]
                         ),
                         2,
                     ),
                     "rate_unit": str(self.hr_unit),
-                    "chain_num": len(self.backend.boards),
+                    "chain_num": len(boards),
                     "fan_num": self.backend.miner_info.fan_count,
                     "fan": [fan.rpm for fan in self.backend.fans],
                     "hwp_total": 0.0,
@@ -465,25 +544,25 @@ class AntminerWebHandler:
                                     float(val.info.ideal_hashrate.into(self.hr_unit)), 2
                                 )
                             ),
-                            "rate_real": float(
-                                round(float(val.hashrate.into(self.hr_unit)), 2)
+                            "rate_real": round(
+                                float(
+                                    self.backend.board_hashrate_avg(i, "5s").into(
+                                        self.hr_unit
+                                    )
+                                ),
+                                2,
                             ),
                             "asic_num": val.chips,
-                            "asic": " ".join(
-                                [
-                                    "".join(["o" * val.chips])[i : i + 3]
-                                    for i in range(0, val.chips, 3)
-                                ]
-                            ),
-                            "temp_pic": [round(val.info.board_temp) for _ in range(4)],
-                            "temp_pcb": [round(val.info.board_temp) for _ in range(4)],
-                            "temp_chip": [round(val.info.chip_temp) for _ in range(4)],
-                            "hw": 0,
+                            "asic": asic_string(val.chips),
+                            "temp_pic": [round(val.board_temp) for _ in range(4)],
+                            "temp_pcb": [round(val.board_temp) for _ in range(4)],
+                            "temp_chip": [round(val.chip_temp) for _ in range(4)],
+                            "hw": self.backend.counters(i).hardware_errors,
                             "eeprom_loaded": True,
-                            "sn": f"REALSERIALNUMBER{i}",
+                            "sn": val.serial,
                             "hwp": 0.0,
                         }
-                        for i, val in enumerate(self.backend.boards)
+                        for i, val in enumerate(boards)
                     ],
                 }
             ],
@@ -505,14 +584,15 @@ class AntminerWebHandler:
         pass
 
     def reboot(self):
-        pass
+        self.backend.reboot()
 
     def reset_conf(self):
         pass
 
     def set_miner_conf(self, **config):
+        # everything is read first, a bad field leaves the miner as it was
         try:
-            self.backend.pools = [
+            pools = [
                 PoolInfo(
                     url=""
                     if val["url"] == ""
@@ -523,14 +603,24 @@ class AntminerWebHandler:
                 )
                 for val in config["pools"]
             ]
-            self.backend.miner_info.fan_speed = config["bitmain-fan-pwm"]
-            self.backend.miner_info.fan_manual = config["bitmain-fan-ctrl"]
+            fan_manual = config["bitmain-fan-ctrl"] in (True, "true")
+            fan_speed = float(config["bitmain-fan-pwm"])
+            if not (math.isfinite(fan_speed) and 0 <= fan_speed <= 100):
+                raise ValueError(f"Invalid fan pwm: {fan_speed}")
         except json.JSONDecodeError:
             log.failure("WEB", "set_miner_conf DecodeError")
             return {"stats": "failure", "code": "M100", "msg": "Decode Error."}
         except LookupError:
             log.failure("WEB", "set_miner_conf LookupError")
             return {"stats": "failure", "code": "M100", "msg": "Lookup Error."}
+        except (TypeError, ValueError):
+            log.failure("WEB", "set_miner_conf ValueError")
+            return {"stats": "failure", "code": "M100", "msg": "Value Error."}
+        self.backend.pools = pools
+        self.backend.set_fan_control(manual=fan_manual, speed=fan_speed)
+        if self.backend.overheated:
+            # applying a new config restarts cgminer, and mining with it
+            self.backend.mining = True
         return {"stats": "success", "code": "M000", "msg": "OK!"}
 
     def set_network_conf(self):
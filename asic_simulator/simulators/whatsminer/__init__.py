@@ -1,17 +1,43 @@
 import asyncio
+import functools
+from typing import Awaitable, Callable
 
 from asic_simulator import log
 from asic_simulator.backend import MinerSimulatorBackend
 from asic_simulator.backend.data.hashrate import HashUnit
+from asic_simulator.limits import AccessLimiter
+from asic_simulator.network import NetworkConditions
+from asic_simulator.replay import Replay
 from asic_simulator.simulators.whatsminer.rpc import WhatsminerRPCHandler
 from asic_simulator.simulators.whatsminer.web import WhatsminerWebHandler
 
 
 class WhatsminerSimulator:
-    def __init__(self, backend: MinerSimulatorBackend, hr_unit: HashUnit = HashUnit.MH):
+    PORTS = {"rpc": 4028, "web": 443, "http": 80}
+
+    def __init__(
+        self,
+        backend: MinerSimulatorBackend,
+        hr_unit: HashUnit = HashUnit.MH,
+        replay: Replay = None,
+        network: NetworkConditions = None,
+        limiters: dict[str, AccessLimiter] = None,
+    ):
         self.backend = backend
-        self.rpc = WhatsminerRPCHandler(backend, hr_unit)
-        self.web = WhatsminerWebHandler(backend, hr_unit)
+        self.network = network
+        # by interface, "rpc" and "web"
+        self.limiters = limiters if limiters is not None else {}
+        self.rpc = WhatsminerRPCHandler(
+            backend, hr_unit, replay, network, self.limiters.get("rpc")
+        )
+        self.hr_unit = hr_unit
+
+    @functools.cached_property
+    def web(self) -> WhatsminerWebHandler:
+        # built on first use, rpc only miners never pay for the web app
+        return WhatsminerWebHandler(
+            self.backend, self.hr_unit, self.network, self.limiters.get("web")
+        )
 
     def run(self):
         log.startup(
@@ -19,7 +45,36 @@ class WhatsminerSimulator:
         )
         log.startup("startup complete")
 
-        async def _run():
-            await asyncio.gather(self.rpc.run(), self.web.run())
+        asyncio.run(self.serve())
+
+    async def serve(self, host: str = "0.0.0.0", ports: dict = None):
+        # a lone miner runs its backend's timers, fleets run a shared queue
+        await asyncio.gather(*await self.start(host, ports), self.backend.timers.run())
+
+    async def start(
+        self,
+        host: str = "0.0.0.0",
+        ports: dict = None,
+        rpc_only: bool = False,
+        shutdown_trigger: Callable[[], Awaitable[None]] = None,
+    ) -> list[asyncio.Task]:
+        """Start listening, returning once the RPC server accepts connections.
 
-        asyncio.run(_run())
+        Returns:
+            The tasks serving each interface, cancel them to stop the miner.
+        """
+        ports = {**self.PORTS, **(ports or {})}
+        rpc_server = await self.rpc.start(host, ports["rpc"])
+        tasks = [asyncio.create_task(rpc_server.serve_forever())]
+        if not rpc_only:
+            tasks.append(
+                asyncio.create_task(
+                    self.web.run(
+                        host,
+                        ports["web"],
+                        ports["http"],
+                        shutdown_trigger=shutdown_trigger,
+                    )
+                )
+            )
+        return tasks
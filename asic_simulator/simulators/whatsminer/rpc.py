@@ -1,17 +1,22 @@
 import asyncio
 import base64
 import binascii
-import datetime
+import functools
 import hashlib
 import json
-import secrets
 import re
+import time
+from typing import Callable
 
 from passlib.handlers.md5_crypt import md5_crypt
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 
 from asic_simulator import log
 from asic_simulator.backend import MinerSimulatorBackend, HashUnit
+from asic_simulator.limits import AccessLimiter
+from asic_simulator.metrics import METRICS, UNKNOWN_COMMAND
+from asic_simulator.network import NetworkConditions
+from asic_simulator.replay import Replay
 
 
 def _add_to_16(string: str) -> bytes:
@@ -28,6 +33,9 @@ def _add_to_16(string: str) -> bytes:
     return str.encode(string)  # return bytes
 
 
+# md5_crypt takes around half a millisecond and encrypted commands need several,
+# the inputs only change when a miner's password or salts do
+@functools.lru_cache(maxsize=65536)
 def _crypt(word: str, salt: str) -> str:
     """Encrypts a word with a salt, using a standard salt format.
 
@@ -58,10 +66,19 @@ def _crypt(word: str, salt: str) -> str:
 
 class WhatsminerRPCHandler:
     def __init__(
-        self, backend: MinerSimulatorBackend, hash_unit: HashUnit = HashUnit.MH
+        self,
+        backend: MinerSimulatorBackend,
+        hash_unit: HashUnit = HashUnit.MH,
+        replay: Replay = None,
+        network: NetworkConditions = None,
+        limiter: AccessLimiter = None,
     ):
         self.hash_unit = hash_unit
         self.backend = backend
+        self.replay = replay
+        self.network = network
+        self.limiter = limiter
+        self._in_flight = METRICS.in_flight("whatsminer", "rpc")
         self.commands = {
             "get_token": self.get_token,
             "get_version": self.get_version,
@@ -72,36 +89,82 @@ class WhatsminerRPCHandler:
             "pools": self.pools,
         }
         self.pwd = "admin"
-        self.salt = secrets.token_hex(8)
-        self.newsalt = secrets.token_hex(8)
-        self.salt_time = str(datetime.datetime.now().timestamp())[:-4]
+        self.salt = self.backend.rng.hex("salt", length=8)
+        self.newsalt = self.backend.rng.hex("newsalt", length=8)
+        # the timestamp to two decimals, as read from the miner's clock
+        self.salt_time = f"{self.backend.clock.now():.2f}"
         self.api_ver = "1.4"
 
-    async def run(self):
-        server = await asyncio.start_server(self._handle_client, "0.0.0.0", 4028)
+    async def run(self, host: str = "0.0.0.0", port: int = 4028):
+        server = await self.start(host, port)
         async with server:
             await server.serve_forever()
 
+    async def start(self, host: str = "0.0.0.0", port: int = 4028) -> asyncio.Server:
+        return await asyncio.start_server(self._handle_client, host, port)
+
     async def _handle_client(
         self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
     ):
-        raw_data = await reader.read(1000)
-        str_data = raw_data.decode()
+        limiter = self.limiter
+        if limiter is None:
+            return await self._answer(reader, writer)
+        if not limiter.admit() and not await limiter.wait():
+            await limiter.reject(reader, writer)
+            return
+        handed_off = False
         try:
-            data = json.loads(str_data)
-        except json.JSONDecodeError:
-            writer.write(json.dumps(self._handle_failure()).encode())
+            handed_off = await self._answer(reader, writer, limiter.release)
+        finally:
+            if not handed_off:
+                limiter.release()
+
+    async def _answer(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        done: Callable[[], None] = None,
+    ) -> bool:
+        """Read a request and send its response.
+
+        Returns:
+            Whether the response was left to the network, which calls `done`
+            once it's sent.
+        """
+        with self._in_flight:
+            raw_data = await reader.read(1000)
+            start = time.perf_counter()
+            try:
+                data = json.loads(raw_data.decode())
+            except ValueError:
+                # not utf-8 or not json
+                data = None
+            if not isinstance(data, dict):
+                label, ok, result = UNKNOWN_COMMAND, False, self._handle_failure()
+            else:
+                enc = True if "enc" in data else False
+                command = data.get("command") if not enc else data.get("data")
+                label, ok, result = self._dispatch(command, enc=enc)
+
+            response = json.dumps(result).encode()
+            METRICS.observe(
+                "whatsminer",
+                "rpc",
+                label,
+                time.perf_counter() - start,
+                error=not ok,
+                bytes_in=len(raw_data),
+                bytes_out=len(response),
+            )
+            network = self.network
+            if network is not None and network.profile is not None:
+                # sent on the network's timers, nothing waits for it here
+                network.send(writer, response, done)
+                return True
+            writer.write(response)
             await writer.drain()
             writer.close()
-            return
-
-        enc = True if "enc" in data else False
-        command = data.get("command") if not enc else data.get("data")
-        result = self.handle_command(command, enc=enc)
-
-        writer.write(json.dumps(result).encode())
-        await writer.drain()
-        writer.close()
+            return False
 
     @property
     def md5_pwd(self):
@@ -151,24 +214,52 @@ class WhatsminerRPCHandler:
         return val == self.host_sign
 
     def handle_command(self, command: str, enc: bool = False, **params):
+        return self._dispatch(command, enc, **params)[2]
+
+    def _dispatch(
+        self, command: str, enc: bool = False, **params
+    ) -> tuple[str, bool, dict]:
+        """Answer a command, decrypting it first if needed.
+
+        Returns:
+            The command name to record metrics under, whether it succeeded and
+            the response.
+        """
         if enc:
             try:
                 data = self._decode(command)
-            except UnicodeDecodeError:
+            except (AttributeError, ValueError):
+                # not a string, bad base64 or padding, not utf-8 or not json, the
+                # base64 and json errors are ValueErrors too
+                data = None
+            if not isinstance(data, dict):
                 log.failure("RPC", "encoded parse failed")
-                return self._handle_failure("Invalid data")
+                return UNKNOWN_COMMAND, False, self._handle_failure("Invalid data")
             if not self._check_token(data.get("token")):
                 log.failure("RPC", "token check failed")
-                return self._handle_failure("Invalid token")
+                label = data.get("cmd")
+                if label not in self.commands:
+                    label = UNKNOWN_COMMAND
+                return label, False, self._handle_failure("Invalid token")
             command = data.get("cmd")
 
+        # tokens are per miner, never replayed
+        if self.replay is not None and command != "get_token":
+            response = self.replay.response("rpc", command)
+            if response is not None:
+                log.success("RPC", "%s, replayed", command)
+                return command, True, (self._encode(response) if enc else response)
         if command in self.commands:
             log.success("RPC", command)
             if enc:
-                return self._encode(self._handle_success(command, **params))
-            return self._handle_success(command, **params)
+                return (
+                    command,
+                    True,
+                    self._encode(self._handle_success(command, **params)),
+                )
+            return command, True, self._handle_success(command, **params)
         log.failure("RPC", command)
-        return self._handle_failure()
+        return UNKNOWN_COMMAND, False, self._handle_failure()
 
     def _handle_failure(self, msg: str = "invalid cmd"):
         return {
@@ -178,7 +269,7 @@ class WhatsminerRPCHandler:
                     "Description": f"whatsminer v{self.api_ver}",
                     "Msg": msg,
                     "STATUS": "E",
-                    "When": round(datetime.datetime.now().timestamp()),
+                    "When": round(self.backend.clock.now()),
                 }
             ],
             "id": 1,
@@ -194,7 +285,7 @@ class WhatsminerRPCHandler:
             # whatsminer only, weird format
             return {
                 "STATUS": "S",
-                "When": round(datetime.datetime.now().timestamp()),
+                "When": round(self.backend.clock.now()),
                 "Code": command_res["code"],
                 "Msg": command_res["result"],
                 "Description": f"whatsminer v{self.api_ver}",
@@ -206,7 +297,7 @@ class WhatsminerRPCHandler:
                     "Description": "cgminer 4.9.2",
                     "Msg": command_res["msg"],
                     "STATUS": "S",
-                    "When": round(datetime.datetime.now().timestamp()),
+                    "When": round(self.backend.clock.now()),
                 }
             ],
             **command_res["result"],
@@ -251,11 +342,18 @@ class WhatsminerRPCHandler:
             },
         }
 
+    def _board_rate(self, board: int, window: str) -> float:
+        return round(
+            float(self.backend.board_hashrate_avg(board, window).into(self.hash_unit)),
+            2,
+        )
+
     def devs(self):
-        ts = round(datetime.datetime.now().timestamp())
+        boards = self.backend.boards
+        counters = [self.backend.counters(i) for i in range(len(boards))]
         return {
             "code": 69,
-            "msg": f"{len(self.backend.boards)} ASC(s)",
+            "msg": f"{len(boards)} ASC(s)",
             "result": {
                 "DEVS": [
                     {
@@ -265,7 +363,7 @@ class WhatsminerRPCHandler:
                         "Slot": i,
                         "Enabled": "Y",
                         "Status": "Alive" if not board.hashrate == 0 else "Dead",
-                        "Temperature": board.info.board_temp,
+                        "Temperature": round(board.board_temp, 2),
                         "Chip Frequency": 734,
                         "Fan Speed In": self.backend.fans[0].rpm
                         if len(self.backend.fans) > 0
@@ -273,34 +371,34 @@ class WhatsminerRPCHandler:
                         "Fan Speed Out": self.backend.fans[1].rpm
                         if len(self.backend.fans) > 1
                         else 0,
-                        "MHS av": round(float(board.info.hashrate.into(self.hash_unit)), 2),
-                        "MHS 5s": round(float(board.info.hashrate.into(self.hash_unit)), 2),
-                        "MHS 1m": round(float(board.info.hashrate.into(self.hash_unit)), 2),
-                        "MHS 5m": round(float(board.info.hashrate.into(self.hash_unit)), 2),
-                        "MHS 15m": round(float(board.info.hashrate.into(self.hash_unit)), 2),
-                        "Accepted": 10000,
-                        "Rejected": 100,
-                        "Hardware Errors": 100,
-                        "Utility": 1.00,
-                        "Last Share Pool": 0,
-                        "Last Share Time": ts - 10,
-                        "Total MH": 1000000000000.0,
-                        "Diff1 Work": 1000000,
-                        "Difficulty Accepted": 100000000.0,
-                        "Difficulty Rejected": 100000.0,
-                        "Last Share Difficulty": 100000.0,
-                        "Last Valid Work": ts - 16,
-                        "Device Hardware%": 0.01,
-                        "Device Rejected%": 1.00,
+                        "MHS av": self._board_rate(i, "av"),
+                        "MHS 5s": self._board_rate(i, "5s"),
+                        "MHS 1m": self._board_rate(i, "1m"),
+                        "MHS 5m": self._board_rate(i, "5m"),
+                        "MHS 15m": self._board_rate(i, "15m"),
+                        "Accepted": c.accepted,
+                        "Rejected": c.rejected,
+                        "Hardware Errors": c.hardware_errors,
+                        "Utility": c.utility,
+                        "Last Share Pool": self.backend.active_pool or 0,
+                        "Last Share Time": c.last_share_time,
+                        "Total MH": c.total_mh,
+                        "Diff1 Work": c.diff1_work,
+                        "Difficulty Accepted": c.difficulty_accepted,
+                        "Difficulty Rejected": c.difficulty_rejected,
+                        "Last Share Difficulty": float(c.difficulty),
+                        "Last Valid Work": c.last_share_time - 1,
+                        "Device Hardware%": c.hardware_pct,
+                        "Device Rejected%": c.rejected_pct,
                         "Device Elapsed": self.backend.elapsed,
                         "Upfreq Complete": 1,
                         "Effective Chips": board.chips,
-                        "PCB SN": f"FAKE12AB34CD56EF78{i}",
-                        "Chip Temp Min": board.info.chip_temp,
-                        "Chip Temp Max": board.info.chip_temp,
-                        "Chip Temp Avg": board.info.chip_temp,
+                        "PCB SN": board.serial,
+                        "Chip Temp Min": round(board.chip_temp, 2),
+                        "Chip Temp Max": round(board.chip_temp, 2),
+                        "Chip Temp Avg": round(board.chip_temp, 2),
                     }
-                    for i, board in enumerate(self.backend.boards)
+                    for i, (board, c) in enumerate(zip(boards, counters))
                 ]
             },
         }
@@ -317,7 +415,7 @@ class WhatsminerRPCHandler:
         }
 
     def pools(self):
-        ts = round(datetime.datetime.now().timestamp())
+        ts = round(self.backend.clock.now())
         return {
             "code": 69,
             "msg": f"{len(self.backend.pools)} Pool(s)",
@@ -331,37 +429,39 @@ class WhatsminerRPCHandler:
                         "Quota": 1,
                         "Long Poll": "N",
                         "Getworks": 9000,
-                        "Accepted": 10000,
-                        "Rejected": 100,
-                        "Works": 1000000000,
+                        "Accepted": c.accepted,
+                        "Rejected": c.rejected,
+                        "Works": c.diff1_work,
                         "Discarded": 100000,
-                        "Stale": 0,
+                        "Stale": c.stale,
                         "Get Failures": 3,
                         "Remote Failures": 0,
                         "User": p.user,
-                        "Last Share Time": ts - 2,
-                        "Diff1 Shares": 0,
+                        "Last Share Time": c.last_share_time,
+                        "Diff1 Shares": c.diff1_work,
                         "Proxy Type": "",
                         "Proxy": "",
-                        "Difficulty Accepted": 1000000000.0,
-                        "Difficulty Rejected": 1000000.0,
-                        "Difficulty Stale": 0.0,
-                        "Last Share Difficulty": 100000.0,
+                        "Difficulty Accepted": c.difficulty_accepted,
+                        "Difficulty Rejected": c.difficulty_rejected,
+                        "Difficulty Stale": c.difficulty_stale,
+                        "Last Share Difficulty": float(p.difficulty),
                         "Work Difficulty": 0.0,
                         "Has Stratum": True,
-                        "Stratum Active": True,
+                        "Stratum Active": self.backend.stratum_active(i),
                         "Stratum URL": p.url,
-                        "Stratum Difficulty": 100000.0,
+                        "Stratum Difficulty": float(p.difficulty),
                         "Has GBT": False,
-                        "Best Share": 10000000000,
-                        "Pool Rejected%": 0.0,
-                        "Pool Stale%": 0.0,
+                        "Best Share": c.best_share,
+                        "Pool Rejected%": c.rejected_pct,
+                        "Pool Stale%": c.stale_pct,
                         "Bad Work": 0,
                         "Current Block Height": (ts - int("29AB5F49", 16))
                         // 1200,  # approx
                         "Current Block Version": 536870912,
                     }
-                    for i, p in enumerate(self.backend.pools)
+                    for i, (p, c) in enumerate(
+                        zip(self.backend.pools, self.backend.pool_counters())
+                    )
                 ]
             },
         }
@@ -1,4 +1,5 @@
 import os
+from typing import Awaitable, Callable
 
 import hypercorn
 from fastapi import FastAPI, APIRouter
@@ -7,11 +8,22 @@ from fastapi.responses import FileResponse
 from hypercorn.asyncio import serve
 
 from asic_simulator.backend import MinerSimulatorBackend, HashUnit
+from asic_simulator.limits import AccessLimiter, LimitMiddleware
+from asic_simulator.metrics import METRICS, InFlightMiddleware
+from asic_simulator.network import NetworkConditions, NetworkMiddleware
 from asic_simulator.settings import SSL_PUBLIC_KEY, SSL_PRIVATE_KEY
 
 
 class WhatsminerWebHandler:
-    def __init__(self, backend: MinerSimulatorBackend = None, hr_unit: HashUnit = None):
+    def __init__(
+        self,
+        backend: MinerSimulatorBackend = None,
+        hr_unit: HashUnit = None,
+        network: NetworkConditions = None,
+        limiter: AccessLimiter = None,
+    ):
+        self.network = network
+        self.limiter = limiter
         self.web_dir = os.path.join(os.path.dirname(__file__), "web_files")
         self.router = APIRouter()
         self.router.add_api_route(
@@ -28,19 +40,32 @@ class WhatsminerWebHandler:
             os.path.join(self.web_dir, "luci-static", *os.path.split(path))
         )
 
-    async def run(self):
+    async def run(
+        self,
+        host: str = "0.0.0.0",
+        port: int = 443,
+        insecure_port: int = 80,
+        shutdown_trigger: Callable[[], Awaitable[None]] = None,
+    ):
         app = FastAPI()
         app.add_middleware(HTTPSRedirectMiddleware)
         app.include_router(self.router)
+        if self.network is not None:
+            app = NetworkMiddleware(app, self.network)
+        if self.limiter is not None:
+            app = LimitMiddleware(app, self.limiter)
 
         cfg = hypercorn.Config()
-        cfg.bind = "0.0.0.0:443"
-        cfg.insecure_bind = "0.0.0.0:80"
+        cfg.bind = f"{host}:{port}"
+        cfg.insecure_bind = f"{host}:{insecure_port}"
         cfg.keyfile = SSL_PRIVATE_KEY
         cfg.certfile = SSL_PUBLIC_KEY
         cfg.loglevel = "ERROR"
 
-        await serve(app, cfg)
+        in_flight = METRICS.in_flight("whatsminer", "web")
+        await serve(
+            InFlightMiddleware(app, in_flight), cfg, shutdown_trigger=shutdown_trigger
+        )
 
 
 if __name__ == "__main__":
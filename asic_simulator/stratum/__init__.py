@@ -0,0 +1,72 @@
+"""Stratum V1, the protocol miners use to get work from pools and submit shares.
+
+Messages are JSON-RPC objects, one per line, in both directions:
+
+    -> {"id": 1, "method": "mining.subscribe", "params": ["bmminer/1.0.0"]}
+    <- {"id": 1, "result": [[["mining.notify", "ae6812eb"]], "08000002", 4], "error": null}
+    -> {"id": 2, "method": "mining.authorize", "params": ["worker.1", "x"]}
+    <- {"id": 2, "result": true, "error": null}
+    <- {"id": null, "method": "mining.set_difficulty", "params": [65536]}
+    <- {"id": null, "method": "mining.notify", "params": [job_id, prevhash, ...]}
+    -> {"id": 3, "method": "mining.submit", "params": ["worker.1", job_id, extranonce2, ntime, nonce]}
+    <- {"id": 3, "result": true, "error": null}
+
+Errors are [code, message, traceback] with the codes below.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+
+from asic_simulator import log
+
+ERROR_OTHER = 20
+ERROR_JOB_NOT_FOUND = 21
+ERROR_DUPLICATE_SHARE = 22
+ERROR_LOW_DIFFICULTY = 23
+ERROR_UNAUTHORIZED = 24
+ERROR_NOT_SUBSCRIBED = 25
+
+# longer lines are garbage, not a message still arriving
+MAX_LINE = 16384
+
+
+def encode(message: dict) -> bytes:
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+
+class LineProtocol(asyncio.Protocol):
+    """Splits the stream into messages, one JSON object per line."""
+
+    def __init__(self):
+        self.transport: asyncio.Transport | None = None
+        self._buffer = b""
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+
+    def data_received(self, data: bytes):
+        self._buffer += data
+        if b"\n" not in data:
+            if len(self._buffer) > MAX_LINE:
+                log.failure("STRATUM", "line too long, closing the connection")
+                self.transport.close()
+            return
+        *lines, self._buffer = self._buffer.split(b"\n")
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                message = json.loads(line)
+            except ValueError:
+                log.failure("STRATUM", "invalid message: %r", line[:200])
+                continue
+            if isinstance(message, dict):
+                self.message_received(message)
+
+    def message_received(self, message: dict):
+        raise NotImplementedError
+
+    def send(self, message: dict):
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.write(encode(message))
@@ -0,0 +1,407 @@
+"""Stratum V1 sessions of simulated miners with their pools.
+
+A miner with stratum enabled keeps a connection to its active pool like real
+firmware does: it subscribes, authorizes, follows the jobs and difficulty the
+pool sends and submits shares at the rate its boards hash at that
+difficulty.  The pool's answers are counted in the backend's `pool_shares`,
+which the pools and summary responses report instead of counts derived from
+the hashrate.
+
+Sessions are plain protocols and share submissions are timers on a
+`TimerQueue`, so one process holds thousands of them without a task per
+miner.  Nothing is hashed, nonces are random and it's up to the pool what to
+accept.
+"""
+from __future__ import annotations
+
+import asyncio
+import errno
+import time
+
+from asic_simulator import log
+from asic_simulator.backend.data import (
+    CHANGE_LIGHT,
+    CHANGE_POOLS,
+    CHANGE_REBOOT,
+    MinerSimulatorBackend,
+    PoolInfo,
+)
+from asic_simulator.backend.data.counters import DIFF1_HASHES, SubmittedShares
+from asic_simulator.metrics import METRICS, Histogram, Metrics
+from asic_simulator.stratum import ERROR_JOB_NOT_FOUND, LineProtocol
+from asic_simulator.timers import TimerHandle, TimerQueue
+
+USER_AGENTS = {"antminer": "bmminer/1.0.0", "whatsminer": "cgminer/4.9.2"}
+USER_AGENT = "cgminer/4.9.2"
+
+# seconds between reconnection attempts, doubling up to the max
+RETRY_MIN = 1.0
+RETRY_MAX = 60.0
+
+# can't connect from the miner's own address, e.g. loopback to a remote pool
+_BIND_ERRORS = (errno.EADDRNOTAVAIL, errno.EINVAL, errno.ENETUNREACH)
+
+
+class ClientStats:
+    """Totals over every stratum session of the process."""
+
+    def __init__(self, metrics: Metrics = METRICS):
+        self.sessions = 0
+        self.submitted = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.stale = 0
+        # seconds from submitting a share to the pool's answer
+        self.latency = Histogram()
+        metrics.add_collector(self.collect)
+
+    def collect(self) -> list[str]:
+        shares = "asic_simulator_stratum_shares_total"
+        latency = "asic_simulator_stratum_submit_duration_seconds"
+        return [
+            "# HELP asic_simulator_stratum_sessions Authorized stratum sessions.",
+            "# TYPE asic_simulator_stratum_sessions gauge",
+            f"asic_simulator_stratum_sessions {self.sessions}",
+            f"# HELP {shares} Shares submitted to pools, by the pool's answer.",
+            f"# TYPE {shares} counter",
+            f'{shares}{{result="accepted"}} {self.accepted}',
+            f'{shares}{{result="rejected"}} {self.rejected}',
+            f'{shares}{{result="stale"}} {self.stale}',
+            f'{shares}{{result="pending"}} '
+            f"{self.submitted - self.accepted - self.rejected - self.stale}",
+            f"# HELP {latency} Time for the pool to answer a share.",
+            f"# TYPE {latency} histogram",
+            *self.latency.render(latency),
+        ]
+
+
+CLIENT_STATS = ClientStats()
+
+
+class _Connection(LineProtocol):
+    """One connection to a pool, a client opens a new one every time."""
+
+    def __init__(self, client: StratumClient):
+        super().__init__()
+        self.client = client
+
+    def connection_made(self, transport: asyncio.Transport):
+        super().connection_made(transport)
+        self.client._connected(self)
+
+    def message_received(self, message: dict):
+        self.client._message(self, message)
+
+    def connection_lost(self, exc: Exception | None):
+        self.client._lost(self, exc)
+
+
+class StratumClient:
+    """The stratum session of one miner, following its active pool.
+
+    Parameters:
+        backend: The miner, whose active pool and hashrate drive the session.
+        timers: Where share submissions and reconnections are scheduled, the
+            caller runs it.
+        source: The miner's address, connections are made from it so the pool
+            sees every miner separately.  Dropped if it can't reach the pool.
+        user_agent: Sent when subscribing.
+    """
+
+    def __init__(
+        self,
+        backend: MinerSimulatorBackend,
+        timers: TimerQueue,
+        source: str = None,
+        user_agent: str = USER_AGENT,
+        stats: ClientStats = CLIENT_STATS,
+    ):
+        self.backend = backend
+        self.timers = timers
+        self.source = source
+        self.user_agent = user_agent
+        self.stats = stats
+        # index and settings of the pool connected or being connected to
+        self.pool: int | None = None
+        self._pool_conf: tuple | None = None
+        self.authorized = False
+        self.extranonce1 = ""
+        self.extranonce2_size = 4
+        self.difficulty: float | None = None
+        # params of the last mining.notify
+        self.job: list | None = None
+        self._running = False
+        self._connection: _Connection | None = None
+        self._opening: asyncio.Task | None = None
+        self._retry: TimerHandle | None = None
+        self._share: TimerHandle | None = None
+        self._unsubscribe = None
+        self._failures = 0
+        self._next_id = 1
+        # id -> (method, pool, difficulty, sent)
+        self._requests: dict[int, tuple] = {}
+        # counters of the random draws
+        self._shares = 0
+        self._extranonce2 = 0
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        if self.backend.pool_shares is None:
+            self.backend.pool_shares = {}
+        self._unsubscribe = self.backend.subscribe(self._changed)
+        self._connect()
+
+    def stop(self):
+        """Close the session, the miner's counters go back to being derived."""
+        if not self._running:
+            return
+        self._running = False
+        if self._unsubscribe is not None:
+            self._unsubscribe()
+            self._unsubscribe = None
+        self._disconnect()
+        self.backend.pool_shares = None
+
+    def _connect(self):
+        self._retry = None
+        pool = self.backend.active_pool
+        if not self._running or pool is None:
+            # a change of pools connects again
+            self.pool = self._pool_conf = None
+            return
+        info = self.backend.pools[pool]
+        self.pool = pool
+        self._pool_conf = _pool_conf(info)
+        self._opening = asyncio.ensure_future(self._open(info))
+
+    async def _open(self, pool: PoolInfo):
+        loop = asyncio.get_running_loop()
+        local_addr = (self.source, 0) if self.source is not None else None
+        try:
+            await loop.create_connection(
+                lambda: _Connection(self), pool.url, pool.port, local_addr=local_addr
+            )
+        except OSError as e:
+            if local_addr is not None and e.errno in _BIND_ERRORS:
+                self.source = None
+                self._opening = None
+                self._connect()
+                return
+            log.failure(
+                "STRATUM",
+                "%s can't connect to %s: %s",
+                self.backend.miner_id,
+                pool.full_url,
+                e,
+            )
+            self._retry_later()
+        finally:
+            if self._opening is asyncio.current_task():
+                self._opening = None
+
+    def _retry_later(self):
+        delay = min(RETRY_MAX, RETRY_MIN * 2**self._failures)
+        # spread out a fleet reconnecting to a pool that came back
+        delay *= self.backend.rng.uniform("stratum_retry", self._failures, 0.5, 1.5)
+        self._failures += 1
+        self._retry = self.timers.call_later(delay, self._connect)
+
+    def _disconnect(self):
+        for handle in (self._retry, self._share):
+            if handle is not None:
+                handle.cancel()
+        self._retry = self._share = None
+        if self._opening is not None:
+            self._opening.cancel()
+            self._opening = None
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            connection.transport.close()
+            self._session_ended()
+
+    def _reconnect(self):
+        self._disconnect()
+        self._failures = 0
+        self._connect()
+
+    def _session_ended(self):
+        if self.authorized:
+            self.stats.sessions -= 1
+            self.backend.stratum_pool = None
+        self.authorized = False
+        self.job = None
+        self.difficulty = None
+        self._requests = {}
+
+    def _connected(self, connection: _Connection):
+        if not self._running:
+            connection.transport.close()
+            return
+        self._connection = connection
+        self._request("mining.subscribe", [self.user_agent])
+
+    def _lost(self, connection: _Connection, exc: Exception | None):
+        if connection is not self._connection:
+            # closed on purpose
+            return
+        self._connection = None
+        if self._share is not None:
+            self._share.cancel()
+            self._share = None
+        self._session_ended()
+        log.failure(
+            "STRATUM",
+            "%s lost its pool connection: %s",
+            self.backend.miner_id,
+            exc or "closed by the pool",
+        )
+        self._retry_later()
+
+    def _request(self, method: str, params: list, *context):
+        request_id = self._next_id
+        self._next_id += 1
+        self._requests[request_id] = (method, *context)
+        self._connection.send({"id": request_id, "method": method, "params": params})
+
+    def _message(self, connection: _Connection, message: dict):
+        if connection is not self._connection:
+            return
+        method = message.get("method")
+        if method is not None:
+            self._notification(method, message.get("params") or [], message.get("id"))
+            return
+        request = self._requests.pop(message.get("id"), None)
+        if request is None:
+            return
+        method, *context = request
+        result, error = message.get("result"), message.get("error")
+        if method == "mining.subscribe":
+            if error is not None or not isinstance(result, list) or len(result) < 3:
+                self._refused("subscribe", error)
+                return
+            self.extranonce1, self.extranonce2_size = result[1], int(result[2])
+            pool = self.backend.pools[self.pool]
+            self._request("mining.authorize", [pool.user, pool.pwd])
+        elif method == "mining.authorize":
+            if error is not None or result is not True:
+                self._refused("authorize", error)
+                return
+            self.authorized = True
+            self.backend.stratum_pool = self.pool
+            self._failures = 0
+            self.stats.sessions += 1
+            self._schedule_share()
+        elif method == "mining.submit":
+            self._answered(result, error, *context)
+
+    def _refused(self, what: str, error):
+        log.failure(
+            "STRATUM",
+            "%s pool refused to %s: %s",
+            self.backend.miner_id,
+            what,
+            error,
+        )
+        # the connection is lost with a retry, like any other failure
+        self._connection.transport.close()
+
+    def _notification(self, method: str, params: list, request_id):
+        if method == "mining.notify" and len(params) >= 9:
+            self.job = params
+        elif method == "mining.set_difficulty" and params:
+            self.difficulty = float(params[0])
+            # shows as the pool's difficulty in the pools responses
+            self.backend.pools[self.pool].difficulty = self.difficulty
+            self._schedule_share()
+        elif method == "mining.set_extranonce" and len(params) >= 2:
+            self.extranonce1, self.extranonce2_size = params[0], int(params[1])
+        elif method == "client.reconnect":
+            # to the configured pool, not wherever the pool points to
+            self._reconnect()
+        elif method == "client.get_version" and request_id is not None:
+            self._connection.send(
+                {"id": request_id, "result": self.user_agent, "error": None}
+            )
+
+    def _changed(self, backend: MinerSimulatorBackend, change: str):
+        if change == CHANGE_LIGHT:
+            return
+        if change == CHANGE_REBOOT:
+            # the connection doesn't survive a reboot
+            self._reconnect()
+        elif change == CHANGE_POOLS:
+            pool = backend.active_pool
+            conf = None if pool is None else _pool_conf(backend.pools[pool])
+            if pool != self.pool or conf != self._pool_conf:
+                self._reconnect()
+        elif self.authorized:
+            # anything else may change the hashrate, shares are memoryless so
+            # drawing the next one again is exact
+            self._schedule_share()
+
+    def _schedule_share(self):
+        if not self.authorized:
+            return
+        # may shut down an overheating miner, and reschedule on the way
+        hashrate = self.backend.current_hashrate()
+        if self._share is not None:
+            self._share.cancel()
+            self._share = None
+        if hashrate <= 0:
+            return
+        difficulty = self.difficulty or self.backend.pools[self.pool].difficulty
+        rate = hashrate / (DIFF1_HASHES * difficulty)
+        delay = self.backend.rng.expovariate("stratum_share", self._shares, rate)
+        self._shares += 1
+        self._share = self.timers.call_later(delay, self._submit)
+
+    def _submit(self):
+        self._share = None
+        if self.job is not None and self._connection is not None:
+            pool = self.backend.pools[self.pool]
+            mask = (1 << (8 * self.extranonce2_size)) - 1
+            extranonce2 = self._extranonce2 & mask
+            self._extranonce2 += 1
+            nonce = self.backend.rng.bits("stratum_nonce", self._shares) & 0xFFFFFFFF
+            self._request(
+                "mining.submit",
+                [
+                    pool.user,
+                    self.job[0],
+                    f"{extranonce2:0{2 * self.extranonce2_size}x}",
+                    self.job[7],
+                    f"{nonce:08x}",
+                ],
+                self.pool,
+                self.difficulty or pool.difficulty,
+                time.perf_counter(),
+            )
+            self.stats.submitted += 1
+        self._schedule_share()
+
+    def _answered(self, result, error, pool: int, difficulty: float, sent: float):
+        self.stats.latency.observe(time.perf_counter() - sent)
+        if self.backend.pool_shares is None:
+            return
+        shares = self.backend.pool_shares.get(pool)
+        if shares is None:
+            shares = self.backend.pool_shares[pool] = SubmittedShares()
+        if result is True and error is None:
+            shares.accepted += 1
+            shares.difficulty_accepted += difficulty
+            shares.last_share_time = self.backend.clock.now()
+            self.stats.accepted += 1
+        elif isinstance(error, list) and error and error[0] == ERROR_JOB_NOT_FOUND:
+            shares.stale += 1
+            shares.difficulty_stale += difficulty
+            self.stats.stale += 1
+        else:
+            shares.rejected += 1
+            shares.difficulty_rejected += difficulty
+            self.stats.rejected += 1
+
+
+def _pool_conf(pool: PoolInfo) -> tuple:
+    return pool.url, pool.port, pool.user, pool.pwd
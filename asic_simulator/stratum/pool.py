@@ -0,0 +1,490 @@
+"""A local Stratum V1 pool for simulated miners to mine on.
+
+    python -m asic_simulator.stratum.pool --port 3333 --stats-port 3334
+
+Hands out jobs, sets the difficulty, checks that shares are well formed, for
+a current job and not submitted before, and counts them per worker.  Nothing
+is hashed, so a well formed share is accepted unless `reject_rate` says
+otherwise.  The counts are at `GET /stats` on the stats port, or `stats()`
+when running in process, to check them against what the miners report.
+
+Answers to a batch of lines are written at once and jobs are encoded once
+for every connection, so one process takes tens of thousands of shares a
+second.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import dataclasses
+import itertools
+import random
+import re
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+import hypercorn
+from fastapi import APIRouter, FastAPI, HTTPException
+from hypercorn.asyncio import serve
+
+from asic_simulator import log
+from asic_simulator.stratum import (
+    ERROR_DUPLICATE_SHARE,
+    ERROR_JOB_NOT_FOUND,
+    ERROR_LOW_DIFFICULTY,
+    ERROR_NOT_SUBSCRIBED,
+    ERROR_OTHER,
+    ERROR_UNAUTHORIZED,
+    LineProtocol,
+    encode,
+)
+
+EXTRANONCE2_SIZE = 4
+# jobs still accepted after a newer one, unless a block cleared them
+KEEP_JOBS = 3
+# a vardiff retarget needs this many shares since the last one
+RETARGET_SHARES = 8
+
+# a coinbase transaction around the extranonces, never looked at
+COINBASE1 = "0100000001" + "00" * 32 + "ffffffff"
+COINBASE2 = "ffffffff0100f2052a0100000000000000"
+
+_SUBMIT_PARAMS = 5
+_HEX = re.compile("[0-9a-fA-F]*")
+
+
+@dataclass
+class WorkerStats:
+    connections: int = 0
+    accepted: int = 0
+    rejected: int = 0
+    stale: int = 0
+    duplicate: int = 0
+    invalid: int = 0
+    difficulty_accepted: float = 0.0
+    difficulty_rejected: float = 0.0
+    difficulty_stale: float = 0.0
+    last_share_time: float = None
+
+    def add(self, other: WorkerStats):
+        for f in dataclasses.fields(self):
+            if f.name == "last_share_time":
+                if other.last_share_time is not None:
+                    self.last_share_time = max(
+                        self.last_share_time or 0, other.last_share_time
+                    )
+            else:
+                setattr(self, f.name, getattr(self, f.name) + getattr(other, f.name))
+
+
+class _PoolConnection(LineProtocol):
+    def __init__(self, pool: MockPool):
+        super().__init__()
+        self.pool = pool
+        self.extranonce1 = f"{next(pool._extranonces) & 0xFFFFFFFF:08x}"
+        self.subscribed = False
+        self.workers: set[str] = set()
+        self.difficulty = pool.difficulty
+        # shares seen per job, for duplicates
+        self.seen: dict[str, set] = {}
+        self._out: list[bytes] = []
+        # vardiff, shares and when since the last retarget
+        self._retarget_shares = 0
+        self._retarget_time = time.monotonic()
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        self.pool._connections.add(self)
+
+    def connection_lost(self, exc):
+        self.pool._connections.discard(self)
+        for worker in self.workers:
+            self.pool.workers[worker].connections -= 1
+
+    def data_received(self, data: bytes):
+        super().data_received(data)
+        if self._out:
+            self.transport.write(b"".join(self._out))
+            self._out = []
+
+    def reply(self, request_id, result=None, error: list = None):
+        self._out.append(encode({"id": request_id, "result": result, "error": error}))
+
+    def error(self, request_id, code: int, message: str):
+        self.reply(request_id, None, [code, message, None])
+
+    def message_received(self, message: dict):
+        method = message.get("method")
+        request_id = message.get("id")
+        params = message.get("params")
+        if not isinstance(params, list):
+            params = []
+        if method == "mining.submit":
+            self.pool._submit(self, request_id, params)
+        elif method == "mining.subscribe":
+            self.subscribed = True
+            self.reply(
+                request_id,
+                [
+                    [
+                        ["mining.set_difficulty", self.extranonce1],
+                        ["mining.notify", self.extranonce1],
+                    ],
+                    self.extranonce1,
+                    EXTRANONCE2_SIZE,
+                ],
+            )
+        elif method == "mining.authorize":
+            self.pool._authorize(self, request_id, params)
+        elif method in ("mining.extranonce.subscribe", "mining.suggest_difficulty"):
+            self.reply(request_id, True)
+        elif request_id is not None:
+            self.error(request_id, ERROR_OTHER, f"Unknown method {method}")
+
+
+class MockPool:
+    """A Stratum V1 pool that accepts every well formed share.
+
+    Parameters:
+        difficulty: The starting difficulty of every connection.
+        job_interval: Seconds between new jobs.
+        block_interval: Seconds between new blocks, whose jobs clear the
+            older ones, None for never.
+        reject_rate: Fraction of well formed shares rejected as low
+            difficulty anyway.
+        share_interval: Target seconds between a connection's shares for
+            vardiff, None keeps the difficulty fixed.  Shares in flight while
+            it changes are counted at the new difficulty, so keep it off to
+            compare difficulty totals with the miners'.
+        seed: For the rejections.
+    """
+
+    def __init__(
+        self,
+        difficulty: float = 65536,
+        job_interval: float = 30,
+        block_interval: float = 600,
+        reject_rate: float = 0.0,
+        share_interval: float = None,
+        seed: int = None,
+    ):
+        self.difficulty = difficulty
+        self.job_interval = job_interval
+        self.block_interval = block_interval
+        self.reject_rate = reject_rate
+        self.share_interval = share_interval
+        self.workers: dict[str, WorkerStats] = {}
+        # shares submitted for a worker the connection didn't authorize
+        self.unauthorized = 0
+        self.started: float = None
+        self._random = random.Random(seed)
+        self._connections: set[_PoolConnection] = set()
+        self._extranonces = itertools.count(1)
+        self._job_ids = itertools.count(1)
+        # valid job ids, oldest first, and the encoded notify of the last one
+        self._jobs: list[str] = []
+        self._notify: bytes = b""
+        self._last_block = 0.0
+        self._server: asyncio.AbstractServer | None = None
+        self._jobs_task: asyncio.Task | None = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 3333):
+        loop = asyncio.get_running_loop()
+        self.started = time.time()
+        self._new_job(clean=True)
+        self._server = await loop.create_server(
+            lambda: _PoolConnection(self), host, port, backlog=4096
+        )
+        self._jobs_task = asyncio.create_task(self._rotate_jobs())
+        log.startup("mock pool on stratum+tcp://%s:%s", host, port)
+
+    async def stop(self):
+        if self._jobs_task is not None:
+            self._jobs_task.cancel()
+            self._jobs_task = None
+        if self._server is not None:
+            self._server.close()
+            for connection in list(self._connections):
+                connection.transport.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def stats(self) -> dict:
+        total = WorkerStats()
+        for worker in self.workers.values():
+            total.add(worker)
+        elapsed = time.time() - self.started if self.started else 0.0
+        return {
+            "connections": len(self._connections),
+            "workers": len(self.workers),
+            "unauthorized": self.unauthorized,
+            "difficulty": self.difficulty,
+            "job": self._jobs[-1] if self._jobs else None,
+            "elapsed": elapsed,
+            "shares_per_second": (
+                (total.accepted + total.rejected + total.stale) / elapsed
+                if elapsed > 0
+                else 0.0
+            ),
+            **dataclasses.asdict(total),
+        }
+
+    def reset(self):
+        """Zero the share counts, connections stay as they are."""
+        self.workers = {
+            name: WorkerStats(connections=w.connections)
+            for name, w in self.workers.items()
+        }
+        self.unauthorized = 0
+        self.started = time.time()
+
+    async def _rotate_jobs(self):
+        while True:
+            await asyncio.sleep(self.job_interval)
+            now = time.monotonic()
+            clean = (
+                self.block_interval is not None
+                and now - self._last_block >= self.block_interval
+            )
+            self._new_job(clean)
+            for connection in self._connections:
+                if connection.workers:
+                    connection.transport.write(self._notify)
+                if clean:
+                    connection.seen = {}
+                else:
+                    for job in list(connection.seen):
+                        if job not in self._jobs:
+                            del connection.seen[job]
+
+    def _new_job(self, clean: bool):
+        job_id = f"{next(self._job_ids):x}"
+        if clean:
+            self._jobs = []
+            self._last_block = time.monotonic()
+        self._jobs = self._jobs[-(KEEP_JOBS - 1) :] + [job_id]
+        self._notify = encode(
+            {
+                "id": None,
+                "method": "mining.notify",
+                "params": [
+                    job_id,
+                    f"{self._random.getrandbits(256):064x}",
+                    COINBASE1,
+                    COINBASE2,
+                    [],
+                    "20000000",
+                    "1703a30c",
+                    f"{int(time.time()):08x}",
+                    clean,
+                ],
+            }
+        )
+
+    def _set_difficulty(self, connection: _PoolConnection) -> bytes:
+        return encode(
+            {
+                "id": None,
+                "method": "mining.set_difficulty",
+                "params": [connection.difficulty],
+            }
+        )
+
+    def _authorize(self, connection: _PoolConnection, request_id, params: list):
+        if not connection.subscribed:
+            connection.error(request_id, ERROR_NOT_SUBSCRIBED, "Not subscribed")
+            return
+        if not params or not isinstance(params[0], str) or not params[0]:
+            connection.error(request_id, ERROR_UNAUTHORIZED, "Unauthorized worker")
+            return
+        worker = params[0]
+        first = not connection.workers
+        if worker not in connection.workers:
+            connection.workers.add(worker)
+            stats = self.workers.get(worker)
+            if stats is None:
+                stats = self.workers[worker] = WorkerStats()
+            stats.connections += 1
+        connection.reply(request_id, True)
+        if first:
+            connection._out.append(self._set_difficulty(connection))
+            connection._out.append(self._notify)
+
+    def _submit(self, connection: _PoolConnection, request_id, params: list):
+        if len(params) < _SUBMIT_PARAMS or params[0] not in connection.workers:
+            self.unauthorized += 1
+            connection.error(request_id, ERROR_UNAUTHORIZED, "Unauthorized worker")
+            return
+        worker, job_id, extranonce2, ntime, nonce = params[:_SUBMIT_PARAMS]
+        stats = self.workers[worker]
+        difficulty = connection.difficulty
+        if not (
+            _is_hex(extranonce2, 2 * EXTRANONCE2_SIZE)
+            and _is_hex(ntime, 8)
+            and _is_hex(nonce, 8)
+        ):
+            stats.invalid += 1
+            stats.rejected += 1
+            stats.difficulty_rejected += difficulty
+            connection.error(request_id, ERROR_OTHER, "Malformed share")
+            return
+        if job_id not in self._jobs:
+            stats.stale += 1
+            stats.difficulty_stale += difficulty
+            connection.error(request_id, ERROR_JOB_NOT_FOUND, "Job not found")
+            return
+        seen = connection.seen.get(job_id)
+        if seen is None:
+            seen = connection.seen[job_id] = set()
+        share = (extranonce2, ntime, nonce)
+        if share in seen:
+            stats.duplicate += 1
+            stats.rejected += 1
+            stats.difficulty_rejected += difficulty
+            connection.error(request_id, ERROR_DUPLICATE_SHARE, "Duplicate share")
+            return
+        seen.add(share)
+        if self.reject_rate and self._random.random() < self.reject_rate:
+            stats.rejected += 1
+            stats.difficulty_rejected += difficulty
+            connection.error(request_id, ERROR_LOW_DIFFICULTY, "Low difficulty share")
+        else:
+            stats.accepted += 1
+            stats.difficulty_accepted += difficulty
+            stats.last_share_time = time.time()
+            connection.reply(request_id, True)
+        if self.share_interval is not None:
+            self._vardiff(connection)
+
+    def _vardiff(self, connection: _PoolConnection):
+        connection._retarget_shares += 1
+        if connection._retarget_shares < RETARGET_SHARES:
+            return
+        now = time.monotonic()
+        interval = (now - connection._retarget_time) / connection._retarget_shares
+        connection._retarget_shares = 0
+        connection._retarget_time = now
+        if interval <= 0:
+            return
+        # at most 4x either way at a time, so it settles rather than swings
+        factor = min(4.0, max(0.25, self.share_interval / interval))
+        difficulty = max(1.0, round(connection.difficulty * factor))
+        if difficulty != connection.difficulty:
+            connection.difficulty = difficulty
+            connection._out.append(self._set_difficulty(connection))
+
+
+def _is_hex(value, length: int) -> bool:
+    return (
+        isinstance(value, str)
+        and len(value) == length
+        and _HEX.fullmatch(value) is not None
+    )
+
+
+class PoolStatsHandler:
+    """HTTP API with the pool's counts, for tests to check against the miners'."""
+
+    def __init__(self, pool: MockPool):
+        self.pool = pool
+        self.router = APIRouter()
+        self.router.add_api_route("/stats", self.stats, methods=["GET"])
+        self.router.add_api_route("/workers", self.workers, methods=["GET"])
+        self.router.add_api_route("/workers/{name}", self.worker, methods=["GET"])
+        self.router.add_api_route("/reset", self.reset, methods=["POST"])
+
+    async def run(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 3334,
+        shutdown_trigger: Callable[[], Awaitable[None]] = None,
+    ):
+        app = FastAPI()
+        app.include_router(self.router)
+        cfg = hypercorn.Config()
+        cfg.bind = f"{host}:{port}"
+        cfg.loglevel = "ERROR"
+        await serve(app, cfg, shutdown_trigger=shutdown_trigger)
+
+    def stats(self):
+        return self.pool.stats()
+
+    def workers(self):
+        return {
+            name: dataclasses.asdict(stats) for name, stats in self.pool.workers.items()
+        }
+
+    def worker(self, name: str):
+        stats = self.pool.workers.get(name)
+        if stats is None:
+            raise HTTPException(404, f"No worker {name}")
+        return dataclasses.asdict(stats)
+
+    def reset(self):
+        self.pool.reset()
+        return self.pool.stats()
+
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3333)
+    parser.add_argument(
+        "--stats-port", type=int, help="serve the counts over HTTP on this port"
+    )
+    parser.add_argument("--difficulty", type=float, default=65536)
+    parser.add_argument("--job-interval", type=float, default=30)
+    parser.add_argument(
+        "--block-interval",
+        type=float,
+        default=600,
+        help="seconds between jobs that clear the older ones, 0 for never",
+    )
+    parser.add_argument("--reject-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--share-interval",
+        type=float,
+        help="vardiff target seconds between a connection's shares",
+    )
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--loop", choices=("asyncio", "uvloop"), default="asyncio")
+    return parser.parse_args(argv)
+
+
+async def run(args: argparse.Namespace):
+    pool = MockPool(
+        difficulty=args.difficulty,
+        job_interval=args.job_interval,
+        block_interval=args.block_interval or None,
+        reject_rate=args.reject_rate,
+        share_interval=args.share_interval,
+        seed=args.seed,
+    )
+    await pool.start(args.host, args.port)
+    try:
+        if args.stats_port is not None:
+            log.startup("pool stats on http://%s:%s/stats", args.host, args.stats_port)
+            await PoolStatsHandler(pool).run(args.host, args.stats_port)
+        else:
+            await asyncio.Event().wait()
+    finally:
+        await pool.stop()
+
+
+def main(argv: list[str] = None):
+    args = parse_args(argv)
+    if args.loop == "uvloop":
+        try:
+            import uvloop
+        except ImportError:
+            raise SystemExit("uvloop is not installed, use --loop asyncio")
+        uvloop.install()
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
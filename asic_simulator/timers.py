@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+from typing import Any, Callable
+
+from asic_simulator import log
+from asic_simulator.clock import REAL_CLOCK, Clock, ManualClock
+
+
+class TimerHandle:
+    __slots__ = ("when", "seq", "callback", "args", "cancelled")
+
+    def __init__(self, when: float, seq: int, callback: Callable, args: tuple):
+        self.when = when
+        self.seq = seq
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def __lt__(self, other: TimerHandle) -> bool:
+        return (self.when, self.seq) < (other.when, other.seq)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerQueue:
+    """A single heap of timed callbacks, served by one task.
+
+    Scheduling and cancelling are O(log n) and O(1), so millions of pending
+    timers cost one heap entry each rather than one task or loop handle each.
+    Cancelled timers are dropped lazily when they reach the top of the heap.
+    Times are on the queue's clock, real time by default.
+    """
+
+    def __init__(self, clock: Clock = None):
+        self.clock = clock if clock is not None else REAL_CLOCK
+        self._heap: list[TimerHandle] = []
+        self._seq = itertools.count()
+        self._wakeup: asyncio.Event | None = None
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def now(self) -> float:
+        return self.clock.now()
+
+    def call_at(self, when: float, callback: Callable, *args: Any) -> TimerHandle:
+        handle = TimerHandle(when, next(self._seq), callback, args)
+        heapq.heappush(self._heap, handle)
+        if self._wakeup is not None and self._heap[0] is handle:
+            # the new timer is the earliest, the runner has to sleep less
+            self._wakeup.set()
+        return handle
+
+    def call_later(self, delay: float, callback: Callable, *args: Any) -> TimerHandle:
+        return self.call_at(self.now() + delay, callback, *args)
+
+    def run_due(self, now: float = None) -> int:
+        """Run every timer due at or before now.
+
+        Returns:
+            The number of callbacks run.
+        """
+        if now is None:
+            now = self.now()
+        ran = 0
+        while self._heap and self._heap[0].when <= now:
+            handle = heapq.heappop(self._heap)
+            if handle.cancelled:
+                continue
+            try:
+                handle.callback(*handle.args)
+            except Exception as e:
+                # one broken callback mustn't stop every other timer
+                log.failure(
+                    "TIMERS",
+                    "%s failed: %r",
+                    getattr(handle.callback, "__qualname__", handle.callback),
+                    e,
+                )
+            ran += 1
+        return ran
+
+    def advance(self, seconds: float) -> int:
+        """Step a manual clock forward, running the timers due on the way.
+
+        Each timer runs with the clock at its own time, so the events it
+        schedules in the step run too, in order.
+
+        Returns:
+            The number of callbacks run.
+        """
+        clock = self.clock
+        if not isinstance(clock, ManualClock):
+            raise ValueError("Only manual clocks can be stepped")
+        target = clock.now() + seconds
+        ran = 0
+        while True:
+            when = self.next_due()
+            if when is None or when > target:
+                break
+            # overdue timers run now, time never goes backwards
+            clock.set(max(when, clock.now()))
+            ran += self.run_due(when)
+        clock.set(target)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return ran
+
+    def next_due(self) -> float | None:
+        while self._heap and self._heap[0].cancelled:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        return self._heap[0].when
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                self.run_due()
+                self._wakeup.clear()
+                when = self.next_due()
+                timeout = (
+                    None
+                    if when is None
+                    else self.clock.delay(max(0.0, when - self.now()))
+                )
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._wakeup = None
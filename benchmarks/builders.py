@@ -0,0 +1,191 @@
+"""Micro-benchmarks for the response builders, with stored baselines.
+
+Each builder is timed on miners with 1, 3 and 4 boards.  The cases are timed
+in rounds, each running every case once for --min-time, and the median round
+is the time per call, so a slow moment of the machine hits every case a
+little instead of a few cases a lot.  Results are compared against
+`baselines/builders.json` and the run fails if any case got slower than the
+baseline times --threshold:
+
+    python -m benchmarks.builders                  # compare
+    python -m benchmarks.builders --save           # record a new baseline
+    python -m benchmarks.builders -k whatsminer    # only matching cases
+
+Baselines only mean something on the machine they were recorded on, so record
+one before changing code and compare on the same box.  To record one from an
+older checkout, run this file from that checkout:
+
+    cd old-checkout && python /path/to/benchmarks/builders.py --save \
+        --baseline /path/to/benchmarks/baselines/builders.json
+"""
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import json
+import os
+import platform
+import statistics
+import sys
+import timeit
+from typing import Callable
+
+from asic_simulator import log
+from asic_simulator.backend import MINER_INFO, HashUnit
+from asic_simulator.backend.data import MinerSimulatorBackend
+from asic_simulator.simulators.antminer.rpc import AntminerRPCHandler
+from asic_simulator.simulators.antminer.web import AntminerWebHandler
+from asic_simulator.simulators.whatsminer.rpc import WhatsminerRPCHandler
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baselines", "builders.json")
+BOARD_COUNTS = (1, 3, 4)
+
+
+def _backend(vendor: str, model: str, boards: int) -> MinerSimulatorBackend:
+    miner_info = dataclasses.replace(
+        MINER_INFO[vendor]["stock"][model], board_count=boards
+    )
+    try:
+        return MinerSimulatorBackend(miner_info, miner_id=0, seed=0)
+    except TypeError:
+        # checkouts from before per miner seeding, for recording old baselines
+        return MinerSimulatorBackend(miner_info)
+
+
+def _antminer_cases(boards: int) -> dict[str, Callable[[], object]]:
+    rpc = AntminerRPCHandler(_backend("antminer", "S19j", boards))
+    web = AntminerWebHandler(_backend("antminer", "S19j", boards), HashUnit.GH)
+    return {
+        f"antminer.rpc.stats[{boards}]": rpc.stats,
+        f"antminer.rpc.summary[{boards}]": rpc.summary,
+        f"antminer.rpc.new_stats[{boards}]": rpc.new_stats,
+        f"antminer.web.stats[{boards}]": web.stats,
+        f"antminer.web.chart[{boards}]": web.chart,
+        f"antminer.web.pools[{boards}]": web.pools,
+    }
+
+
+def _whatsminer_cases(boards: int) -> dict[str, Callable[[], object]]:
+    whatsminer = WhatsminerRPCHandler(_backend("whatsminer", "M30SVG10", boards))
+    # the same salts on every run and checkout, older ones drew salts too long
+    # for md5_crypt
+    whatsminer.salt = "BQ5hoXV9"
+    whatsminer.newsalt = "jbzkfQls"
+    encoded = whatsminer._encode({"cmd": "devs", "token": whatsminer.host_sign})
+    devs = whatsminer._handle_success("devs")
+    return {
+        f"whatsminer.rpc.devs[{boards}]": whatsminer.devs,
+        f"whatsminer.rpc.pools[{boards}]": whatsminer.pools,
+        f"whatsminer.rpc._encode[{boards}]": lambda: whatsminer._encode(devs),
+        f"whatsminer.rpc._decode[{boards}]": lambda: whatsminer._decode(encoded["enc"]),
+    }
+
+
+def cases() -> dict[str, Callable[[], object]]:
+    """Every benchmark case by name, `<builder>[<boards>]`."""
+    result = {}
+    for boards in BOARD_COUNTS:
+        result.update(_antminer_cases(boards))
+        result.update(_whatsminer_cases(boards))
+    return result
+
+
+def measure(
+    cases: dict[str, Callable[[], object]], rounds: int, min_time: float
+) -> dict[str, float]:
+    """Median time per call of each case in microseconds."""
+    timers = {}
+    for name, fn in cases.items():
+        timer = timeit.Timer(fn)
+        number, elapsed = timer.autorange()
+        # scale up so each round runs for at least min_time
+        number = max(number, int(number * min_time / elapsed) if elapsed else number)
+        timers[name] = (timer, number)
+    samples = {name: [] for name in cases}
+    for _ in range(rounds):
+        for name, (timer, number) in timers.items():
+            samples[name].append(timer.timeit(number) / number * 1e6)
+    return {name: statistics.median(times) for name, times in samples.items()}
+
+
+def machine() -> dict:
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+    }
+
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-k", "--filter", help="only cases containing this text")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save", action="store_true", help="record a new baseline")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=float(os.getenv("BENCHMARK_THRESHOLD", "1.25")),
+        help="fail when slower than baseline times this (default 1.25)",
+    )
+    parser.add_argument("--rounds", type=int, default=11)
+    parser.add_argument("--min-time", type=float, default=0.5)
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] = None):
+    args = parse_args(argv)
+    if hasattr(log, "configure"):
+        log.configure(enabled=False)
+
+    baseline = {}
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        baseline = stored["results"]
+        if stored.get("machine") != machine():
+            print(
+                f"warning: baseline recorded on {stored.get('machine')}, "
+                "comparisons across machines are not meaningful",
+                file=sys.stderr,
+            )
+
+    selected = {
+        name: fn
+        for name, fn in cases().items()
+        if not args.filter or args.filter in name
+    }
+    results = measure(selected, args.rounds, args.min_time)
+    failed = []
+    print(f"{'case':<38}{'us/call':>10}{'baseline':>10}{'ratio':>8}")
+    for name in results:
+        line = f"{name:<38}{results[name]:>10.2f}"
+        if name in baseline:
+            ratio = results[name] / baseline[name]
+            line += f"{baseline[name]:>10.2f}{ratio:>8.2f}"
+            if ratio > args.threshold:
+                failed.append(name)
+                line += "  SLOWER"
+        print(line)
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        if args.filter and os.path.exists(args.baseline):
+            # keep the cases that weren't run
+            with open(args.baseline) as f:
+                results = {**json.load(f)["results"], **results}
+        with open(args.baseline, "w") as f:
+            json.dump({"machine": machine(), "results": results}, f, indent=2)
+            f.write("\n")
+        print(f"baseline written to {args.baseline}")
+    elif failed:
+        print(
+            f"{len(failed)} case(s) slower than {args.threshold}x baseline: "
+            + ", ".join(failed),
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
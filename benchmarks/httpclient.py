@@ -0,0 +1,150 @@
+"""A minimal keep-alive HTTP/1.1 client for the web benchmarks.
+
+Just enough HTTP for the simulator's web servers, with digest auth, and no
+dependencies, so the benchmarks measure the servers and not a client library.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import re
+import ssl as ssl_module
+
+
+class HTTPError(Exception):
+    pass
+
+
+class Response:
+    __slots__ = ("status", "headers", "body")
+
+    def __init__(self, status: int, headers: dict[str, str], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+def insecure_ssl_context() -> ssl_module.SSLContext:
+    # the simulated miners use a self signed certificate, like real ones
+    context = ssl_module.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl_module.CERT_NONE
+    return context
+
+
+class HTTPConnection:
+    def __init__(
+        self, host: str, port: int, ssl: ssl_module.SSLContext = None, timeout=5.0
+    ):
+        self.host = host
+        self.port = port
+        self.ssl = ssl
+        self.timeout = timeout
+        self.cookies: dict[str, str] = {}
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self.ssl), self.timeout
+        )
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        headers: dict[str, str] = None,
+        body: bytes = b"",
+    ) -> Response:
+        if self._writer is None:
+            await self.connect()
+        try:
+            return await asyncio.wait_for(
+                self._request(method, path, headers or {}, body), self.timeout
+            )
+        except BaseException:
+            # the connection is in an unknown state, start over next time
+            self.close()
+            raise
+
+    async def _request(
+        self, method: str, path: str, headers: dict[str, str], body: bytes
+    ) -> Response:
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}"]
+        if self.cookies:
+            cookie = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+            lines.append(f"Cookie: {cookie}")
+        if body:
+            lines.append(f"Content-Length: {len(body)}")
+        lines.extend(f"{k}: {v}" for k, v in headers.items())
+        self._writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+        await self._writer.drain()
+
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise HTTPError("connection closed")
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while (line := await self._reader.readline()) not in (b"\r\n", b"\n", b""):
+            key, _, value = line.decode("latin-1").partition(":")
+            key, value = key.strip().lower(), value.strip()
+            if key == "set-cookie":
+                name, _, rest = value.partition("=")
+                self.cookies[name] = rest.split(";")[0]
+            response_headers[key] = value
+
+        if response_headers.get("transfer-encoding") == "chunked":
+            data = bytearray()
+            while size := int((await self._reader.readline()).split(b";")[0], 16):
+                data += await self._reader.readexactly(size + 2)
+                del data[-2:]
+            await self._reader.readline()
+            response_body = bytes(data)
+        elif "content-length" in response_headers:
+            response_body = await self._reader.readexactly(
+                int(response_headers["content-length"])
+            )
+        else:
+            response_body = await self._reader.read()
+            self.close()
+        if response_headers.get("connection") == "close":
+            self.close()
+        return Response(status, response_headers, response_body)
+
+
+def _md5(value: str) -> str:
+    return hashlib.md5(value.encode()).hexdigest()
+
+
+def digest_authorization(
+    challenge: str, method: str, path: str, username: str, password: str
+) -> str:
+    """Answer a `WWW-Authenticate: Digest ...` challenge (RFC 7616, MD5)."""
+    params = dict(re.findall(r'(\w+)="?([^",]*)"?', challenge))
+    realm, nonce = params["realm"], params["nonce"]
+    ha1 = _md5(f"{username}:{realm}:{password}")
+    ha2 = _md5(f"{method}:{path}")
+    fields = {"username": username, "realm": realm, "nonce": nonce, "uri": path}
+    if "qop" in params:
+        cnonce = os.urandom(8).hex()
+        nc = "00000001"
+        qop = params["qop"].split(",")[0].strip()
+        fields["response"] = _md5(f"{ha1}:{nonce}:{nc}:{cnonce}:{qop}:{ha2}")
+        fields.update(qop=qop, nc=nc, cnonce=cnonce)
+    else:
+        fields["response"] = _md5(f"{ha1}:{nonce}:{ha2}")
+    if "opaque" in params:
+        fields["opaque"] = params["opaque"]
+    if "algorithm" in params:
+        fields["algorithm"] = params["algorithm"]
+    # qop, nc and algorithm are tokens, everything else is quoted
+    unquoted = ("qop", "nc", "algorithm")
+    return "Digest " + ", ".join(
+        f"{k}={v}" if k in unquoted else f'{k}="{v}"' for k, v in fields.items()
+    )
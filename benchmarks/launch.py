@@ -0,0 +1,84 @@
+"""Launch a local fleet for a benchmark to run against."""
+from __future__ import annotations
+
+import ipaddress
+import socket
+import subprocess
+import sys
+import time
+
+
+def addresses(bind: str, count: int) -> list[str]:
+    start = ipaddress.ip_address(bind)
+    return [str(start + i) for i in range(count)]
+
+
+def launch_fleet(
+    vendor: str,
+    model: str,
+    count: int,
+    bind: str,
+    mode: str = "rpc",
+    rpc_port: int = 4028,
+    web_port: int = None,
+    http_port: int = None,
+    workers: int = 1,
+    timeout: float = 120,
+) -> subprocess.Popen:
+    """Start `python -m asic_simulator` and wait until its last miner answers.
+
+    Miners are started in order, so once every port of the last one accepts
+    connections the whole fleet is up.
+    """
+    cmd = [
+        sys.executable,
+        "-m",
+        "asic_simulator",
+        "--vendor",
+        vendor,
+        "--model",
+        model,
+        "--count",
+        str(count),
+        "--bind",
+        bind,
+        "--mode",
+        mode,
+        "--rpc-port",
+        str(rpc_port),
+        "--workers",
+        str(workers),
+        "--log-level",
+        "OFF",
+    ]
+    ports = [rpc_port]
+    if web_port is not None:
+        cmd += ["--web-port", str(web_port)]
+        ports.append(web_port)
+    if http_port is not None:
+        cmd += ["--http-port", str(http_port)]
+        ports.append(http_port)
+    if mode == "rpc":
+        ports = [rpc_port]
+    process = subprocess.Popen(cmd, stderr=subprocess.DEVNULL)
+    last = addresses(bind, count)[-1]
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"fleet exited with code {process.returncode}")
+        try:
+            for port in ports:
+                socket.create_connection((last, port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise TimeoutError(f"fleet not ready after {timeout}s")
+
+
+def stop_fleet(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
@@ -0,0 +1,82 @@
+"""Latency recording and reporting shared by the benchmarks."""
+from __future__ import annotations
+
+import json
+import math
+import sys
+from array import array
+from collections import Counter
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest rank percentile of already sorted values."""
+    if not values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(values)))
+    return values[rank - 1]
+
+
+class Recorder:
+    """Latencies and errors per request name, for one benchmark run."""
+
+    def __init__(self):
+        self.latencies: dict[str, array] = {}
+        self.errors: Counter = Counter()
+        self.reasons: Counter = Counter()
+
+    def record(self, name: str, latency: float, error: str = None):
+        if name not in self.latencies:
+            self.latencies[name] = array("d")
+        self.latencies[name].append(latency)
+        if error is not None:
+            self.errors[name] += 1
+            self.reasons[error] += 1
+
+    def summary(self, elapsed: float) -> list[dict]:
+        rows = []
+        for name in sorted(self.latencies):
+            values = sorted(self.latencies[name])
+            rows.append(
+                {
+                    "name": name,
+                    "requests": len(values),
+                    "errors": self.errors[name],
+                    "error_pct": 100 * self.errors[name] / len(values),
+                    "rps": len(values) / elapsed if elapsed else 0.0,
+                    "p50_ms": percentile(values, 50) * 1000,
+                    "p99_ms": percentile(values, 99) * 1000,
+                    "p999_ms": percentile(values, 99.9) * 1000,
+                    "max_ms": values[-1] * 1000,
+                }
+            )
+        return rows
+
+
+def print_report(
+    recorder: Recorder, elapsed: float, as_json: bool = False, file=sys.stdout
+):
+    rows = recorder.summary(elapsed)
+    if as_json:
+        json.dump(
+            {"elapsed": elapsed, "results": rows, "errors": dict(recorder.reasons)},
+            file,
+            indent=2,
+        )
+        file.write("\n")
+        return
+
+    header = f"{'name':<24}{'requests':>10}{'errors':>8}{'err%':>7}{'req/s':>10}"
+    header += f"{'p50 ms':>9}{'p99 ms':>9}{'p999 ms':>9}{'max ms':>9}"
+    print(header, file=file)
+    total = 0
+    for row in rows:
+        total += row["requests"]
+        print(
+            f"{row['name']:<24}{row['requests']:>10}{row['errors']:>8}"
+            f"{row['error_pct']:>7.2f}{row['rps']:>10.1f}{row['p50_ms']:>9.2f}"
+            f"{row['p99_ms']:>9.2f}{row['p999_ms']:>9.2f}{row['max_ms']:>9.2f}",
+            file=file,
+        )
+    print(f"{total} requests in {elapsed:.1f}s, {total / elapsed:.1f} req/s", file=file)
+    for reason, count in recorder.reasons.most_common():
+        print(f"  {count} x {reason}", file=file)
@@ -0,0 +1,261 @@
+"""Load generator for the simulated cgminer style RPC servers.
+
+Run against miners that are already up, or let it launch a local fleet:
+
+    python -m benchmarks.rpc_load --launch --vendor antminer -n 100 \\
+        --bind 127.0.10.1 --rpc-port 14028 --concurrency 64 --duration 20
+
+Either a fixed number of connections poll back to back (--concurrency), or
+requests are started at a fixed rate (--rate) and latency is counted from when
+each one was due, so a stalled server can't hide its queueing delay.
+
+Commands are taken round robin from --commands.  `new_stats` sends `stats` with
+`new_api`, and an `enc:` prefix sends a Whatsminer command through the
+encrypted token flow, fetching each miner's token once.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import binascii
+import hashlib
+import itertools
+import json
+import sys
+import time
+
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from passlib.handlers.md5_crypt import md5_crypt
+
+from benchmarks.launch import addresses, launch_fleet, stop_fleet
+from benchmarks.report import Recorder, print_report
+
+DEFAULT_COMMANDS = {
+    "antminer": ["stats", "summary", "pools", "devs", "new_stats"],
+    "whatsminer": ["devs", "pools", "devdetails", "get_version", "enc:devs"],
+}
+WHATSMINER_PASSWORD = "admin"
+
+
+class RequestError(Exception):
+    pass
+
+
+async def rpc_request(host: str, port: int, payload: dict, timeout: float) -> dict:
+    async def _request() -> bytes:
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            writer.write(json.dumps(payload).encode())
+            await writer.drain()
+            return await reader.read()
+        finally:
+            writer.close()
+
+    data = await asyncio.wait_for(_request(), timeout)
+    if not data:
+        raise RequestError("empty response")
+    return json.loads(data)
+
+
+def _status_error(response: dict) -> str | None:
+    status = response.get("STATUS")
+    if isinstance(status, list) and status:
+        status = status[0].get("STATUS")
+    if status == "E":
+        return "error status"
+    return None
+
+
+class WhatsminerToken:
+    """The AES key and host signature for one miner, as pyasic derives them."""
+
+    def __init__(self, token_info: dict, password: str = WHATSMINER_PASSWORD):
+        salt, newsalt, salt_time = (
+            token_info["salt"],
+            token_info["newsalt"],
+            token_info["time"],
+        )
+        md5_pwd = md5_crypt.hash(password, salt=salt).split("$")[3]
+        self.host_sign = md5_crypt.hash(md5_pwd + salt_time, salt=newsalt).split("$")[3]
+        key = binascii.unhexlify(hashlib.sha256(md5_pwd.encode()).hexdigest())
+        self.cipher = Cipher(algorithms.AES(key), modes.ECB())
+
+    def encrypt(self, command: str) -> dict:
+        data = json.dumps({"cmd": command, "token": self.host_sign})
+        data += "\0" * (-len(data) % 16)
+        encryptor = self.cipher.encryptor()
+        enc = encryptor.update(data.encode()) + encryptor.finalize()
+        return {"enc": 1, "data": base64.b64encode(enc).decode()}
+
+    def decrypt(self, response: dict) -> dict:
+        decryptor = self.cipher.decryptor()
+        data = decryptor.update(base64.b64decode(response["enc"]))
+        return json.loads((data + decryptor.finalize()).rstrip(b"\0"))
+
+
+class LoadGenerator:
+    def __init__(
+        self,
+        targets: list[tuple[str, int]],
+        commands: list[str],
+        timeout: float = 5.0,
+    ):
+        self.targets = targets
+        self.commands = commands
+        self.timeout = timeout
+        self.recorder = Recorder()
+        self._tokens: dict[tuple[str, int], asyncio.Future] = {}
+        # every command goes to every target in turn
+        self._next = itertools.cycle(itertools.product(targets, commands))
+
+    async def _token(self, target: tuple[str, int]) -> WhatsminerToken:
+        # concurrent requests to a miner share one get_token round trip
+        if target not in self._tokens:
+            self._tokens[target] = asyncio.ensure_future(self._fetch_token(target))
+        try:
+            return await self._tokens[target]
+        except Exception:
+            self._tokens.pop(target, None)
+            raise
+
+    async def _fetch_token(self, target: tuple[str, int]) -> WhatsminerToken:
+        start = time.perf_counter()
+        error = None
+        try:
+            response = await rpc_request(
+                *target, {"command": "get_token"}, self.timeout
+            )
+            return WhatsminerToken(response["Msg"])
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.recorder.record("get_token", time.perf_counter() - start, error=error)
+
+    async def request(self, due: float = None):
+        """Send the next command to the next target.
+
+        Parameters:
+            due: When the request should have started, latency counts from
+                here if given.
+        """
+        target, command = next(self._next)
+        try:
+            if command.startswith("enc:"):
+                token = await self._token(target)
+        except Exception:
+            # already recorded as a failed get_token
+            return
+        start = due if due is not None else time.perf_counter()
+        error = None
+        try:
+            if command.startswith("enc:"):
+                response = await rpc_request(
+                    *target, token.encrypt(command[4:]), self.timeout
+                )
+                if "enc" not in response:
+                    error = "not encrypted"
+                else:
+                    error = _status_error(token.decrypt(response))
+            elif command.startswith("new_"):
+                payload = {"command": command[4:], "new_api": True}
+                error = _status_error(await rpc_request(*target, payload, self.timeout))
+            else:
+                error = _status_error(
+                    await rpc_request(*target, {"command": command}, self.timeout)
+                )
+        except asyncio.TimeoutError:
+            error = "timeout"
+        except (OSError, RequestError, ValueError) as e:
+            error = type(e).__name__
+        self.recorder.record(command, time.perf_counter() - start, error=error)
+
+    async def run_concurrency(self, concurrency: int, duration: float):
+        deadline = time.perf_counter() + duration
+
+        async def _worker():
+            while time.perf_counter() < deadline:
+                await self.request()
+
+        await asyncio.gather(*(_worker() for _ in range(concurrency)))
+
+    async def run_rate(self, rate: float, duration: float, max_in_flight: int):
+        start = time.perf_counter()
+        in_flight = asyncio.Semaphore(max_in_flight)
+        tasks = set()
+
+        async def _request(due: float):
+            async with in_flight:
+                await self.request(due)
+
+        for i in range(int(rate * duration)):
+            due = start + i / rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.create_task(_request(due))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--vendor", choices=DEFAULT_COMMANDS, default="antminer")
+    parser.add_argument("--model", help="model to launch, defaults per vendor")
+    parser.add_argument("-n", "--count", type=int, default=10)
+    parser.add_argument("--bind", default="127.0.10.1")
+    parser.add_argument("--rpc-port", type=int, default=4028)
+    parser.add_argument(
+        "--launch", action="store_true", help="start a local rpc-only fleet first"
+    )
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--commands", help="comma separated, defaults per vendor")
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument("-c", "--concurrency", type=int, default=32)
+    load.add_argument("-r", "--rate", type=float, help="requests per second")
+    parser.add_argument("--max-in-flight", type=int, default=1000)
+    parser.add_argument("-d", "--duration", type=float, default=10)
+    parser.add_argument("--timeout", type=float, default=5)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] = None):
+    args = parse_args(argv)
+    model = args.model or {"antminer": "S19j", "whatsminer": "M30SVG10"}[args.vendor]
+    commands = (
+        args.commands.split(",") if args.commands else DEFAULT_COMMANDS[args.vendor]
+    )
+    targets = [(host, args.rpc_port) for host in addresses(args.bind, args.count)]
+
+    fleet = None
+    if args.launch:
+        fleet = launch_fleet(
+            args.vendor,
+            model,
+            args.count,
+            args.bind,
+            rpc_port=args.rpc_port,
+            workers=args.workers,
+        )
+    try:
+        generator = LoadGenerator(targets, commands, timeout=args.timeout)
+        start = time.perf_counter()
+        if args.rate is not None:
+            run = generator.run_rate(args.rate, args.duration, args.max_in_flight)
+        else:
+            run = generator.run_concurrency(args.concurrency, args.duration)
+        asyncio.run(run)
+        elapsed = time.perf_counter() - start
+    finally:
+        if fleet is not None:
+            stop_fleet(fleet)
+    print_report(generator.recorder, elapsed, as_json=args.json)
+    if generator.recorder.errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""Load generator for the simulated web interfaces.
+
+Antminer: each simulated user logs in through the digest auth handshake, then
+polls the CGI JSON endpoints with its session cookie, fetching a dashboard
+asset every few requests and logging in again on a fresh connection every
+--reauth requests.  Whatsminer: users request the HTTP port, check the redirect
+to HTTPS and load the pages over TLS.
+
+    python -m benchmarks.web_load --launch -n 20 --bind 127.0.20.1 \\
+        --web-port 18080 --concurrency 64 --duration 20
+
+Results are reported separately for auth handshakes, CGI JSON, static files,
+redirects and HTTPS pages (--per-endpoint splits them further).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import sys
+import time
+
+from benchmarks.httpclient import (
+    HTTPConnection,
+    HTTPError,
+    digest_authorization,
+    insecure_ssl_context,
+)
+from benchmarks.launch import addresses, launch_fleet, stop_fleet
+from benchmarks.report import Recorder, print_report
+
+ANTMINER_CGI = [
+    "/cgi-bin/stats.cgi",
+    "/cgi-bin/summary.cgi",
+    "/cgi-bin/pools.cgi",
+    "/cgi-bin/get_miner_conf.cgi",
+]
+ANTMINER_STATIC = [
+    "/index.html",
+    "/js/index.js",
+    "/js/vue.min.js",
+    "/i18n/strings_en.properties",
+]
+WHATSMINER_PAGES = ["/", "/cgi-bin/luci"]
+ERRORS = (OSError, asyncio.TimeoutError, HTTPError, ValueError)
+
+
+class WebLoadGenerator:
+    def __init__(
+        self,
+        hosts: list[str],
+        web_port: int,
+        http_port: int = None,
+        username: str = "root",
+        password: str = "root",
+        static_every: int = 10,
+        reauth: int = 100,
+        per_endpoint: bool = False,
+        timeout: float = 5.0,
+    ):
+        self.hosts = hosts
+        self.web_port = web_port
+        self.http_port = http_port
+        self.username = username
+        self.password = password
+        self.static_every = static_every
+        self.reauth = reauth
+        self.per_endpoint = per_endpoint
+        self.timeout = timeout
+        self.recorder = Recorder()
+        self._hosts = itertools.cycle(hosts)
+        self._ssl = insecure_ssl_context()
+
+    def _name(self, category: str, path: str) -> str:
+        return f"{category} {path}" if self.per_endpoint else category
+
+    async def _timed(self, name: str, request, check=None):
+        start = time.perf_counter()
+        error = None
+        response = None
+        try:
+            response = await request
+            if check is not None:
+                error = check(response)
+        except asyncio.TimeoutError:
+            error = "timeout"
+        except ERRORS as e:
+            error = type(e).__name__
+        self.recorder.record(name, time.perf_counter() - start, error=error)
+        return None if error else response
+
+    async def login(self, connection: HTTPConnection, path: str) -> bool:
+        """The digest handshake: a 401 challenge, then the authorized request."""
+
+        async def _handshake():
+            response = await connection.request("GET", path)
+            if response.status != 401:
+                return response
+            authorization = digest_authorization(
+                response.headers.get("www-authenticate", ""),
+                "GET",
+                path,
+                self.username,
+                self.password,
+            )
+            return await connection.request(
+                "GET", path, headers={"Authorization": authorization}
+            )
+
+        def _check(response) -> str | None:
+            if response.status != 200:
+                return f"login status {response.status}"
+            if not connection.cookies:
+                return "no session cookie"
+            return None
+
+        return await self._timed("auth", _handshake(), _check) is not None
+
+    async def antminer_user(self, deadline: float):
+        while time.perf_counter() < deadline:
+            connection = HTTPConnection(
+                next(self._hosts), self.web_port, timeout=self.timeout
+            )
+            try:
+                if not await self.login(connection, ANTMINER_CGI[0]):
+                    continue
+                for i in range(self.reauth):
+                    if time.perf_counter() >= deadline:
+                        break
+                    if self.static_every and i % self.static_every == 0:
+                        path = ANTMINER_STATIC[i // self.static_every % 4]
+                        await self._timed(
+                            self._name("static", path),
+                            connection.request("GET", path),
+                            _expect_status(200),
+                        )
+                    path = ANTMINER_CGI[i % len(ANTMINER_CGI)]
+                    await self._timed(
+                        self._name("cgi", path),
+                        connection.request("GET", path),
+                        _expect_json,
+                    )
+            finally:
+                connection.close()
+
+    async def whatsminer_user(self, deadline: float):
+        while time.perf_counter() < deadline:
+            host = next(self._hosts)
+            http = HTTPConnection(host, self.http_port, timeout=self.timeout)
+            https = HTTPConnection(
+                host, self.web_port, ssl=self._ssl, timeout=self.timeout
+            )
+            try:
+                for i in range(self.reauth):
+                    if time.perf_counter() >= deadline:
+                        break
+                    path = WHATSMINER_PAGES[i % len(WHATSMINER_PAGES)]
+                    await self._timed(
+                        self._name("redirect", path),
+                        http.request("GET", path),
+                        _expect_https_redirect,
+                    )
+                    await self._timed(
+                        self._name("https", path),
+                        https.request("GET", path),
+                        _expect_status(200),
+                    )
+            finally:
+                http.close()
+                https.close()
+
+    async def run(self, vendor: str, concurrency: int, duration: float):
+        deadline = time.perf_counter() + duration
+        user = self.antminer_user if vendor == "antminer" else self.whatsminer_user
+        await asyncio.gather(*(user(deadline) for _ in range(concurrency)))
+
+
+def _expect_status(status: int):
+    def _check(response) -> str | None:
+        if response.status != status:
+            return f"status {response.status}"
+        return None
+
+    return _check
+
+
+def _expect_json(response) -> str | None:
+    if response.status != 200:
+        return f"status {response.status}"
+    json.loads(response.body)
+    return None
+
+
+def _expect_https_redirect(response) -> str | None:
+    if response.status not in (301, 302, 307, 308):
+        return f"status {response.status}"
+    if not response.headers.get("location", "").startswith("https://"):
+        return "redirect not to https"
+    return None
+
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--vendor", choices=("antminer", "whatsminer"), default="antminer"
+    )
+    parser.add_argument("--model", help="model to launch, defaults per vendor")
+    parser.add_argument("-n", "--count", type=int, default=10)
+    parser.add_argument("--bind", default="127.0.20.1")
+    parser.add_argument("--rpc-port", type=int, default=4028)
+    parser.add_argument(
+        "--web-port", type=int, help="antminer http or whatsminer https port"
+    )
+    parser.add_argument("--http-port", type=int, help="whatsminer http port")
+    parser.add_argument(
+        "--launch", action="store_true", help="start a local full fleet first"
+    )
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("-c", "--concurrency", type=int, default=32)
+    parser.add_argument("-d", "--duration", type=float, default=10)
+    parser.add_argument("--static-every", type=int, default=10)
+    parser.add_argument("--reauth", type=int, default=100)
+    parser.add_argument("--per-endpoint", action="store_true")
+    parser.add_argument("--timeout", type=float, default=5)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] = None):
+    args = parse_args(argv)
+    if args.vendor == "antminer":
+        model = args.model or "S19j"
+        web_port = args.web_port or 80
+        http_port = None
+    else:
+        model = args.model or "M30SVG10"
+        web_port = args.web_port or 443
+        http_port = args.http_port or 80
+
+    fleet = None
+    if args.launch:
+        fleet = launch_fleet(
+            args.vendor,
+            model,
+            args.count,
+            args.bind,
+            mode="full",
+            rpc_port=args.rpc_port,
+            web_port=web_port,
+            http_port=http_port,
+            workers=args.workers,
+        )
+    try:
+        generator = WebLoadGenerator(
+            addresses(args.bind, args.count),
+            web_port,
+            http_port,
+            static_every=args.static_every,
+            reauth=args.reauth,
+            per_endpoint=args.per_endpoint,
+            timeout=args.timeout,
+        )
+        start = time.perf_counter()
+        asyncio.run(generator.run(args.vendor, args.concurrency, args.duration))
+        elapsed = time.perf_counter() - start
+    finally:
+        if fleet is not None:
+            stop_fleet(fleet)
+    print_report(generator.recorder, elapsed, as_json=args.json)
+    if generator.recorder.errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,14 @@
+import sys
+
+from asic_simulator.fleet import Fleet
 from asic_simulator.simulators import MINER_SIMULATORS
 
 if __name__ == "__main__":
-    sim = MINER_SIMULATORS["antminer"]["stock"]["S19j"]
-    # sim = MINER_SIMULATORS["whatsminer"]["stock"]["M30SVG10"]
+    if len(sys.argv) > 1:
+        # run a whole fleet from a manifest, see asic_simulator/fleet/manifest.py
+        Fleet.from_file(sys.argv[1]).run()
+    else:
+        sim = MINER_SIMULATORS["antminer"]["stock"]["S19j"]
+        # sim = MINER_SIMULATORS["whatsminer"]["stock"]["M30SVG10"]
 
-    sim.run()
+        sim.run()